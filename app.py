@@ -2,34 +2,66 @@
 import streamlit as st
 st.set_page_config(page_title="月次入力", layout="wide")
 
+# 重い import / DB準備はログイン画面の裏で先に始める（コールドスタート対策）
+import boot
+boot.start_prewarm()
+
 from auth_guard import auth_guard
 auth_guard()
 
+# 運用向けの画面（再描画プロファイル / メモリ）は ADMIN_USERS だけ
+from auth_core import is_admin
+IS_ADMIN = is_admin(st.session_state.get("auth_user"))
+
+# 再描画プロファイル（PROFILE=1 / 管理者のサイドバーのトグル）: ここから末尾の profiler.end() までを1回分として計測
+import profiler
+profiler.begin(
+    st.session_state.get("auth_user") or "-",
+    profiler.enabled_by_env() or (IS_ADMIN and bool(st.session_state.get("profile_on"))),
+)
+
 import os
 import sys
-import psycopg2
-from psycopg2.extras import execute_values
-import pandas as pd
+import threading
+import time
+import pandas as pd  # 通常は boot の事前準備で import 済み
 import calendar
-from datetime import date, datetime, timedelta
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, time as dtime, timedelta
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
 
 # -----------------------------
 # Path（先に定義）
 # -----------------------------
-TABLE = "records"
+# スキーマ/接続は db_core（psycopg2 は初回接続時に import）
+import db_core
+import ledger_core
+import ledger_snapshot
+import archive_store
+import day_window
+from db_core import (
+    TABLE, TENANT_COL, VER_COL, CLIENT_COLS, COLUMNS,
+    connect as db_connect, default_tenant, init_db, ensure_year_partitions, years_of,
+    ledger_version, bump_ledger_version, record_day_changes,
+)
+# DBに届かなかった書き込みは端末内ジャーナルへ（復帰後にバックグラウンドで再送）
+import journal
+journal.start_replayer()
+# 他プロセス（レプリカ）の書き込みは LISTEN/NOTIFY で受けてそのテナントのキャッシュを捨てる
+import change_feed
+change_feed.start_listener()
+# 集計 / 当月レポ / バックアップはバックグラウンドのスケジューラで先に作る（ジョブは末尾で登録）
+import scheduler
+scheduler.start_scheduler()
+# MEMORY_TRACE=1 の時だけ tracemalloc（メモリ予算の画面で確保の多い行を出す）
+import memory_monitor
+memory_monitor.start_tracing()
 
 # ここにUIは置かない（関数定義がまだ）
 
-# 取引先（売上）
-CLIENT_COLS = ["U", "出", "R", "W", "menu", "しょんぴ", "Afrex", "Afresh", "ハコベル", "pickg", "その他"]
-
-# スキーマ（並び保証）
-COLUMNS = [
-    "日付", "合計売上", "合計h", "frex h", "fresh h", "他 h", "合計時給", "5h+", "警告",
-    *CLIENT_COLS,
-    "メモ"
-]
-
 def ensure_clients_map():
     if "clients_map" not in st.session_state:
         st.session_state["clients_map"] = {c: "" for c in CLIENT_COLS}
@@ -55,9 +87,13 @@ def run_db(label: str, fn: Callable[[], T], default: T | None = None) -> T | Non
     DB処理の共通ラッパー
     - 成功: fn()の結果を返す
     - 失敗: st.error でユーザー向け表示 + st.exception で詳細表示（ログにも出る）して default を返す
+    - ブレーカーが開いている（DB停止中）: 待たずに警告だけ出して default を返す（状態は画面上部に表示）
     """
     try:
         return fn()
+    except db_core.CircuitOpen:
+        st.warning(f"DB停止中のため {label} を行えませんでした（復帰すると自動で戻ります）")
+        return default
     except Exception as e:
         st.error(f"DBエラー: {label} に失敗しました。設定や接続状態を確認してください。")
         st.caption(f"詳細: {type(e).__name__}: {e}")
@@ -66,75 +102,341 @@ def run_db(label: str, fn: Callable[[], T], default: T | None = None) -> T | Non
         return default
 
 # -----------------------------
-# Supabase(Postgres) 固定
-#   - SUPABASE_DB_URL が必須
+# テナント（ドライバー）
+#   - ログイン中ユーザー = テナント（未ログイン/認証なしは default_tenant()）
 # -----------------------------
-def _pg_url() -> str:
-    url = os.getenv("SUPABASE_DB_URL") or st.secrets.get("SUPABASE_DB_URL", "")
-    if not url:
-        raise RuntimeError("SUPABASE_DB_URL が未設定だよ（Railway Variables / ローカルsecrets を確認）")
-    if "sslmode=" not in url:
-        url += ("&" if "?" in url else "?") + "sslmode=require"
-    if "connect_timeout=" not in url:
-        url += ("&" if "?" in url else "?") + "connect_timeout=5"
-    return url
-
-def _pg_connect():
-    return psycopg2.connect(_pg_url())
-
-def init_db():
-    """Postgres にテーブルが無ければ作る（全カラムTEXT / PK=日付）"""
-    col_defs = []
-    for c in COLUMNS:
-        if c == "日付":
-            col_defs.append(f'"{c}" TEXT PRIMARY KEY')
-        else:
-            col_defs.append(f'"{c}" TEXT')
+def current_tenant() -> str:
+    return st.session_state.get("auth_user") or default_tenant()
+
+# -----------------------------
+# 年アーカイブ（締めた年 → 圧縮Parquet）
+#   - ARCHIVE_DIR/<テナント>/<年>.parquet（zstd / ファイル操作は archive_store）
+#   - load_df は DB + アーカイブを合わせたコンパクト台帳を返す（レポは期間ごとに TEXT に戻して読む）
+#   - 削除（一覧 / 月の入れ直し）はアーカイブ側も書き直す。絞り込み / DB検索 / 時点復元 は DB の行だけが対象
+#   - Railway ではボリュームを ARCHIVE_DIR にマウントしておくこと（再デプロイで消えるため）
+# -----------------------------
+def archive_year(year: int, tenant: str | None = None) -> int:
+    """
+    締めた年（今年より前）を Parquet に書き出してから DB から削除する
+    - 書き出し → 読み戻して件数一致を確認 → 削除（失敗時は DB を触らない）
+    - 戻り値: アーカイブした行数
+    """
+    tenant = tenant or current_tenant()
+    year = int(year)
 
-    create_sql = f'CREATE TABLE IF NOT EXISTS "{TABLE}" (\n  ' + ",\n  ".join(col_defs) + "\n);"
+    def _do() -> int:
+        if year >= date.today().year:
+            raise RuntimeError(f"{year}年はまだ締まっていないためアーカイブできません")
+        init_db()
 
-    pcon = _pg_connect()
-    try:
-        with pcon.cursor() as cur:
-            cur.execute(create_sql)
-        pcon.commit()
-    finally:
-        pcon.close()
+        colnames = ", ".join([f'"{c}"' for c in COLUMNS])
+        lo, hi = f"{year:04d}", f"{year + 1:04d}"
+        with db_connect() as pcon:
+            with pcon.cursor() as cur:
+                cur.execute(
+                    f'SELECT {colnames} FROM "{TABLE}" WHERE "{TENANT_COL}" = %s AND "日付" >= %s AND "日付" < %s;',
+                    (tenant, lo, hi),
+                )
+                rows = cur.fetchall()
+            if not rows:
+                return 0
+
+            # 既存アーカイブがあれば統合（DB側を優先）/ 読み戻して件数一致を確認してから置き換え
+            archive_store.write_year(tenant, year, pd.DataFrame(rows, columns=COLUMNS).fillna(""))
+
+            with pcon.cursor() as cur:
+                db_core.set_source(cur, "archive")
+                cur.execute(
+                    f'DELETE FROM "{TABLE}" WHERE "{TENANT_COL}" = %s AND "日付" >= %s AND "日付" < %s;',
+                    (tenant, lo, hi),
+                )
+            pcon.commit()
+            bump_ledger_version(tenant)
+            return len(rows)
+
+    return int(run_db(f"年アーカイブ（{year}）", _do, default=0) or 0)
+
+# -----------------------------
+# テナント別キャッシュ
+#   - 書き込みのたびにテナントの版(version)を上げる → 版をキーにした cache_data が自然に無効化
+#   - 版は db_core でプロセス内共有（他セッション / ジャーナル再送の保存もすぐ反映）
+# -----------------------------
 
 # Railway Logs で確認用（postgres固定）
 sys.stderr.write("[DB] backend=postgres\n")
 sys.stderr.flush()
 
-def load_df() -> pd.DataFrame:
-    def _do():
-        init_db()
+@st.cache_resource
+def _ledger_vers() -> dict[str, set[int]]:
+    """テナント -> _load_df_cached に載っている版"""
+    return {}
+
+@st.cache_resource
+def _ledger_vers_lock() -> threading.Lock:
+    return threading.Lock()
+
+def _keep_newest_ledger(tenant: str, ver: int) -> None:
+    """新しい版を読んだら同じテナントの古い版をキャッシュから外す（max_entries まで古い版を抱えない）"""
+    with _ledger_vers_lock():
+        vers = _ledger_vers().setdefault(tenant, set())
+        old = [v for v in vers if v < ver]
+        vers.difference_update(old)
+        vers.add(ver)
+    for v in old:
+        _load_df_cached.clear(tenant, v)
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _load_df_cached(tenant: str, ver: int) -> pd.DataFrame:
+    """
+    テナント + 版 ごとにキャッシュ（ver は無効化キーとしてだけ使う）
+    - cache_resource なので全セッションで同じオブジェクト（読むだけ・書き換え禁止）
+    - 中身はコンパクト台帳（ledger_core.compact_ledger）を Arrow スナップショット経由で mmap したもの
+    - このプロセスで最初（版0）はスナップショットがあれば DB を待たずに返し、裏で照合
+    - 新しい版を読んだら同じテナントの古い版は外す（読み中のセッションは手元の参照をそのまま使える）
+    """
+    _keep_newest_ledger(tenant, ver)
+    if ver == 0:
+        snap = ledger_snapshot.open_cold(tenant)
+        if snap is not None:
+            return snap
 
-        pcon = _pg_connect()
-        try:
-            with pcon.cursor() as cur:
-                cur.execute(f'SELECT * FROM "{TABLE}";')
-                rows = cur.fetchall()
-                cols = [d[0] for d in cur.description]
-            df = pd.DataFrame(rows, columns=cols)
-        finally:
-            pcon.close()
+    init_db()
 
-        # 足りない列を補完して順番を揃える
-        for c in COLUMNS:
-            if c not in df.columns:
-                df[c] = ""
-        df = df[COLUMNS]
+    with db_connect() as pcon:
+        with pcon.cursor() as cur:
+            rows, checksum = db_core.select_all_checked(cur, tenant)
+        df = pd.DataFrame(rows, columns=COLUMNS)
 
-        # 日付でソート
-        if not df.empty:
-            df["_sort"] = pd.to_datetime(df["日付"], errors="coerce")
-            df = df.sort_values("_sort").drop(columns=["_sort"]).reset_index(drop=True)
+    # 締めた年のアーカイブを合流（同じ日付は DB 側を優先）
+    arc = archive_store.load_archive(tenant)
+    if not arc.empty:
+        df = pd.concat([arc, df], ignore_index=True).drop_duplicates(subset=["日付"], keep="last")
 
+    # 型付きの形に詰める（列の補完 / 日付ソートもここで）
+    return ledger_snapshot.publish(tenant, ledger_core.compact_ledger(df), checksum)
+
+def _overlay_journal(df: pd.DataFrame, tenant: str) -> pd.DataFrame:
+    """未送信のジャーナル（保存/削除）を画面用に重ねる"""
+    pending = journal.entries(tenant, status=journal.STATUS_PENDING)
+    if not pending:
         return df
+    keys = pd.to_datetime(list({e["date_key"] for e in pending}), errors="coerce")
+    rows = [{c: (e["row"] or {}).get(c, "") for c in COLUMNS} for e in pending if e["op"] == "upsert"]
+    df = df[~df["日付"].isin(keys)]
+    if rows:
+        # スナップショット由来の台帳は取引先が密な int32 なので、足す行も密にして型を揃える
+        add = ledger_core.dense_clients(ledger_core.compact_ledger(pd.DataFrame(rows, columns=COLUMNS)))
+        df = add if df.empty else pd.concat([ledger_core.dense_clients(df), add], ignore_index=True)
+    return df.sort_values("日付", kind="stable").reset_index(drop=True)
+
+def _ledger_frame(tenant: str) -> pd.DataFrame:
+    """画面と同じ台帳（キャッシュ + 未送信のジャーナル）。st を呼ばないのでバックグラウンドジョブからも使う"""
+    return _overlay_journal(_load_df_cached(tenant, ledger_version(tenant)), tenant)
+
+def load_df(tenant: str | None = None) -> pd.DataFrame:
+    tenant = tenant or current_tenant()
 
+    def _do():
+        try:
+            ver = ledger_version(tenant)
+            fut = _take_inflight("ledger", (tenant, ver))
+            return fut.result() if fut is not None else _load_df_cached(tenant, ver)
+        except Exception as e:
+            # DBに届かない時は最後に書き出したスナップショットを読み取り専用で見せる
+            snap = ledger_snapshot.read(tenant) if db_core.is_connection_error(e) else None
+            if snap is None:
+                raise
+            st.session_state["ledger_from_snapshot"] = True
+            return snap[0]
+
+    st.session_state["ledger_from_snapshot"] = False
     out = run_db("データ読み込み（load_df）", _do)
-    return out if isinstance(out, pd.DataFrame) else pd.DataFrame(columns=COLUMNS)
+    if not isinstance(out, pd.DataFrame):
+        out = ledger_core.compact_ledger(pd.DataFrame(columns=COLUMNS))
+    return _overlay_journal(out, tenant)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def ledger_periods(tenant: str, ver: int, _df: pd.DataFrame) -> tuple[list[str], list[int]]:
+    """月一覧 / 年一覧（テナント + 版 ごとにキャッシュ。_df はキーに含めない）"""
+    if _df.empty:
+        return [], []
+    dts = _df["日付"].dropna()   # 日付が読めない行は月 / 年に入れない
+    months = sorted(dts.dt.strftime("%Y-%m").unique().tolist())
+    years = sorted(int(y) for y in dts.dt.year.unique().tolist())
+    return months, years
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def ledger_csv(tenant: str, ver: int, _df: pd.DataFrame) -> bytes:
+    """全データCSV（テナント + 版 ごとに1回だけ TEXT に戻して書き出す）"""
+    return ledger_core.expand_ledger(_df).to_csv(index=False).encode("utf-8-sig")
+
+def period_frame(df: pd.DataFrame, period: str | int) -> pd.DataFrame:
+    """月（YYYY-MM）/ 年 の行だけ TEXT 台帳に戻す（表示 / レポ関数向け）"""
+    return ledger_core.expand_ledger(ledger_core.period_rows(df, period))
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def parsed_ledger(tenant: str, ver: int, _df: pd.DataFrame) -> pd.DataFrame:
+    """日次の数値フレーム（テナント + 版 ごとに1回だけパース）"""
+    return ledger_core.parse_ledger(_df)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def trend_data(tenant: str, ver: int, zoom: str, _df: pd.DataFrame) -> pd.DataFrame:
+    """トレンド表示用（テナント + 版 + 表示範囲 ごとにキャッシュ / 画面解像度まで間引き済み）"""
+    parsed = parsed_ledger(tenant, ver, _df)
+    return ledger_core.trend_frame(parsed, ledger_core.TREND_ZOOMS.get(zoom))
+
+# -----------------------------
+# 版ごとの変わった日（db_core.day_changes）を行にする
+#   - 他プロセスの通知は日付だけなので、その日の行は新しい版の台帳から取る（無ければ削除）
+# -----------------------------
+def _resolve_day_changes(changes: list[tuple[str, object]], df: pd.DataFrame) -> list[tuple[str, dict | None]]:
+    need = [k for k, row in changes if row is db_core.DAY_CHANGED]
+    if not need:
+        return changes
+    got = ledger_core.day_rows(df, need)
+    rows = {r["日付"]: r for r in got.to_dict("records")}
+    return [(k, rows.get(k) if row is db_core.DAY_CHANGED else row) for k, row in changes]
+
+# -----------------------------
+# 取引先ミックス（月 × 取引先 行列）
+#   - テナントごとに「作った版 / 取引先の日次値 / 行列」をプロセス内に保持
+#   - 版の差分がすべて1日単位の保存/削除 / 他プロセスの通知なら差分だけ反映、それ以外（CSV取込/月削除/再送など）は作り直し
+# -----------------------------
+@st.cache_resource
+def _client_matrices() -> dict[str, dict]:
+    return {}
+
+@st.cache_resource
+def _client_matrix_lock() -> threading.Lock:
+    return threading.Lock()
+
+def client_matrix(tenant: str, ver: int, df: pd.DataFrame) -> pd.DataFrame:
+    store = _client_matrices()
+    with _client_matrix_lock():
+        ent = store.get(tenant)
+        changes = db_core.day_changes(tenant, ent["ver"], ver) if ent is not None and ent["ver"] < ver else None
+        if changes is not None:
+            for date_key, row in _resolve_day_changes(changes, df):
+                ledger_core.apply_day_change(ent["days"], ent["matrix"], date_key, row)
+            ent["ver"] = ver
+        elif ent is None or ent["ver"] != ver:
+            parsed = parsed_ledger(tenant, ver, df)
+            ent = {"ver": ver, "days": parsed[CLIENT_COLS].copy(), "matrix": ledger_core.client_matrix(parsed)}
+            store[tenant] = ent
+        return ent["matrix"].copy()
+
+# -----------------------------
+# メモ / 日付検索
+#   - 既定はプロセス内の転置インデックス（DB + アーカイブ分。未送信のジャーナル分は検索時に上乗せ）
+#   - テナントごとに「作った版 / インデックス」を保持。版の差分が1日単位の保存/削除なら差分だけ反映（取引先ミックスと同じ）
+#   - SEARCH_BACKEND=db なら Postgres（pg_trgm）で検索（アーカイブ / 未送信分は対象外）
+# -----------------------------
+@st.cache_resource
+def _memo_indexes() -> dict[str, dict]:
+    return {}
+
+@st.cache_resource
+def _memo_index_lock() -> threading.Lock:
+    return threading.Lock()
+
+def _memo_index(tenant: str, ver: int) -> dict:
+    """_memo_index_lock() を持った状態で呼ぶ"""
+    store = _memo_indexes()
+    ent = store.get(tenant)
+    changes = db_core.day_changes(tenant, ent["ver"], ver) if ent is not None and ent["ver"] < ver else None
+    if changes is not None:
+        if any(row is db_core.DAY_CHANGED for _k, row in changes):
+            changes = _resolve_day_changes(changes, _load_df_cached(tenant, ver))
+        for date_key, row in changes:
+            ledger_core.index_put(ent["index"], date_key, None if row is None else str(row.get("メモ", "") or ""))
+        ent["ver"] = ver
+    elif ent is None or ent["ver"] != ver:
+        base = _load_df_cached(tenant, ver)
+        ent = {"ver": ver, "index": ledger_core.memo_index(base["日付"].dt.strftime("%Y-%m-%d"), base["メモ"])}
+        store[tenant] = ent
+    return ent["index"]
+
+def warm_memo_index(tenant: str, ver: int) -> None:
+    with _memo_index_lock():
+        _memo_index(tenant, ver)
+
+def search_ledger(tenant: str, q: str, df: pd.DataFrame, limit: int = 200) -> pd.DataFrame:
+    """一致した日の 日付 / 合計売上 / 合計h / メモ（新しい順）"""
+    cols = ["日付", "合計売上", "合計h", "メモ"]
+    if os.getenv("SEARCH_BACKEND") == "db":
+        words, prefixes = ledger_core.parse_query(q)
+        if not words and not prefixes:
+            return pd.DataFrame(columns=cols)
+        init_db()
+        with db_connect() as pcon:
+            with pcon.cursor() as cur:
+                return pd.DataFrame(db_core.search_memos(cur, tenant, words, prefixes, limit), columns=cols)
+
+    pending = {
+        e["date_key"]: None if e["op"] == "delete" else str((e["row"] or {}).get("メモ", "") or "")
+        for e in journal.entries(tenant, status=journal.STATUS_PENDING)
+    }
+    with _memo_index_lock():
+        dates = ledger_core.search_index(_memo_index(tenant, ledger_version(tenant)), q, overlay=pending, limit=limit)
+    return ledger_core.day_rows(df, dates)[cols].iloc[::-1].reset_index(drop=True)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def earnings_profile(tenant: str, ver: int, _df: pd.DataFrame):
+    """曜日×季節の日給プロファイル（テナント + 版 ごとに1回）"""
+    return ledger_core.earnings_profile(parsed_ledger(tenant, ver, _df))
+
+# -----------------------------
+# 日付切替の先読み（窓の中身と版の追従は day_window。ここはセッションと DB をつなぐだけ）
+# -----------------------------
+def _usable_window(tenant: str, date_key: str) -> dict | None:
+    return day_window.usable(st.session_state, tenant, date_key, ledger_version(tenant))
+
+def _window_apply(tenant: str, ver: int, changes: list[tuple[str, dict | None]]) -> None:
+    day_window.apply(st.session_state, tenant, ver, changes)
+
+def _fetch_day_window(tenant: str, date_key: str, ver: int) -> dict:
+    """前後 day_window.PREFETCH_DAYS 日を1回で読む（st を触らないのでワーカーからも呼べる）"""
+    lo, hi = day_window.bounds(date_key)
+    init_db()
+    with db_connect() as pcon:
+        with pcon.cursor() as cur:
+            rows = db_core.select_days(cur, tenant, lo, hi)
+    return day_window.build(tenant, ver, lo, hi, rows)
+
+def _day_window(tenant: str, date_key: str) -> dict:
+    win = _usable_window(tenant, date_key)
+    if win is not None:
+        return win
+    fut = _take_inflight("window", (tenant, date_key))
+    win = fut.result() if fut is not None else _fetch_day_window(tenant, date_key, ledger_version(tenant))
+    st.session_state["day_window"] = win
+    return win
+
+# -----------------------------
+# 描画開始時の同時読み込み（day_window.start_fetches）
+#   - 台帳（DB + アーカイブ）と選んだ日の前後（先読みの窓）を同時に読み始める（init_db はプロセスで1回 / 同じ台帳を同時に頼んでも読むのは1本だけ）
+#   - 月一覧 / 年一覧は台帳から作るので DB 往復は無い（台帳が届いた時点で ledger_periods）
+#   - 受け取り手（load_df / load_row）がその再描画で動く時だけ投げ、残った分は末尾の drop_inflight() で取り消す
+#   - ワーカーは st のキャッシュ関数（_load_df_cached）を ScriptRunContext なしで呼ぶ → その警告はスケジューラと同じく出さない
+# -----------------------------
+@st.cache_resource
+def _fetch_pool() -> ThreadPoolExecutor:
+    scheduler.quiet_no_context("fetch")
+    return ThreadPoolExecutor(max_workers=int(os.getenv("DB_FETCH_WORKERS") or 4), thread_name_prefix="fetch")
+
+def start_fetches(tenant: str, date_key: str) -> None:
+    """選択日を読む直前（起動直後 / 日付切替）に呼ぶ。窓が足りない時だけ台帳と窓をワーカーに投げてすぐ戻る"""
+    day_window.start_fetches(
+        st.session_state, _fetch_pool(), tenant, date_key, ledger_version(tenant),
+        _load_df_cached, _fetch_day_window, journal.has_pending,
+    )
 
+def _take_inflight(kind: str, key: tuple):
+    return day_window.take_inflight(st.session_state, kind, key)
+
+def drop_inflight() -> None:
+    """受け取られなかった読み込みを取り消す（再描画の末尾）"""
+    day_window.drop_inflight(st.session_state)
 
 def load_row_safe(date_key: str) -> dict | None:
     """DBエラー時は st.error を出して None を返す（UI側はこれを使う）"""
@@ -142,98 +444,118 @@ def load_row_safe(date_key: str) -> dict | None:
         return load_row(date_key)
     return run_db("データ取得（load_row）", _do, default=None)
 
-def load_row(date_key: str) -> dict | None:
-    init_db()
+def load_row(date_key: str, tenant: str | None = None) -> dict | None:
+    """1日分（末尾の行バージョンは row_vers に記録して返り値には入れない）"""
+    tenant = tenant or current_tenant()
+    vers = st.session_state.setdefault("row_vers", {})
 
-    pcon = _pg_connect()
-    try:
-        with pcon.cursor() as cur:
-            cur.execute(f'SELECT * FROM "{TABLE}" WHERE "日付" = %s LIMIT 1;', (date_key,))
-            row = cur.fetchone()
-            if not row:
-                return None
-            cols = [d[0] for d in cur.description]
-    finally:
-        pcon.close()
-
-    data = dict(zip(cols, row))
+    # 未送信の保存/削除があればそちらが最新
+    for e in journal.entries(tenant, status=journal.STATUS_PENDING):
+        if e["date_key"] == date_key:
+            return None if e["op"] == "delete" else {c: (e["row"] or {}).get(c, "") for c in COLUMNS}
+
+    row = _day_window(tenant, date_key)["rows"].get(date_key)
+    if not row:
+        vers[date_key] = 0
+        return None
+
+    vers[date_key] = int(row[-1])
+    data = dict(zip(COLUMNS, row[:-1]))
     for c in COLUMNS:
         data.setdefault(c, "")
     return data
 
-def upsert_row(row: dict) -> bool:
-    def _do() -> bool:
-        init_db()
-
-        cols = COLUMNS
-        values = ["" if row.get(c) is None else str(row.get(c, "")) for c in cols]
+def _journal_offline(label: str, e: Exception) -> None:
+    sys.stderr.write(f"[JOURNAL] {label}: offline ({type(e).__name__}: {e})\n"); sys.stderr.flush()
+    st.warning("DBに接続できないため端末内に一時保存しました（復帰後に自動送信）")
 
-        colnames = ", ".join([f'"{c}"' for c in cols])
-        placeholders = ", ".join(["%s"] * len(cols))
-        update_set = ", ".join([f'"{c}"=EXCLUDED."{c}"' for c in cols if c != "日付"])
+def upsert_row(row: dict, tenant: str | None = None) -> bool:
+    tenant = tenant or current_tenant()
+    key = str(row.get("日付", ""))
+    vers = st.session_state.setdefault("row_vers", {})
+    base_ver = vers.get(key)
 
-        sql = f"""
-            INSERT INTO "{TABLE}" ({colnames})
-            VALUES ({placeholders})
-            ON CONFLICT("日付") DO UPDATE SET
-            {update_set};
-        """
+    # 同じ日付に未送信があるなら順序を守るためジャーナルに積む
+    if journal.has_pending(tenant, key):
+        journal.append(tenant, "upsert", key, row, base_ver)
+        return True
 
-        pcon = _pg_connect()
+    def _do() -> bool:
+        # スキーマ確認/年パーティションはプロセス内で確認済みなら0往復 → upsert 1文 + commit
         try:
-            with pcon.cursor() as cur:
-                cur.execute(sql, values)
-            pcon.commit()
+            init_db()
+            ensure_year_partitions(years_of([key]))
+
+            with db_connect() as pcon:
+                with pcon.cursor() as cur:
+                    db_core.set_source(cur, "ui")
+                    vers[key] = db_core.upsert_day(cur, tenant, row)
+                pcon.commit()
+        except Exception as e:
+            if not db_core.is_connection_error(e):
+                raise
+            journal.append(tenant, "upsert", key, row, base_ver)
+            _journal_offline("保存（upsert）", e)
             return True
-        finally:
-            pcon.close()
+        ver = bump_ledger_version(tenant)
+        record_day_changes(tenant, ver, [(key, row)])
+        _window_apply(tenant, ver, [(key, row)])
+        return True
 
     # run_db は「失敗時に st.error + ログ出し」して False を返す想定
     return run_db("保存（upsert）", _do, default=False)
 
-def delete_by_dates(date_keys: set[str]) -> bool:
+def delete_by_dates(date_keys: set[str], tenant: str | None = None) -> bool:
     if not date_keys:
         return True
+    tenant = tenant or current_tenant()
 
     def _do() -> bool:
-        init_db()
         keys = [str(k) for k in sorted(date_keys)]
-
-        placeholders = ", ".join(["%s"] * len(keys))
-        sql = f'DELETE FROM "{TABLE}" WHERE "日付" IN ({placeholders});'
-
-        pcon = _pg_connect()
+        # アーカイブ済みの年の分も消す（ローカルのファイルなのでオフラインでも先に済ませる）
+        archive_store.delete_days(tenant, keys)
         try:
-            with pcon.cursor() as cur:
-                cur.execute(sql, keys)
-            pcon.commit()
+            init_db()
+            with db_connect() as pcon:
+                with pcon.cursor() as cur:
+                    db_core.set_source(cur, "ui")
+                    db_core.delete_days(cur, tenant, keys)
+                pcon.commit()
+        except Exception as e:
+            if not db_core.is_connection_error(e):
+                raise
+            # 一覧からの削除は無条件（一覧の行バージョンまでは持っていないため）
+            for k in keys:
+                journal.append(tenant, "delete", k, None, None)
+            _journal_offline("削除（delete_by_dates）", e)
             return True
-        finally:
-            pcon.close()
+        ver = bump_ledger_version(tenant)
+        record_day_changes(tenant, ver, [(k, None) for k in keys])
+        _window_apply(tenant, ver, [(k, None) for k in keys])
+        return True
 
     return run_db("削除（delete_by_dates）", _do, default=False)
 
-def delete_by_month_prefix(month_prefix: str) -> bool:
+def delete_by_month_prefix(month_prefix: str, tenant: str | None = None) -> bool:
     """
     month_prefix: 'YYYY-MM' を想定
-    例) 2026-02 を渡すと 2026-02- の全行を削除
+    例) 2026-02 を渡すと 2026-02- の全行を削除（ログイン中テナントのみ）
     """
     if not month_prefix:
         return True
+    tenant = tenant or current_tenant()
 
     def _do() -> bool:
+        # 月だけ入れ直す時にアーカイブ側の旧行が残らないように
+        archive_store.delete_days(tenant, month_prefix=month_prefix)
         init_db()
-        like = f"{month_prefix}-%"
-        sql = f'DELETE FROM "{TABLE}" WHERE "日付" LIKE %s;'
-
-        pcon = _pg_connect()
-        try:
+        with db_connect() as pcon:
             with pcon.cursor() as cur:
-                cur.execute(sql, (like,))
+                db_core.set_source(cur, "import")   # 月だけ完全一致インポートの前処理
+                db_core.delete_month(cur, tenant, month_prefix)
             pcon.commit()
+            bump_ledger_version(tenant)
             return True
-        finally:
-            pcon.close()
 
     return bool(run_db(f"削除（delete_by_month_prefix {month_prefix}）", _do, default=False))
 
@@ -333,7 +655,42 @@ def load_inputs_from_row(row: dict):
 # UI
 # -----------------------------
 st.markdown("## 月次入力（Postgres / Supabase）")
+if "_boot" not in st.session_state:
+    # 先読みは選択日を読む時（起動直後 / 日付切替）だけ。普段の再描画では投げない
+    start_fetches(current_tenant(), (st.session_state.get("d") or date.today()).isoformat())
 df = load_df()
+if ledger_snapshot.status(current_tenant()) == ledger_snapshot.STATUS_VERIFYING:
+    st.caption("⚡ スナップショットから表示中（DBと照合中）")
+_breaker = db_core.breaker_state()
+if _breaker["open"]:
+    st.warning(
+        f"🔌 DBに接続できません（{int(time.time() - _breaker['opened_at'])}秒前から / 裏で再接続を確認中）。"
+        "保存は端末内に一時保存し、復帰後に自動送信します"
+    )
+if st.session_state.get("ledger_from_snapshot"):
+    st.caption("⚡ DBに届かないため、最後に読み込んだ台帳（スナップショット）を表示中")
+
+# -----------------------------
+# 端末内ジャーナル（未送信 / 競合）
+# -----------------------------
+_jt = current_tenant()
+_pending = journal.entries(_jt, status=journal.STATUS_PENDING)
+_conflicts = journal.entries(_jt, status=journal.STATUS_CONFLICT)
+if _pending:
+    st.info(f"📡 未送信の変更が {len(_pending)} 件あります（DB復帰後に自動送信）")
+if _conflicts:
+    with st.expander(f"⚠ 送信できなかった変更（競合 {len(_conflicts)} 件）", expanded=True):
+        st.caption("オフライン中に、同じ日付がDB側で先に更新/削除されていました")
+        for e in _conflicts:
+            label = "削除" if e["op"] == "delete" else "保存"
+            c1, c2, c3 = st.columns([3, 1, 1])
+            c1.write(f"{e['date_key']}（{label}）: {e.get('error') or ''}")
+            if c2.button("上書き", key=f"jr_force_{e['id']}"):
+                journal.force(e["id"])
+                st.rerun()
+            if c3.button("破棄", key=f"jr_discard_{e['id']}"):
+                journal.discard(e["id"])
+                st.rerun()
 # -----------------------------
 # 初回だけ：日付(d)の行を読み込んで session_state を先に埋める（ウィジェット生成前）
 # -----------------------------
@@ -368,6 +725,7 @@ if "_boot" not in st.session_state:
 
 def on_date_change():
     key = st.session_state["d"].isoformat()
+    start_fetches(current_tenant(), key)
     data = load_row_safe(key)
 
     if data:
@@ -530,27 +888,21 @@ if save:
     frex_h  = to_float(st.session_state["frex_h_s"]) or 0.0
     fresh_h = to_float(st.session_state["fresh_h_s"]) or 0.0
 
-    other_h = max(0.0, float(total_h) - float(frex_h) - float(fresh_h))
-    hourly = int(total_sales / total_h) if total_h > 0 else ""
-    flag_5h = "5h+" if total_h >= 5.0 else ""
-    warn = "⚠ 売上あり/時間0" if (total_sales > 0 and total_h <= 0) else ""
-
     row = {
         "日付": key,
         "合計売上": to_cell_int(total_sales),
         "合計h": to_cell_float(total_h),
         "frex h": to_cell_float(frex_h),
         "fresh h": to_cell_float(fresh_h),
-        "他 h": to_cell_float(other_h),
-        "合計時給": to_cell_int(hourly) if hourly != "" else "",
-        "5h+": flag_5h,
-        "警告": warn,
         "メモ": st.session_state.get("memo", "") or "",
     }
 
     for c in CLIENT_COLS:
         row[c] = to_cell_int(client_nums.get(c, 0))
 
+    # 他 h / 合計時給 / 5h+ / 警告 は共通の派生ロジックで（CSVインポート/全件再計算と同じ）
+    row.update(ledger_core.derive_row(row))
+
     ok = upsert_row(row)
     if ok:
         st.session_state["loaded_sig"] = _sig(_current_payload())
@@ -568,13 +920,9 @@ if df.empty:
     st.info("データがありません")
 else:
     # --- 月で表示を切り替え（デフォルト：最新データの月） ---
-    dcol = pd.to_datetime(df["日付"], errors="coerce")
-    df2 = df.copy()
-    df2["_d"] = dcol
-    df2 = df2.dropna(subset=["_d"])
-
-    months = sorted(df2["_d"].dt.strftime("%Y-%m").unique().tolist())
-    latest_month = df2["_d"].max().strftime("%Y-%m") if not df2.empty else None
+    _vt = current_tenant()
+    months, _ = ledger_periods(_vt, ledger_version(_vt), df)
+    latest_month = months[-1] if months else None
 
     sel_month = st.selectbox(
         "表示する月（YYYY-MM）",
@@ -583,9 +931,8 @@ else:
         key="db_view_month",
     )
 
-    # 選択月だけ表示（並びは月内で日付昇順）
-    view = df2[df2["_d"].dt.strftime("%Y-%m") == sel_month].copy()
-    view = view.sort_values("_d").drop(columns=["_d"]).reset_index(drop=True)
+    # 選択月だけ TEXT に戻して表示（並びは月内で日付昇順）
+    view = (period_frame(df, sel_month) if sel_month else ledger_core.expand_ledger(df.iloc[:0])).reset_index(drop=True)
     if "選択" not in view.columns:
         view.insert(0, "選択", False)
 
@@ -622,6 +969,24 @@ else:
                     st.rerun()
                 # 失敗時は run_db が st.error を出す
 
+    # -----------------------------
+    # 日付が読めない / 書式が違う行（読めない行は月の一覧・レポに出ないのでここで見て消す）
+    # -----------------------------
+    irr = ledger_core.irregular_dates(df)
+    if not irr.empty:
+        with st.expander(f"⚠ 日付が読めない / YYYY-MM-DD でない行（{len(irr)} 行）"):
+            st.caption("日付はDBの文字のまま表示。読めない行は月の一覧・レポには出ません（全データCSVには含まれます）")
+            st.dataframe(irr, width="stretch", hide_index=True)
+            irr_pick = st.multiselect("削除する行（日付）", irr["日付"].tolist(), key="irr_pick")
+            irr_ok = st.checkbox("削除してOK（戻せません）", key="confirm_del_irr")
+            if st.button("選んだ行を削除", key="btn_del_irr"):
+                if not irr_pick or not irr_ok:
+                    st.warning("行を選んでチェックを入れてから押してね")
+                elif delete_by_dates(set(irr_pick)):
+                    st.success(f"削除しました: {', '.join(sorted(irr_pick))}")
+                    st.session_state.pop("irr_pick", None)
+                    st.rerun()
+
     # -----------------------------
     # CSVエクスポート（表示中の月 / 全データ）
     # -----------------------------
@@ -638,7 +1003,7 @@ else:
     
     today_str = date.today().isoformat()
     
-    csv_all = df.to_csv(index=False).encode("utf-8-sig")
+    csv_all = ledger_csv(_vt, ledger_version(_vt), df)
 
     st.download_button(
         label="📦 全データをCSVでダウンロード（バックアップ）",
@@ -648,6 +1013,83 @@ else:
         key="dl_all",
     )
 
+# -----------------------------
+# メモ / 日付検索（CSV を書き出さずに「あの渋滞の日」を探す）
+# -----------------------------
+st.markdown("#### 🔎 メモ・日付検索")
+memo_q = st.text_input(
+    "検索（空白区切りで AND / 2025-03 のような日付も可）", key="memo_q", placeholder="例: 渋滞 / 雨 2025-06"
+).strip()
+if memo_q:
+    _t = time.perf_counter()
+    hits = run_db("メモ検索", lambda: search_ledger(current_tenant(), memo_q, df), default=None)
+    if hits is not None:
+        st.caption(
+            f"{len(hits):,} 件 / {(time.perf_counter() - _t) * 1000:.0f} ms"
+            + ("（DB検索: アーカイブ済みの年 / 未送信の分は対象外）" if os.getenv("SEARCH_BACKEND") == "db" else "")
+        )
+        if not hits.empty:
+            st.dataframe(hits, width="stretch", hide_index=True)
+
+# -----------------------------
+# 条件で絞り込み（期間 / 取引先あり / 時給 / 5h+・警告）
+#   - 条件はパラメータ付き SQL で DB に渡す（型付きの生成列 + 索引 / db_core.filter_days）
+#   - 結果はページ単位でキャッシュ（テナント + 版 + 条件 + ページ）。保存で版が変われば作り直し
+#   - DB の行だけが対象（アーカイブ済みの年 / 未送信の分は含まない）
+# -----------------------------
+FILTER_PAGE_SIZE = 50
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def filtered_page(tenant: str, ver: int, sig: tuple, page: int) -> tuple[pd.DataFrame, int]:
+    init_db()
+    with db_connect() as pcon:
+        with pcon.cursor() as cur:
+            rows, total = db_core.filter_days(
+                cur, tenant, limit=FILTER_PAGE_SIZE, offset=(page - 1) * FILTER_PAGE_SIZE, **dict(sig)
+            )
+    return pd.DataFrame(rows, columns=COLUMNS), total
+
+with st.expander("🔍 条件で絞り込み"):
+    f1, f2 = st.columns(2)
+    flt_from = f1.date_input("期間（から）", value=None, key="flt_from")
+    flt_to = f2.date_input("期間（まで）", value=None, key="flt_to")
+    flt_clients = st.multiselect("取引先（選んだものすべてがある日）", CLIENT_COLS, key="flt_clients")
+    h1, h2 = st.columns(2)
+    flt_hmin = h1.number_input("時給（以上）", value=None, min_value=0, step=100, key="flt_hourly_min")
+    flt_hmax = h2.number_input("時給（以下）", value=None, min_value=0, step=100, key="flt_hourly_max")
+    g1, g2 = st.columns(2)
+    flt_flags = [f for f, on in [("5h+", g1.checkbox("5h+ のみ", key="flt_5h")), ("警告", g2.checkbox("警告のみ", key="flt_warn"))] if on]
+
+    # 条件の署名（並び順を固定してキャッシュのキーにする）
+    flt_sig = tuple(sorted({
+        k: v for k, v in {
+            "date_from": flt_from.isoformat() if flt_from else None,
+            "date_to": flt_to.isoformat() if flt_to else None,
+            "clients": tuple(c for c in CLIENT_COLS if c in flt_clients),
+            "hourly_min": int(flt_hmin) if flt_hmin is not None else None,
+            "hourly_max": int(flt_hmax) if flt_hmax is not None else None,
+            "flags": tuple(flt_flags),
+        }.items() if v is not None and v != ()   # 時給 0 も条件（空欄 / 未選択だけ外す）
+    }.items()))
+    st.caption("DB の行だけが対象です（アーカイブ済みの年 / 未送信の分は含みません）")
+    if not flt_sig:
+        st.caption("条件を1つ以上指定すると DB から該当日を取得します")
+    else:
+        if st.session_state.get("flt_sig") != flt_sig:
+            # 条件が変わったら1ページ目へ
+            st.session_state["flt_sig"] = flt_sig
+            st.session_state["flt_page"] = 1
+        page = int(st.number_input("ページ", min_value=1, step=1, key="flt_page"))
+        _ft = current_tenant()
+        res = run_db("絞り込み", lambda: filtered_page(_ft, ledger_version(_ft), flt_sig, page), default=None)
+        if res is not None:
+            rows_df, total = res
+            pages = max(1, -(-total // FILTER_PAGE_SIZE))
+            lo = (page - 1) * FILTER_PAGE_SIZE
+            st.caption(f"{total:,} 件中 {min(lo + 1, total):,}–{min(lo + len(rows_df), total):,} 件（{page}/{pages} ページ）")
+            if not rows_df.empty:
+                st.dataframe(rows_df, width="stretch", hide_index=True)
+
 # -----------------------------
 # バックアップ/復元（CSV → DB）
 # -----------------------------
@@ -710,6 +1152,29 @@ if up_file is not None:
         st.write("プレビュー（先頭10行）")
         st.dataframe(import_df.head(10), width="stretch", hide_index=True)
 
+        # 検証（列単位でまとめて判定 / 同じファイルなら rerun で再計算しない）
+        if st.session_state.get("import_check_id") != up_file.file_id:
+            st.session_state["import_check"] = ledger_core.validate_import(import_df)
+            st.session_state["import_check_id"] = up_file.file_id
+        check = st.session_state["import_check"]
+        errs = check["errors"]
+        if errs.empty:
+            st.success("検証OK: 問題は見つかりませんでした")
+        else:
+            st.warning(
+                f"検証: {int(check['issue'].sum())} 行に問題があります"
+                f"（うち自動修正できない {int(check['unfixable'].sum())} 行）"
+            )
+            st.dataframe(errs.head(1000), width="stretch", hide_index=True)
+            if len(errs) > 1000:
+                st.caption(f"先頭1000件のみ表示（全 {len(errs)} 件）")
+            st.radio(
+                "問題のある行の扱い",
+                list(ledger_core.IMPORT_MODES),
+                format_func=ledger_core.IMPORT_MODES.get,
+                key="import_mode",
+            )
+
         st.markdown("### インポート方式")
         strict_month = st.checkbox(
             "✅（月次CSV向け）この月のDBを先に全削除してから復元（CSVに無い日付は消える）",
@@ -728,12 +1193,22 @@ if up_file is not None:
                 st.warning("チェックを入れてから押してね")
             else:
                 def _do_import() -> int:
+                    from psycopg2.extras import execute_values
                     init_db()
 
                     df_imp = st.session_state.get("import_df")
                     if df_imp is None or df_imp.empty:
                         raise RuntimeError("インポート対象のCSVがありません（もう一度ファイルを選び直してね）")
 
+                    # 検証結果に沿って取り込む行を決める（既定は中止）
+                    df_imp = ledger_core.resolve_import(
+                        df_imp, st.session_state["import_check"], st.session_state.get("import_mode", "reject")
+                    )
+                    if df_imp is None:
+                        raise RuntimeError("検証で問題が見つかったため中止しました（扱いを選ぶかCSVを直してね）")
+                    if df_imp.empty:
+                        raise RuntimeError("取り込める行がありません")
+
                     # strict_month の安全チェック
                     if strict_month:
                         months2 = st.session_state.get("import_months", [])
@@ -744,37 +1219,42 @@ if up_file is not None:
                         if not ok_del:
                             raise RuntimeError("月削除に失敗したためインポート中断")
 
-                    cols = COLUMNS
+                    # 派生列はファイルの値ではなく共通ロジックで作り直す
+                    df_imp = df_imp.copy()
+                    df_imp[ledger_core.DERIVED_COLS] = ledger_core.derive_fields(df_imp)
+
+                    tenant = current_tenant()
+                    ensure_year_partitions(years_of(df_imp["日付"].tolist()))
+                    cols = [TENANT_COL, *COLUMNS]
                     colnames = ", ".join([f'"{c}"' for c in cols])
-                    update_set = ", ".join([f'"{c}"=EXCLUDED."{c}"' for c in cols if c != "日付"])
+                    update_set = ", ".join([f'"{c}"=EXCLUDED."{c}"' for c in COLUMNS if c != "日付"])
 
                     sql = f'''
                         INSERT INTO "{TABLE}" ({colnames})
                         VALUES %s
-                        ON CONFLICT("日付") DO UPDATE SET
-                        {update_set};
+                        ON CONFLICT("{TENANT_COL}", "日付") DO UPDATE SET
+                        {update_set}, "{VER_COL}" = "{TABLE}"."{VER_COL}" + 1;
                     '''
 
                     values_list = [
-                        tuple("" if r.get(c) is None else str(r.get(c, "")) for c in cols)
-                        for _, r in df_imp.iterrows()
+                        (tenant, *r) for r in df_imp[COLUMNS].astype(str).itertuples(index=False, name=None)
                     ]
 
-                    pcon = _pg_connect()
-                    try:
+                    with db_connect() as pcon:
                         with pcon.cursor() as cur:
+                            db_core.set_source(cur, "import")
                             execute_values(cur, sql, values_list, page_size=500)
                         pcon.commit()
+                        bump_ledger_version(tenant)
                         return len(values_list)
-                    finally:
-                        pcon.close()
 
                 n = run_db("CSVインポート（高速/execute_values）", _do_import, default=0)
                 if n > 0:
                     st.success(f"インポート完了: {n} 行")
 
                     # UIリセット（ファイル表示も消す）
-                    for k in ["confirm_import", "strict_month_restore", "btn_import", "import_df", "import_months", "import_csv_rows", "import_minmax"]:
+                    for k in ["confirm_import", "strict_month_restore", "btn_import", "import_df", "import_months", "import_csv_rows", "import_minmax",
+                              "import_check", "import_check_id", "import_mode"]:
                         st.session_state.pop(k, None)
                     st.session_state["csv_up_ver"] += 1
 
@@ -782,6 +1262,247 @@ if up_file is not None:
 else:
     st.caption("CSVを選ぶと、プレビューとインポートボタンが表示されます。")
 
+# -----------------------------
+# メンテナンス：派生列（他 h / 合計時給 / 5h+ / 警告）を全件再計算
+#   - DB の行を読み → 共通の派生ロジックで作り直し → 値が変わる行だけ1文で更新
+# -----------------------------
+def recompute_derived(tenant: str | None = None) -> int:
+    tenant = tenant or current_tenant()
+
+    def _do() -> int:
+        init_db()
+        with db_connect() as pcon:
+            with pcon.cursor() as cur:
+                cur_df = pd.DataFrame(db_core.select_all(cur, tenant), columns=COLUMNS)
+                if cur_df.empty:
+                    return 0
+                new = ledger_core.derive_fields(cur_df)
+                diff = (new != cur_df[ledger_core.DERIVED_COLS].fillna("")).any(axis=1)
+                rows = list(zip(cur_df.loc[diff, "日付"], *[new.loc[diff, c] for c in ledger_core.DERIVED_COLS]))
+                db_core.set_source(cur, "bulk")
+                n = db_core.update_columns(cur, tenant, ledger_core.DERIVED_COLS, rows)
+            pcon.commit()
+        if n:
+            bump_ledger_version(tenant)
+        return n
+
+    return int(run_db("派生列の再計算", _do, default=0) or 0)
+
+with st.expander("🛠 メンテナンス（派生列の再計算）"):
+    st.caption("他 h / 合計時給 / 5h+ / 警告 を 合計売上・時間 から全件作り直します（値が変わる行だけ更新）")
+    if st.button("派生列を全件再計算", key="btn_recompute_derived"):
+        n = recompute_derived()
+        st.success(f"再計算しました: {n} 行を更新")
+
+# -----------------------------
+# 変更履歴 / 時点復元
+#   - 保存 / 削除 / インポート / 再計算 / アーカイブ / 再送 は DB のトリガーで変更ログに残る（経路つき）
+#   - 日付 / 月 / 全体 を指定時刻の状態に1文で戻す（戻した書き込みもログに残るので、復元自体も戻せる）
+#   - 履歴は開いた時だけ読む（毎回の再描画で DB に行かない）
+# -----------------------------
+APP_TZ = ZoneInfo(os.getenv("APP_TZ") or "Asia/Tokyo")
+CHANGE_OPS = {"I": "追加", "U": "更新", "D": "削除"}
+CHANGE_SOURCES = {"ui": "画面", "import": "CSV", "bulk": "一括", "archive": "アーカイブ", "journal": "再送", "restore": "復元", "sql": "SQL"}
+
+def load_changes(tenant: str | None = None, limit: int = 200) -> pd.DataFrame:
+    tenant = tenant or current_tenant()
+
+    def _do() -> pd.DataFrame:
+        init_db()
+        with db_connect() as pcon:
+            with pcon.cursor() as cur:
+                rows = db_core.list_changes(cur, tenant, limit)
+        return pd.DataFrame(
+            [
+                {
+                    "時刻": ts.astimezone(APP_TZ).strftime("%Y-%m-%d %H:%M:%S"),
+                    "日付": d,
+                    "操作": CHANGE_OPS.get(op, op),
+                    "経路": CHANGE_SOURCES.get(src, src),
+                    "合計売上（前→後）": f"{(old or {}).get('合計売上', '')} → {(new or {}).get('合計売上', '')}",
+                }
+                for _id, ts, d, op, src, old, new in rows
+            ],
+            columns=["時刻", "日付", "操作", "経路", "合計売上（前→後）"],
+        )
+
+    return run_db("変更履歴の読み込み", _do, default=pd.DataFrame())
+
+def restore_preview(at: datetime, lo: str | None, hi: str | None, tenant: str | None = None) -> list[tuple[str, bool]]:
+    tenant = tenant or current_tenant()
+
+    def _do():
+        init_db()
+        with db_connect() as pcon:
+            with pcon.cursor() as cur:
+                return db_core.restore_preview(cur, tenant, at, lo, hi)
+
+    return run_db("時点復元（確認）", _do, default=[]) or []
+
+def restore_ledger(at: datetime, lo: str | None, hi: str | None, tenant: str | None = None) -> int:
+    tenant = tenant or current_tenant()
+
+    def _do() -> int:
+        init_db()
+        with db_connect() as pcon:
+            with pcon.cursor() as cur:
+                n = db_core.restore_to(cur, tenant, at, lo, hi)
+            pcon.commit()
+        bump_ledger_version(tenant)
+        return n
+
+    return int(run_db("時点復元", _do, default=0) or 0)
+
+def _month_range(month_str: str) -> tuple[str, str]:
+    y, mo = map(int, month_str.split("-"))
+    return month_str, (f"{y + 1:04d}-01" if mo == 12 else f"{y:04d}-{mo + 1:02d}")
+
+with st.expander("⏪ 変更履歴 / 時点復元"):
+    st.caption("DB の変更だけを記録・復元します（アーカイブ済みの年は対象外。アーカイブ後に消した分は戻せません）")
+    if st.toggle("履歴を読み込む", key="history_on"):
+        hist = load_changes()
+        if hist is None or hist.empty:
+            st.caption("変更履歴はまだありません")
+        else:
+            st.dataframe(hist, hide_index=True, width="stretch", height=240)
+
+        scope = st.radio("戻す範囲", ["日付", "月", "全体"], horizontal=True, key="restore_scope")
+        lo = hi = None
+        if scope == "日付":
+            rd = st.date_input("日付", value=date.today(), key="restore_day")
+            lo, hi = rd.isoformat(), (rd + timedelta(days=1)).isoformat()
+        elif scope == "月":
+            rm = st.text_input("月（YYYY-MM）", value=date.today().strftime("%Y-%m"), key="restore_month").strip()
+            try:
+                datetime.strptime(rm, "%Y-%m")
+                lo, hi = _month_range(rm)
+            except ValueError:
+                st.error("月は YYYY-MM で入力してね")
+                scope = None
+
+        c1, c2 = st.columns(2)
+        at_d = c1.date_input("いつの状態に戻すか（日付）", value=date.today(), key="restore_at_day")
+        at_t = c2.time_input("時刻", value=dtime(0, 0), step=60, key="restore_at_time")
+        at = datetime.combine(at_d, at_t, tzinfo=APP_TZ)
+
+        if scope is not None:
+            plan = restore_preview(at, lo, hi)
+            if not plan:
+                st.caption("この時点と今で違う日はありません")
+            else:
+                n_del = sum(1 for _, keep in plan if not keep)
+                st.caption(f"{len(plan)} 日分が {at:%Y-%m-%d %H:%M} の状態に戻ります（うち {n_del} 日はその時点に無かったので削除）")
+                st.caption("対象: " + ", ".join(d for d, _ in plan[:31]) + (" ほか" if len(plan) > 31 else ""))
+                confirm_restore = st.checkbox("戻してOK（戻した操作も履歴に残ります）", key="confirm_restore")
+                if st.button("この時点に戻す", key="btn_restore"):
+                    if not confirm_restore:
+                        st.warning("チェックを入れてから押してね")
+                    else:
+                        n = restore_ledger(at, lo, hi)
+                        st.success(f"戻しました: {n} 行")
+                        st.rerun()
+
+# -----------------------------
+# 年アーカイブ（締めた年 → Parquet / レポからはそのまま読める）
+# -----------------------------
+with st.expander("🗄 年アーカイブ（過去年をDBから外してParquetへ）"):
+    _tenant = current_tenant()
+    arc_years = archive_store.archived_years(_tenant)
+    st.caption(f"アーカイブ済み: {', '.join(map(str, arc_years)) if arc_years else 'なし'}（レポ/一覧にはそのまま表示 / 削除はアーカイブ側も消します。絞り込み・時点復元の対象外）")
+
+    closed_years = sorted(
+        int(y) for y in df["日付"].dropna().dt.year.unique().tolist()
+        if int(y) < date.today().year
+    ) if not df.empty else []
+
+    if not closed_years:
+        st.caption("アーカイブできる過去年はありません")
+    else:
+        arc_year = st.selectbox("アーカイブする年", closed_years, key="archive_year")
+        confirm_arc = st.checkbox("DBから外してOK（Parquetに移します）", key="confirm_archive")
+        if st.button("アーカイブ実行", key="btn_archive"):
+            if not confirm_arc:
+                st.warning("チェックを入れてから押してね")
+            else:
+                n = archive_year(int(arc_year), _tenant)
+                if n > 0:
+                    st.success(f"{arc_year}年をアーカイブしました: {n} 行")
+                    st.session_state.pop("confirm_archive", None)
+                    st.rerun()
+                else:
+                    st.info("DB上に対象行がありません（アーカイブ済みの可能性）")
+
+# -----------------------------
+# トレンド（移動合計 7日 / 30日）
+# -----------------------------
+with st.expander("📈 トレンド（売上 / 時間 / 時給）"):
+    import altair as alt
+
+    _tt = current_tenant()
+    zoom = st.radio("表示範囲", list(ledger_core.TREND_ZOOMS), horizontal=True, key="trend_zoom")
+    trend = trend_data(_tt, ledger_version(_tt), zoom, df)
+    if trend.empty:
+        st.caption("データがありません")
+    else:
+        metric_labels = {"sales": "売上（円）", "hours": "時間（h）", "hourly": "時給（円/h）"}
+        metric = st.radio("指標", list(metric_labels), format_func=metric_labels.get, horizontal=True, key="trend_metric")
+        long = (
+            trend[[f"{metric}_{w}" for w in ledger_core.TREND_WINDOWS]]
+            .rename(columns={f"{metric}_{w}": f"{w}日" for w in ledger_core.TREND_WINDOWS})
+            .rename_axis("日付").reset_index()
+            .melt(id_vars="日付", var_name="窓", value_name="値")
+            .dropna(subset=["値"])
+        )
+        chart = alt.Chart(long).mark_line().encode(
+            x=alt.X("日付:T", title=None),
+            y=alt.Y("値:Q", title=f"移動合計 {metric_labels[metric]}" if metric != "hourly" else metric_labels[metric]),
+            color=alt.Color("窓:N", title="窓"),
+            tooltip=[alt.Tooltip("日付:T"), "窓:N", alt.Tooltip("値:Q", format=",.0f")],
+        )
+        st.altair_chart(chart, width="stretch")
+        st.caption(f"点の数: {len(trend)}（表示範囲に合わせて日/週/月に間引き）")
+
+# -----------------------------
+# 取引先ミックス（月ごとのシェア / 推移 / 順位）
+# -----------------------------
+with st.expander("🧩 取引先ミックス"):
+    import altair as alt
+
+    _ct = current_tenant()
+    cmat = client_matrix(_ct, ledger_version(_ct), df)
+    if cmat.empty:
+        st.caption("データがありません")
+    else:
+        mix_months = cmat.index.tolist()
+        mix_month = st.selectbox("対象月", mix_months, index=len(mix_months) - 1, key="mix_month")
+        mix = ledger_core.client_mix(cmat, mix_month)
+        if mix.empty:
+            st.caption("この月は取引先別の売上がありません")
+        else:
+            st.dataframe(
+                mix,
+                width="stretch",
+                hide_index=True,
+                column_config={
+                    "売上": st.column_config.NumberColumn("売上", format="%d 円"),
+                    "シェア": st.column_config.ProgressColumn("シェア", format="percent", min_value=0, max_value=1),
+                    "前月差": st.column_config.NumberColumn("前月差", format="%+d 円"),
+                },
+            )
+
+        # 推移（直近12か月・月ごとの構成）
+        recent = cmat.iloc[-12:]
+        recent = recent.loc[:, recent.sum() != 0]
+        if not recent.empty:
+            long = recent.reset_index().melt(id_vars="月", var_name="取引先", value_name="売上")
+            chart = alt.Chart(long).mark_bar().encode(
+                x=alt.X("月:O", title=None),
+                y=alt.Y("売上:Q", stack="normalize", title="シェア"),
+                color=alt.Color("取引先:N"),
+                tooltip=["月:O", "取引先:N", alt.Tooltip("売上:Q", format=",.0f")],
+            )
+            st.altair_chart(chart, width="stretch")
+
 # -----------------------------
 # レポ生成（簡易：月次集計）
 # -----------------------------
@@ -811,7 +1532,8 @@ def build_month_report_simple(df: pd.DataFrame, month_str: str) -> str:
     lines.append(f"時給: {hourly:,} 円/h")
     return "\n".join(lines)
 
-def build_month_report_full(df: pd.DataFrame, month_str: str) -> str:
+def build_month_report_full(df: pd.DataFrame, month_str: str, profile=None) -> str:
+    """profile: ledger_core.earnings_profile の結果（当月の着地予測に使う / None なら予測なし）"""
     tmp = df.copy()
     tmp["日付"] = pd.to_datetime(tmp["日付"], errors="coerce")
     tmp = tmp.dropna(subset=["日付"])
@@ -980,6 +1702,17 @@ def build_month_report_full(df: pd.DataFrame, month_str: str) -> str:
 
         lines.append(f"5h+換算で必要: {need_5h_days}日（平均日給 {plan_daily:,}円ベース）")
 
+        # 着地予測（曜日×季節の実績プロファイルから）
+        if profile is not None:
+            fc = ledger_core.forecast_month(profile, today, sum_sales, MONTH_TARGET)
+            lines.append("")
+            lines.append("【着地予測（曜日×季節の実績から）】")
+            if fc["basis_days"] < ledger_core.PROFILE_MIN_DAYS:
+                lines.append("履歴が足りないため予測なし")
+            else:
+                lines.append(f"着地見込み: {fc['expected']:,}円（80%: {fc['low']:,}〜{fc['high']:,}円）")
+                lines.append(f"月40万 到達確率: {fc['prob'] * 100:.0f}%")
+
         # 月末プラン（最大7日表示）
         show_days = min(7, remain_days)
         if show_days > 0:
@@ -1289,17 +2022,19 @@ def build_year_report_full(df: pd.DataFrame, year: int) -> str:
 
     return "\n".join(lines)
 
-months = []
-if not df.empty:
-    dtmp = df.copy()
-    dtmp["日付"] = pd.to_datetime(dtmp["日付"], errors="coerce")
-    months = sorted(dtmp.dropna(subset=["日付"])["日付"].dt.to_period("M").astype(str).unique().tolist())
+@st.cache_data(show_spinner=False, max_entries=32)
+def month_report(tenant: str, ver: int, month_str: str, today: date, _df: pd.DataFrame) -> tuple[str, dict]:
+    """
+    月次レポ + ペース（テナント + 版 + 月 + 今日 ごとにキャッシュ）
+    - 中で date.today() を見て当月の残り日数 / 着地予測が変わるので「今日」もキーに入れる
+    """
+    month_df = period_frame(_df, month_str)
+    rep = build_month_report_full(month_df, month_str, profile=earnings_profile(tenant, ver, _df))
+    return rep, calc_month_pace(month_df, month_str, month_target=400000)
 
-years = []
-if not df.empty:
-    ytmp = df.copy()
-    ytmp["日付"] = pd.to_datetime(ytmp["日付"], errors="coerce")
-    years = sorted(ytmp.dropna(subset=["日付"])["日付"].dt.year.unique().tolist())
+# 月一覧 / 年一覧（テナント + 版 ごとにキャッシュ）
+_tenant = current_tenant()
+months, years = ledger_periods(_tenant, ledger_version(_tenant), df)
 
 cL, cR = st.columns(2)
 
@@ -1317,17 +2052,93 @@ with cR:
     gen_y = st.button("年次レポ生成")
 
 if gen_m and month_str:
-    rep = build_month_report_full(df, month_str)
+    rep, pace = month_report(_tenant, ledger_version(_tenant), month_str, date.today(), df)
     st.session_state["report_text"] = rep
-    st.session_state["pace_info"] = calc_month_pace(df, month_str, month_target=400000)
+    st.session_state["pace_info"] = pace
     st.session_state["report_kind"] = "month"
 
 if gen_y:
-    rep = build_year_report_full(df, int(sel_year))
+    rep = build_year_report_full(period_frame(df, int(sel_year)), int(sel_year))
     st.session_state["report_text"] = rep
     st.session_state["pace_info"] = None  # 年次ではペース判定は出さない
     st.session_state["report_kind"] = "year"
 
+# -----------------------------
+# レポ一括エクスポート（月次 × 12 + 年次 → zip）
+#   - 同じ版の df から各レポを並列に生成（レポ関数は st を呼ばない純粋な集計なのでスレッドで回せる）
+#   - 出来た順に zip へ書き込み（テキスト + 年ごとの Markdown）
+#   - zip はテナント + 版 + 対象 + 今日 ごとにプロセス内キャッシュ（当月レポのペース / 着地予測は今日で変わる。
+#     版や日付が変わったら古いものは捨てる）
+# -----------------------------
+@st.cache_resource
+def _report_zips() -> dict[tuple[str, int, str, date], bytes]:
+    return {}
+
+def export_reports_zip(df: pd.DataFrame, tenant: str, ver: int, scope: str, today: date,
+                       on_progress: Callable[[float, str], None] | None = None) -> bytes:
+    cache = _report_zips()
+    key = (tenant, ver, scope, today)
+    if key in cache:
+        return cache[key]
+
+    all_months, all_years = ledger_periods(tenant, ver, df)
+    target_years = all_years if scope == "全年" else [int(scope)]
+    jobs = [(int(m[:4]), m) for m in all_months if int(m[:4]) in target_years]
+    jobs += [(y, f"{y}_年次") for y in target_years]
+    profile = earnings_profile(tenant, ver, df)
+
+    def _build(job: tuple[int, str]) -> str:
+        y, name = job
+        if name.endswith("_年次"):
+            return build_year_report_full(period_frame(df, y), y)
+        return build_month_report_full(period_frame(df, name), name, profile=profile)
+
+    texts: dict[tuple[int, str], str] = {}
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with ThreadPoolExecutor(max_workers=min(8, max(1, len(jobs)))) as ex:
+            futs = {ex.submit(_build, job): job for job in jobs}
+            for i, fut in enumerate(as_completed(futs), start=1):
+                y, name = futs[fut]
+                texts[(y, name)] = fut.result()
+                zf.writestr(f"{y}/{name}.txt", texts[(y, name)])
+                if on_progress:
+                    on_progress(i / len(jobs), name)
+
+        # 年ごとに Markdown 1本（年次 → 月次の順）
+        for y in target_years:
+            names = [f"{y}_年次"] + sorted(n for (yy, n) in texts if yy == y and not n.endswith("_年次"))
+            md = [f"# {y} レポート", ""]
+            for n in names:
+                md += [f"## {n.replace('_', ' ')}", "", "```text", texts[(y, n)].strip("\n"), "```", ""]
+            zf.writestr(f"{y}/{y}_reports.md", "\n".join(md))
+
+    data = buf.getvalue()
+    for k in [k for k in cache if k[0] == tenant and (k[1] != ver or k[3] != today)]:
+        cache.pop(k, None)
+    cache[key] = data
+    return data
+
+with st.expander("📦 レポ一括エクスポート（zip）"):
+    scope = st.selectbox("対象", ["全年", *[str(y) for y in reversed(years)]], key="export_scope")
+    _ver, _today = ledger_version(_tenant), date.today()
+    zip_bytes = _report_zips().get((_tenant, _ver, scope, _today))
+    if zip_bytes is None and st.button("一括生成", key="btn_export_reports", disabled=not months):
+        bar = st.progress(0.0, text="生成中…")
+        zip_bytes = export_reports_zip(
+            df, _tenant, _ver, scope, _today,
+            on_progress=lambda p, name: bar.progress(p, text=f"生成中… {name}"),
+        )
+        bar.empty()
+    if zip_bytes is not None:
+        st.download_button(
+            label="📥 レポ一式をダウンロード（zip）",
+            data=zip_bytes,
+            file_name=f"reports_{scope}_{_today.isoformat()}.zip",
+            mime="application/zip",
+            key="dl_reports_zip",
+        )
+
 report_text = st.session_state.get("report_text", "")
 pace_info = st.session_state.get("pace_info", None)
 report_kind = st.session_state.get("report_kind", "month")
@@ -1358,3 +2169,200 @@ if report_text:
     """, unsafe_allow_html=True)
 
     st.code(report_text, language="text")
+
+# -----------------------------
+# バックグラウンドジョブ（scheduler）
+#   - rollups: 全テナントの台帳 / 日次フレーム / 月年一覧 / プロファイル / トレンド / 取引先行列 / 全件CSV / メモ検索の索引 を版ごとに作っておく
+#   - month_report: 当月レポ + ペース（date.today() で中身が変わるので日付が変わった直後にも作る）
+#   - backup: 1日1回 TEXT 台帳を BACKUP_DIR/<テナント>/<日付>.parquet へ（BACKUP_KEEP 世代 / 0 で無効）
+#   - changelog_prune: 1日1回 CHANGELOG_KEEP_DAYS（既定 90日 / 0 で無期限）より古い変更ログを捨てる
+#   - 登録は画面の実行ごと（同じ名前は関数だけ差し替え）。最初の登録直後に1回ずつ走る = 起動直後の温め
+#   - ジョブは画面の st.* を呼ばない（キャッシュ関数を同じキーで呼んで温めるだけ）
+# -----------------------------
+def _job_tenants() -> list[str]:
+    init_db()
+    with db_connect() as pcon:
+        with pcon.cursor() as cur:
+            return db_core.list_tenants(cur) or [default_tenant()]
+
+def job_rollups() -> None:
+    for tenant in _job_tenants():
+        ver = ledger_version(tenant)
+        ldf = _ledger_frame(tenant)
+        ledger_periods(tenant, ver, ldf)
+        earnings_profile(tenant, ver, ldf)
+        for zoom in ledger_core.TREND_ZOOMS:
+            trend_data(tenant, ver, zoom, ldf)
+        client_matrix(tenant, ver, ldf)
+        ledger_csv(tenant, ver, ldf)
+        warm_memo_index(tenant, ver)
+
+def job_month_report() -> None:
+    today = date.today()
+    for tenant in _job_tenants():
+        month_report(tenant, ledger_version(tenant), today.strftime("%Y-%m"), today, _ledger_frame(tenant))
+
+def _backup_dir(tenant: str) -> str:
+    base = os.getenv("BACKUP_DIR") or "backup"
+    return os.path.join(base, quote(tenant, safe=""))
+
+def job_backup() -> None:
+    keep = int(os.getenv("BACKUP_KEEP") or 14)
+    if keep <= 0:
+        return
+    today = date.today().isoformat()
+    for tenant in _job_tenants():
+        d = _backup_dir(tenant)
+        path = os.path.join(d, f"{today}.parquet")
+        if os.path.exists(path):
+            continue
+        os.makedirs(d, exist_ok=True)
+        # 未送信のジャーナルは含めない（DB + アーカイブの状態をそのまま残す）
+        bdf = ledger_core.expand_ledger(_load_df_cached(tenant, ledger_version(tenant)))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        bdf.to_parquet(tmp, compression="zstd", index=False)
+        os.replace(tmp, path)
+        for old in sorted(f for f in os.listdir(d) if f.endswith(".parquet"))[:-keep]:
+            os.remove(os.path.join(d, old))
+
+def job_prune_changes() -> None:
+    keep = int(os.getenv("CHANGELOG_KEEP_DAYS") or 90)
+    if keep <= 0:
+        return
+    init_db()
+    with db_connect() as pcon:
+        with pcon.cursor() as cur:
+            db_core.prune_changes(cur, keep)
+        pcon.commit()
+
+_job_every = float(os.getenv("SCHEDULER_ROLLUP_SEC") or 300)
+scheduler.register("rollups", job_rollups, every=_job_every, at_start=True)
+scheduler.register("month_report", job_month_report, every=_job_every, daily=True, at_start=True)
+scheduler.register("backup", job_backup, daily=True, at_start=True)
+scheduler.register("changelog_prune", job_prune_changes, daily=True)
+
+# -----------------------------
+# 起動計測（import / DB準備 / 初回描画までの内訳）
+# -----------------------------
+boot.first_paint()
+with st.sidebar.expander("⏱ 起動計測"):
+    st.caption(boot.summary())
+    st.caption(f"台帳メモリ: {len(df):,} 行 / {ledger_core.bytes_per_row(df):.0f} B/行")
+    _jobs = scheduler.status()
+    if _jobs:
+        st.dataframe(pd.DataFrame(_jobs), hide_index=True, width="stretch")
+
+# -----------------------------
+# メモリ予算（Railway はメモリで課金される）
+#   - セッション: session_state が SESSION_MEM_BUDGET_MB（既定 64）を超えたら、作り直せるキーを大きい順に捨てる
+#   - プロセス: RSS が PROCESS_MEM_BUDGET_MB（既定 0 = 見ない）を超えたら、st.cache_data / レポzip を大きい順に捨てる
+#     （スケジューラで MEMORY_CHECK_SEC ごと。捨てた集計は次に使う時 / rollups ジョブで作り直される）
+# -----------------------------
+# 代表キー -> 一緒に捨てるキー（どれも次の再描画 / ボタンで作り直せる）
+SESSION_RECLAIMABLE = {
+    "import_df": ["import_df", "import_check", "import_check_id"],   # アップロード中の CSV から読み直す
+    "report_text": ["report_text", "pace_info", "report_kind"],      # レポ生成ボタンで作り直す（集計はキャッシュ済み）
+}
+# 捨ててよい st.cache_data（台帳本体 _load_df_cached は全員が使う + mmap なので対象外）
+CACHE_RECLAIMABLE = {
+    f.__name__: f for f in (ledger_csv, month_report, trend_data, parsed_ledger, earnings_profile, ledger_periods, filtered_page)
+}
+
+def trim_session(sizes: dict[str, int]) -> list[str]:
+    """セッションが予算超過なら作り直せるキーを大きい順に捨てる（捨てた代表キーを返す）"""
+    budget = memory_monitor.budget_bytes("SESSION_MEM_BUDGET_MB", 64)
+    total = sum(sizes.values())
+    if not budget or total <= budget:
+        return []
+    groups = {k: sum(sizes.get(m, 0) for m in members) for k, members in SESSION_RECLAIMABLE.items()}
+    dropped = memory_monitor.pick_evictions(groups, total - budget)
+    for k in dropped:
+        for m in SESSION_RECLAIMABLE[k]:
+            st.session_state.pop(m, None)
+    return dropped
+
+def process_reclaimable() -> dict[str, int]:
+    sizes = {k: v for k, v in memory_monitor.cache_footprint().items() if k in CACHE_RECLAIMABLE}
+    sizes["_report_zips"] = sum(len(b) for b in list(_report_zips().values()))
+    return sizes
+
+def job_memory() -> None:
+    budget = memory_monitor.budget_bytes("PROCESS_MEM_BUDGET_MB", 0)
+    rss = memory_monitor.rss_bytes()
+    if not budget or rss <= budget:
+        return
+    dropped = memory_monitor.pick_evictions(process_reclaimable(), rss - budget)
+    for name in dropped:
+        if name == "_report_zips":
+            _report_zips().clear()
+        else:
+            CACHE_RECLAIMABLE[name].clear()
+    memory_monitor.release()
+    sys.stderr.write(
+        f"[MEM] rss={rss / memory_monitor.MB:.0f}MB budget={budget / memory_monitor.MB:.0f}MB "
+        f"dropped={','.join(dropped) or '-'} now={memory_monitor.rss_bytes() / memory_monitor.MB:.0f}MB\n"
+    ); sys.stderr.flush()
+
+scheduler.register("memory", job_memory, every=float(os.getenv("MEMORY_CHECK_SEC") or 60))
+
+_mem_sizes = memory_monitor.session_footprint(st.session_state)
+_mem_dropped = trim_session(_mem_sizes)
+if _mem_dropped:
+    st.sidebar.warning(f"このセッションが予算を超えたため破棄: {', '.join(_mem_dropped)}（必要なら作り直してください）")
+# 内訳（プロセス RSS / 全テナント共有のキャッシュ / tracemalloc）は運用向けなので管理者だけ
+if IS_ADMIN:
+    with st.sidebar.expander("🧠 メモリ"):
+        _rss = memory_monitor.rss_bytes()
+        _pbudget = memory_monitor.budget_bytes("PROCESS_MEM_BUDGET_MB", 0)
+        _sbudget = memory_monitor.budget_bytes("SESSION_MEM_BUDGET_MB", 64)
+        _stotal = sum(_mem_sizes.values())
+        st.caption(
+            f"プロセス RSS: {_rss / memory_monitor.MB:,.0f} MB"
+            + (f" / 予算 {_pbudget / memory_monitor.MB:,.0f} MB" if _pbudget else "")
+            + f"　このセッション: {_stotal / memory_monitor.MB:,.1f} MB / 予算 {_sbudget / memory_monitor.MB:,.0f} MB"
+        )
+        if _pbudget and _rss > _pbudget:
+            st.warning("プロセスのメモリが予算を超えています（キャッシュを順に捨てています）")
+        st.dataframe(
+            pd.DataFrame([{"キー": k, "KB": round(v / 1024, 1)} for k, v in list(_mem_sizes.items())[:10]]),
+            hide_index=True, width="stretch",
+        )
+        _cache_sizes = process_reclaimable()
+        st.dataframe(
+            pd.DataFrame([{"キャッシュ": k, "KB": round(v / 1024, 1)} for k, v in sorted(_cache_sizes.items(), key=lambda kv: -kv[1])]),
+            hide_index=True, width="stretch",
+        )
+        _allocs = memory_monitor.top_allocations()
+        if _allocs:
+            st.caption("tracemalloc: 確保の多い行")
+            st.dataframe(pd.DataFrame(_allocs), hide_index=True, width="stretch")
+
+# -----------------------------
+# 再描画プロファイル（どこが重いか: load_df / data_editor / CSV / レポ …）
+#   - PROFILE=1 で全セッション、トグルでこのセッションだけ。次の再描画から計測
+#   - 新しい PROFILE_KEEP 件をファイルで残す（collapsed 形式: speedscope / flamegraph.pl で開ける）
+#   - 全テナントの再描画が混ざるので、トグル / 一覧 / DL は管理者（ADMIN_USERS）だけ
+# -----------------------------
+drop_inflight()
+profiler.end()
+if IS_ADMIN:
+    with st.sidebar.expander("🔬 再描画プロファイル"):
+        st.toggle("このセッションの再描画を計測", key="profile_on", disabled=profiler.enabled_by_env())
+        _profs = {p["path"]: p for p in profiler.list_profiles()}
+        if not _profs:
+            st.caption("プロファイルはまだありません")
+        else:
+            _pick = st.selectbox(
+                "プロファイル",
+                list(_profs),
+                format_func=lambda k: f"{_profs[k]['時刻']} {_profs[k]['ms']:,}ms {_profs[k]['ラベル']}{' (中断)' if _profs[k]['中断'] else ''}",
+                key="profile_pick",
+            )
+            st.dataframe(pd.DataFrame(profiler.top_functions(_pick)), hide_index=True, width="stretch")
+            st.download_button(
+                "このプロファイルをDL",
+                data=profiler.read_profile(_pick),
+                file_name=os.path.basename(_pick),
+                mime="text/plain",
+                key="dl_profile",
+            )
@@ -0,0 +1,95 @@
+# archive_store.py
+"""
+年アーカイブ（締めた年 → 圧縮Parquet）のファイル操作
+- ARCHIVE_DIR/<テナント>/<年>.parquet（zstd / 中身は DB と同じ TEXT の COLUMNS）
+- 書き込みは一時ファイル → 読み戻して件数確認 → 置き換え（途中で落ちても元のファイルは壊さない）
+- 削除はアーカイブ側も書き直す（DB だけ消すと次の読み込みでアーカイブから復活するため）
+- st.* は使わない（バックグラウンドからも呼べるように）
+"""
+import os
+import threading
+from urllib.parse import quote
+
+import pandas as pd
+
+from db_core import COLUMNS
+
+# 同じプロセスの書き直しが交差しないように（別プロセスとは ARCHIVE_DIR を共有しない前提）
+_LOCK = threading.Lock()
+
+
+def archive_dir(tenant: str) -> str:
+    base = os.getenv("ARCHIVE_DIR") or "archive"
+    return os.path.join(base, quote(tenant, safe=""))
+
+
+def _year_path(tenant: str, year: int) -> str:
+    return os.path.join(archive_dir(tenant), f"{int(year)}.parquet")
+
+
+def archived_years(tenant: str) -> list[int]:
+    d = archive_dir(tenant)
+    if not os.path.isdir(d):
+        return []
+    out = []
+    for name in os.listdir(d):
+        stem, ext = os.path.splitext(name)
+        if ext == ".parquet" and stem.isdigit():
+            out.append(int(stem))
+    return sorted(out)
+
+
+def load_archive(tenant: str) -> pd.DataFrame:
+    frames = [pd.read_parquet(_year_path(tenant, y)) for y in archived_years(tenant)]
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _write(path: str, df: pd.DataFrame) -> None:
+    tmp_path = path + ".tmp"
+    df.sort_values("日付").to_parquet(tmp_path, compression="zstd", index=False)
+    if len(pd.read_parquet(tmp_path)) != len(df):
+        os.remove(tmp_path)
+        raise RuntimeError("アーカイブの読み戻し件数が一致しません")
+    os.replace(tmp_path, path)
+
+
+def write_year(tenant: str, year: int, rows: pd.DataFrame) -> int:
+    """その年のアーカイブに rows を足す（同じ日付は rows 側を優先）。書いた後の件数"""
+    path = _year_path(tenant, year)
+    with _LOCK:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arc = rows
+        if os.path.exists(path):
+            arc = pd.concat([pd.read_parquet(path), rows], ignore_index=True).drop_duplicates(subset=["日付"], keep="last")
+        _write(path, arc)
+        return len(arc)
+
+
+def delete_days(tenant: str, date_keys=(), month_prefix: str | None = None) -> int:
+    """
+    アーカイブから日付（date_keys / month_prefix='YYYY-MM' の月まるごと）を消す。消した行数
+    - その年のアーカイブが空になったらファイルごと消す
+    """
+    keys = {str(k) for k in date_keys}
+    years = {int(k[:4]) for k in keys if k[:4].isdigit()}
+    if month_prefix:
+        years.add(int(month_prefix[:4]))
+    removed = 0
+    with _LOCK:
+        for y in sorted(years & set(archived_years(tenant))):
+            path = _year_path(tenant, y)
+            arc = pd.read_parquet(path)
+            dates = arc["日付"].astype(str)
+            hit = dates.isin(keys)
+            if month_prefix:
+                hit |= dates.str.startswith(f"{month_prefix}-")
+            if not hit.any():
+                continue
+            removed += int(hit.sum())
+            if hit.all():
+                os.remove(path)
+            else:
+                _write(path, arc[~hit])
+    return removed
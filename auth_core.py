@@ -1,5 +1,9 @@
 # auth_core.py
+import base64
+import hashlib
+import hmac
 import os
+import time
 
 def is_railway_env(env: dict[str, str] | None = None) -> bool:
     env = env or os.environ
@@ -38,3 +42,140 @@ def load_credentials(env: dict[str, str] | None = None, secrets: dict | None = N
 
 def validate(username: str, password: str, expected_u: str, expected_p: str) -> bool:
     return (username == expected_u) and (password == expected_p)
+
+# -----------------------------
+# パスワードハッシュ（scrypt / PBKDF2）
+#   - 形式: scrypt$<n>$<r>$<p>$<salt>$<hash> / pbkdf2_sha256$<iter>$<salt>$<hash>（salt/hash は base64）
+#   - 生成: python auth_core.py
+# -----------------------------
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+PBKDF2_ITERATIONS = 600_000
+
+def _b64e(b: bytes) -> str:
+    return base64.b64encode(b).decode("ascii")
+
+def _b64d(s: str) -> bytes:
+    return base64.b64decode(s.encode("ascii"))
+
+def hash_password(password: str, method: str = "scrypt") -> str:
+    salt = os.urandom(16)
+    pw = password.encode("utf-8")
+    if method == "scrypt":
+        h = hashlib.scrypt(pw, salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64e(salt)}${_b64e(h)}"
+    if method == "pbkdf2_sha256":
+        h = hashlib.pbkdf2_hmac("sha256", pw, salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64e(salt)}${_b64e(h)}"
+    raise ValueError(f"unknown hash method: {method}")
+
+def verify_password(password: str, encoded: str) -> bool:
+    """形式が壊れている/未知の方式は False（例外にしない）"""
+    pw = password.encode("utf-8")
+    try:
+        parts = encoded.split("$")
+        if parts[0] == "scrypt" and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = _b64d(parts[4]), _b64d(parts[5])
+            h = hashlib.scrypt(pw, salt=salt, n=n, r=r, p=p, dklen=len(expected), maxmem=128 * r * (n + p + 2) * 2)
+        elif parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            iters = int(parts[1])
+            salt, expected = _b64d(parts[2]), _b64d(parts[3])
+            h = hashlib.pbkdf2_hmac("sha256", pw, salt, iters)
+        else:
+            return False
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(h, expected)
+
+# 存在しないユーザーでも同じだけ計算して、応答時間でユーザー有無が分からないようにする
+_DUMMY_HASH = None
+
+def _dummy_hash() -> str:
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = hash_password("dummy-password")
+    return _DUMMY_HASH
+
+# -----------------------------
+# 複数ユーザーの資格情報ストア（user -> ハッシュ）
+#   - env APP_USERS="alice:scrypt$...,bob:pbkdf2_sha256$..."
+#   - secrets [auth.users] alice = "scrypt$..."
+#   - 従来の APP_USERNAME/APP_PASSWORD（secrets auth.username/password）も読み込み時に1回だけハッシュ化して同居
+# -----------------------------
+def load_credential_store(env: dict[str, str] | None = None, secrets: dict | None = None) -> dict[str, str]:
+    env = env or os.environ
+    store: dict[str, str] = {}
+
+    for item in (env.get("APP_USERS") or "").split(","):
+        user, sep, encoded = item.strip().partition(":")
+        if sep and user and encoded:
+            store[user] = encoded
+
+    if secrets:
+        users = (secrets.get("auth", {}) or {}).get("users", {}) or {}
+        for user, encoded in dict(users).items():
+            if isinstance(encoded, str) and encoded:
+                store.setdefault(str(user), encoded)
+
+    u, p = load_credentials(env, secrets)
+    if u and p and u not in store:
+        store[u] = hash_password(p)
+
+    return store
+
+def verify_user(store: dict[str, str], username: str, password: str) -> bool:
+    encoded = store.get(username)
+    if encoded is None:
+        verify_password(password, _dummy_hash())
+        return False
+    return verify_password(password, encoded)
+
+# -----------------------------
+# 管理者（運用向けの画面: 再描画プロファイル / メモリ）
+#   - env ADMIN_USERS="alice,bob"（ログイン名）
+#   - 認証なし（ローカル開発 / user が None）は Railway 以外なら管理者扱い
+# -----------------------------
+def admin_users(env: dict[str, str] | None = None) -> set[str]:
+    env = env or os.environ
+    return {u.strip() for u in (env.get("ADMIN_USERS") or "").split(",") if u.strip()}
+
+def is_admin(user: str | None, env: dict[str, str] | None = None) -> bool:
+    env = env or os.environ
+    if not user:
+        return not is_railway_env(env)
+    return user in admin_users(env)
+
+# -----------------------------
+# セッショントークン（HMAC-SHA256 署名 / 期限つき）
+#   - ログイン後の rerun はトークン検証だけで通す（secrets 参照もハッシュ計算もしない）
+# -----------------------------
+def issue_token(username: str, key: bytes, ttl_sec: int = 12 * 3600, now: float | None = None) -> str:
+    exp = int((now if now is not None else time.time()) + ttl_sec)
+    body = base64.urlsafe_b64encode(f"{username}|{exp}".encode("utf-8")).decode("ascii")
+    sig = hmac.new(key, body.encode("ascii"), hashlib.sha256).hexdigest()
+    return f"{body}.{sig}"
+
+def verify_token(token: str, key: bytes, now: float | None = None) -> str | None:
+    """正しい署名かつ期限内ならユーザー名、それ以外は None"""
+    if not token or "." not in token:
+        return None
+    body, _, sig = token.rpartition(".")
+    expected = hmac.new(key, body.encode("ascii"), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(sig, expected):
+        return None
+    try:
+        username, _, exp = base64.urlsafe_b64decode(body.encode("ascii")).decode("utf-8").rpartition("|")
+        if int(exp) < (now if now is not None else time.time()):
+            return None
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return username or None
+
+
+if __name__ == "__main__":
+    # APP_USERS / secrets 用のハッシュを作る: python auth_core.py [scrypt|pbkdf2_sha256]
+    import getpass
+    import sys
+
+    method = sys.argv[1] if len(sys.argv) > 1 else "scrypt"
+    print(hash_password(getpass.getpass("password: "), method=method))
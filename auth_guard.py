@@ -2,7 +2,39 @@
 import os
 import streamlit as st
 
-from auth_core import should_skip_auth, load_credentials, validate
+from auth_core import (
+    should_skip_auth, is_railway_env, load_credential_store, verify_user, issue_token, verify_token,
+)
+
+# プロセス内で1回だけ作る（rerun ごとに secrets を dict 化しない）
+_STORE: dict[str, str] | None = None
+# トークン署名鍵：APP_SESSION_SECRET が無ければプロセスごとの乱数（再起動で全員ログアウト）
+_SIGNING_KEY: bytes = (os.environ.get("APP_SESSION_SECRET") or "").encode("utf-8") or os.urandom(32)
+SESSION_TTL_SEC = int(os.environ.get("APP_SESSION_TTL_SEC") or 12 * 3600)
+
+
+def _credential_store() -> dict[str, str]:
+    global _STORE
+    if _STORE is None:
+        # secrets 読み込み（環境によって例外になる可能性があるためガード）
+        secrets_dict = None
+        try:
+            secrets_dict = dict(st.secrets)
+        except Exception:
+            secrets_dict = None
+        # 認証情報取得（env優先 / secrets補助）
+        _STORE = load_credential_store(os.environ, secrets_dict)
+    return _STORE
+
+
+def _show_logged_in(user: str):
+    with st.sidebar:
+        st.success(f"ログイン中: {user}")
+        if st.button("ログアウト", key="btn_logout"):
+            st.session_state["authed"] = False
+            st.session_state.pop("auth_user", None)
+            st.session_state.pop("auth_token", None)
+            st.rerun()
 
 
 def auth_guard():
@@ -10,47 +42,42 @@ def auth_guard():
     - ローカルのみ認証スキップ（DEV用）
     - Railway本番は必ず認証
     - Enterでログイン可能（st.form）
+    - ログイン後は署名付きトークンだけで通す（secrets 参照 / ハッシュ検証をスキップ）
+    - 認証OKなら True を返す（NGは st.stop）
     """
 
     # 1) スキップ条件（ローカルのみ）
     if should_skip_auth(os.environ):
-        return
+        st.session_state["authed"] = True
+        return True
 
-    # 2) secrets 読み込み（環境によって例外になる可能性があるためガード）
-    secrets_dict = None
-    try:
-        secrets_dict = dict(st.secrets)
-    except Exception:
-        secrets_dict = None
+    # 2) ログイン済み：トークン検証だけ（安い経路）
+    user = verify_token(st.session_state.get("auth_token", ""), _SIGNING_KEY)
+    if user:
+        st.session_state["authed"] = True
+        st.session_state["auth_user"] = user
+        _show_logged_in(user)
+        return True
 
-    # 3) 認証情報取得（env優先 / secrets補助）
-    u, p = load_credentials(os.environ, secrets_dict)
+    # 3) 資格情報ストア（プロセス内キャッシュ）
+    store = _credential_store()
 
     # 4) ローカルで env も secrets も無いならスキップ（開発用）
     #    ※不要ならこの if ブロックを削除すると「常に認証必須」になる
-    if (not u and not p) and (not os.environ.get("RAILWAY_ENVIRONMENT")):
-        return
+    if not store and not is_railway_env(os.environ):
+        return True
 
     # 5) Railway / 本番で認証情報が無いのはエラー
-    if not u or not p:
-        st.error("認証設定がありません（APP_USERNAME/APP_PASSWORD または secrets.toml を設定）")
+    if not store:
+        st.error("認証設定がありません（APP_USERS / APP_USERNAME/APP_PASSWORD または secrets.toml を設定）")
         st.stop()
 
-    # 6) セッション初期化
-    if "authed" not in st.session_state:
-        st.session_state["authed"] = False
-
-    # 7) ログイン済み表示
-    if st.session_state["authed"]:
-        with st.sidebar:
-            st.success(f"ログイン中: {st.session_state.get('auth_user', '')}")
-            if st.button("ログアウト", key="btn_logout"):
-                st.session_state["authed"] = False
-                st.session_state.pop("auth_user", None)
-                st.rerun()
-        return
-
-    # 8) ログインフォーム（Enter送信OK）
+    # 6) トークン切れ/改ざんはログアウト扱い
+    st.session_state["authed"] = False
+    st.session_state.pop("auth_user", None)
+    st.session_state.pop("auth_token", None)
+
+    # 7) ログインフォーム（Enter送信OK）
     st.subheader("ログイン")
     with st.form("login_form", clear_on_submit=False):
         username = st.text_input("ユーザー名", key="login_username")
@@ -58,9 +85,10 @@ def auth_guard():
         submitted = st.form_submit_button("ログイン")
 
     if submitted:
-        if validate(username, password, u, p):
+        if verify_user(store, username, password):
             st.session_state["authed"] = True
             st.session_state["auth_user"] = username
+            st.session_state["auth_token"] = issue_token(username, _SIGNING_KEY, SESSION_TTL_SEC)
             st.rerun()
         else:
             st.error("ユーザー名/パスワードが違います")
@@ -0,0 +1,84 @@
+# boot.py
+"""
+起動計測 + バックグラウンド事前準備（プロセスで1回）
+- ログイン画面を出している間に pandas の import / DBプール接続 / スキーマ確認を済ませる
+- import 時間・DB準備・初回描画までの内訳を [BOOT] としてログに1行出す
+"""
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# このモジュールが最初に import された時刻（= プロセスで最初のスクリプト実行）
+T0 = time.perf_counter()
+
+_MARKS: dict[str, float] = {}   # 名前 -> ms（最初の計測だけ残す）
+_LOCK = threading.Lock()
+_PREWARM: threading.Thread | None = None
+_FIRST_PAINT_MS: float | None = None
+
+
+def record(name: str, ms: float) -> None:
+    with _LOCK:
+        _MARKS.setdefault(name, ms)
+
+
+@contextmanager
+def timed(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - t) * 1000)
+
+
+def timed_import(modname: str):
+    """未 import なら時間を計って import（済みなら計測しない）"""
+    if modname in sys.modules:
+        return sys.modules[modname]
+    with timed(f"import {modname}"):
+        return importlib.import_module(modname)
+
+
+def _prewarm():
+    timed_import("pandas")
+    try:
+        import db_core
+        timed_import("psycopg2")
+        with timed("db pool"):
+            db_core.get_pool()
+        with timed("db init_db"):
+            db_core.init_db()
+    except Exception as e:
+        # 事前準備の失敗は致命的ではない（本処理側で run_db がエラー表示する）
+        sys.stderr.write(f"[BOOT] prewarm failed: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+    record("prewarm done", (time.perf_counter() - T0) * 1000)
+
+
+def start_prewarm() -> None:
+    """プロセスで1回だけバックグラウンドで事前準備を開始"""
+    global _PREWARM
+    with _LOCK:
+        if _PREWARM is not None:
+            return
+        _PREWARM = threading.Thread(target=_prewarm, name="boot-prewarm", daemon=True)
+    _PREWARM.start()
+
+
+def first_paint() -> None:
+    """最初の全画面描画の終わりで呼ぶ（プロセスで1回だけログに出す）"""
+    global _FIRST_PAINT_MS
+    with _LOCK:
+        if _FIRST_PAINT_MS is not None:
+            return
+        _FIRST_PAINT_MS = (time.perf_counter() - T0) * 1000
+    sys.stderr.write(f"[BOOT] {summary()}\n"); sys.stderr.flush()
+
+
+def summary() -> str:
+    with _LOCK:
+        parts = [f"{k}={v:.0f}ms" for k, v in _MARKS.items()]
+        if _FIRST_PAINT_MS is not None:
+            parts.append(f"first_paint={_FIRST_PAINT_MS:.0f}ms")
+    return " / ".join(parts) if parts else "(計測なし)"
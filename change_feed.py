@@ -0,0 +1,102 @@
+# change_feed.py
+"""
+他プロセス（Railway のレプリカ / 再起動したワーカー）の書き込みを LISTEN で受けてキャッシュを捨てる
+- DB 側は records の文単位トリガーが NOTIFY（db_core._notify_trigger_sql）
+- 受けたらそのテナントの台帳バージョンだけ上げ、通知の日付を db_core.record_day_changes に記録する
+  → 版をキーにしたキャッシュはそのテナント分だけ作り直し、差分で持つもの（取引先ミックス / メモ索引 / 日付の窓）は
+    その日だけ反映（日付が多すぎて null の通知は記録しない = 作り直し）
+  （作り直しはスケジューラの集計ジョブを起こして裏で済ませる。当月レポは当月の日が変わった時だけ）
+- 自分のプロセスの書き込み（origin が同じ）は書いた側で版を上げ済みなので無視
+- 接続が切れたら張り直し。切れている間の通知は失われるので、復帰時に全テナントの版を上げる（まだ版を上げたことのないテナントも）
+- DB_LISTEN=0 で無効（単一プロセス運用など）/ DB_LISTEN_LOG=1 で受信をログに出す
+"""
+import json
+import os
+import random
+import select
+import sys
+import threading
+import time
+from datetime import date
+
+import db_core
+import scheduler
+
+_LOCK = threading.Lock()
+_LISTENER: threading.Thread | None = None
+KEEPALIVE_SEC = 60
+
+
+def handle(payload: str) -> bool:
+    """1通知を処理（他プロセス発なら True）"""
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        return False
+    if msg.get("origin") == db_core.ORIGIN or not msg.get("tenant"):
+        return False
+    dates = msg.get("dates")
+    ver = db_core.bump_ledger_version(msg["tenant"])
+    # 変わった日だけ記録 → 取引先ミックス / メモ索引 / 日付の窓 はその日だけ反映（dates=null は記録なし = 作り直し）
+    if dates is not None:
+        db_core.record_day_changes(msg["tenant"], ver, [(str(d), db_core.DAY_CHANGED) for d in dates])
+    # 次に開く人を待たずにバックグラウンドで作り直す（当月レポは当月の日が変わった時だけ）
+    scheduler.trigger("rollups")
+    month = date.today().strftime("%Y-%m")
+    if dates is None or any(str(d).startswith(month) for d in dates):
+        scheduler.trigger("month_report")
+    if os.getenv("DB_LISTEN_LOG") == "1":
+        sys.stderr.write(
+            f"[FEED] {msg['tenant']} ver={ver} dates={len(dates) if dates is not None else 'all'} from={msg.get('origin')}\n"
+        ); sys.stderr.flush()
+    return True
+
+
+def _listen_once(first: bool) -> None:
+    """LISTEN して通知を待ち続ける（接続が切れたら例外で戻る）"""
+    import psycopg2
+
+    con = psycopg2.connect(db_core.pg_url())
+    try:
+        con.autocommit = True
+        with con.cursor() as cur:
+            cur.execute(f'LISTEN "{db_core.NOTIFY_CHANNEL}";')
+        # 張り直し（2回目以降）の間に来た通知は取りこぼしているので全体を捨てる
+        if not first:
+            db_core.bump_all_ledger_versions()
+        while True:
+            if select.select([con], [], [], KEEPALIVE_SEC) == ([], [], []):
+                with con.cursor() as cur:
+                    cur.execute("SELECT 1;")
+            con.poll()
+            while con.notifies:
+                handle(con.notifies.pop(0).payload)
+    finally:
+        con.close()
+
+
+def _listen_loop():
+    first, backoff = True, 1.0
+    while True:
+        started = time.monotonic()
+        try:
+            _listen_once(first)
+        except Exception as e:
+            if not db_core.is_connection_error(e):
+                sys.stderr.write(f"[FEED] listener failed: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+        first = False
+        # しばらく繋がっていたなら待ち時間はリセット（続けて失敗する時だけ伸ばす）
+        backoff = 1.0 if time.monotonic() - started > KEEPALIVE_SEC else min(backoff * 2, 60.0)
+        time.sleep(backoff * random.uniform(0.8, 1.2))
+
+
+def start_listener() -> None:
+    """プロセスで1回だけリスナースレッドを開始"""
+    global _LISTENER
+    if os.getenv("DB_LISTEN") == "0":
+        return
+    with _LOCK:
+        if _LISTENER is not None:
+            return
+        _LISTENER = threading.Thread(target=_listen_loop, name="change-feed", daemon=True)
+    _LISTENER.start()
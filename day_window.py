@@ -0,0 +1,105 @@
+# day_window.py
+"""
+日付切替の先読み窓と描画開始時の同時読み込み（セッションごと。st は触らないので state には st.session_state を渡す）
+- 選んだ日の前後 PREFETCH_DAYS 日を1回の範囲クエリで読み、state["day_window"] に持つ（行バージョン込み）
+- 台帳の版が進んだら、差分の記録（db_core.day_changes）にある日だけ窓から外す（記録が無い版があれば窓ごと捨てる）
+- このセッションの保存 / 削除は窓の中身を直接差し替える（他の経路の変更だけ外して、次にその日を選んだ時に読み直す）
+- 窓の外 / 外した日を選んだ時だけ読み直す（窓の中で行が無い日 = 未入力）
+"""
+import os
+from concurrent.futures import Future
+from datetime import date, timedelta
+from typing import Callable
+
+import db_core
+from db_core import COLUMNS
+
+PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS") or 7)
+
+
+def bounds(date_key: str) -> tuple[str, str]:
+    """date_key を中心にした窓の両端（YYYY-MM-DD）"""
+    d = date.fromisoformat(date_key)
+    return (d - timedelta(days=PREFETCH_DAYS)).isoformat(), (d + timedelta(days=PREFETCH_DAYS)).isoformat()
+
+
+def build(tenant: str, ver: int, lo: str, hi: str, rows: list[tuple]) -> dict:
+    """db_core.select_days の結果から窓を作る（版 ver の時点で読んだもの）"""
+    return {"tenant": tenant, "ver": ver, "lo": lo, "hi": hi, "rows": {r[0]: r for r in rows}, "stale": set()}
+
+
+def catch_up(win: dict, tenant: str, ver: int) -> bool:
+    """窓を版 ver まで進める（その間に変わった日は外す）。差分の記録が欠けていれば False"""
+    if win["ver"] > ver:
+        return False
+    changes = db_core.day_changes(tenant, win["ver"], ver)
+    if changes is None:
+        return False
+    win["stale"].update(k for k, _row in changes)
+    win["ver"] = ver
+    return True
+
+
+def usable(state, tenant: str, date_key: str, ver: int) -> dict | None:
+    """セッションの窓がそのまま使えれば返す（版が進んでいれば変わった日を外してから判定）"""
+    win = state.get("day_window")
+    if win is None or win["tenant"] != tenant or not catch_up(win, tenant, ver):
+        return None
+    if win["lo"] <= date_key <= win["hi"] and date_key not in win["stale"]:
+        return win
+    return None
+
+
+def apply(state, tenant: str, ver: int, changes: list[tuple[str, dict | None]]) -> None:
+    """このセッションの保存 / 削除（版 ver）を窓に直接反映（外して読み直しにしない）"""
+    win = state.get("day_window")
+    if win is None or win["tenant"] != tenant:
+        return
+    if not catch_up(win, tenant, ver - 1):
+        state.pop("day_window", None)
+        return
+    vers = state.get("row_vers", {})
+    for k, row in changes:
+        win["stale"].discard(k)
+        if row is None:
+            win["rows"].pop(k, None)
+        else:
+            # DB に入る形（upsert_day と同じ: None は空文字 / すべて文字列）+ 行バージョン
+            win["rows"][k] = (*("" if row.get(c) is None else str(row.get(c, "")) for c in COLUMNS), vers.get(k, 0))
+    win["ver"] = ver
+
+
+# -----------------------------
+# 描画開始時の同時読み込み（投げてある読み込みは state["_inflight"] = {種類: (キー, Future)}）
+#   - 台帳と窓は別々の往復なので、窓で足りない時だけ両方をワーカーに投げ、待つのは遅い方の1往復分
+#   - ワーカーは DB を読んで値を返すだけ（st は触らない）。state への反映は受け取った側のスレッドで
+#   - 受け取り手がキーの違う読み込みを見つけたら取り消す / 残った分は再描画の末尾で drop_inflight
+# -----------------------------
+def start_fetches(state, pool, tenant: str, date_key: str, ver: int,
+                  load_ledger: Callable, fetch_window: Callable, has_pending: Callable[[str, str], bool]) -> None:
+    """選択日を読む直前に呼ぶ。窓が足りない時だけ load_ledger(tenant, ver) と fetch_window(tenant, date_key, ver) を pool に投げる"""
+    drop_inflight(state)
+    # 窓で足りる / 未送信のジャーナルが答える日は DB に行かない（投げても受け取り手がいない）
+    if usable(state, tenant, date_key, ver) is not None or has_pending(tenant, date_key):
+        return
+    state["_inflight"] = {
+        "ledger": ((tenant, ver), pool.submit(load_ledger, tenant, ver)),
+        "window": ((tenant, date_key), pool.submit(fetch_window, tenant, date_key, ver)),
+    }
+
+
+def take_inflight(state, kind: str, key: tuple) -> Future | None:
+    """投げてある読み込み（キーが違えば取り消して None）"""
+    ent = state.get("_inflight", {}).pop(kind, None)
+    if ent is None:
+        return None
+    if ent[0] != key:
+        ent[1].cancel()
+        return None
+    return ent[1]
+
+
+def drop_inflight(state) -> None:
+    """受け取られなかった読み込みを取り消す（走り出した分は終わり次第捨てる）"""
+    for _key, fut in state.pop("_inflight", {}).values():
+        fut.cancel()
@@ -0,0 +1,898 @@
+# db_core.py
+"""
+DB層（Supabase/Postgres 固定）
+- st.* の UI は使わない（バックグラウンドスレッドからも呼ぶため）
+- psycopg2 は初回接続時に import（ログイン画面までを軽くする）
+- 接続はプロセス共有のプール / スキーマ確認はプロセスで1回
+"""
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+# -----------------------------
+# スキーマ
+# -----------------------------
+TABLE = "records"
+
+# テナント（ドライバー）列：PK は (ドライバー, 日付)
+TENANT_COL = "ドライバー"
+
+# 取引先（売上）
+CLIENT_COLS = ["U", "出", "R", "W", "menu", "しょんぴ", "Afrex", "Afresh", "ハコベル", "pickg", "その他"]
+
+# スキーマ（並び保証）
+COLUMNS = [
+    "日付", "合計売上", "合計h", "frex h", "fresh h", "他 h", "合計時給", "5h+", "警告",
+    *CLIENT_COLS,
+    "メモ"
+]
+
+# 行バージョン（更新のたびに +1）
+VER_COL = "ver"
+
+# サーバー側 upsert 関数（DB_UPSERT_FUNC=1 で使用）
+UPSERT_FUNC = f"{TABLE}_upsert_day"
+
+# 変更ログ（追記のみ / 時点復元用）
+CHANGELOG_TABLE = f"{TABLE}_changelog"
+
+# 変更通知（NOTIFY）のチャンネル / このプロセスの識別子（自分の書き込みの通知は無視する）
+NOTIFY_CHANNEL = f"{TABLE}_changed"
+# メモ検索用の trigram インデックス（pg_trgm）
+MEMO_INDEX = f"{TABLE}_memo_trgm"
+# 絞り込み用の型付き生成列（TEXT 列から DB が計算 / 読み書きの列には含めない）
+FILTER_COLS = ["hourly_yen", "client_bits", "flag_bits"]
+FILTER_FLAGS = {"5h+": 1, "警告": 2}
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+
+# -----------------------------
+# 接続
+#   - SUPABASE_DB_URL が必須（env → st.secrets の順）
+# -----------------------------
+def pg_url() -> str:
+    url = os.getenv("SUPABASE_DB_URL") or ""
+    if not url:
+        import streamlit as st
+        url = st.secrets.get("SUPABASE_DB_URL", "")
+    if not url:
+        raise RuntimeError("SUPABASE_DB_URL が未設定だよ（Railway Variables / ローカルsecrets を確認）")
+    if "sslmode=" not in url:
+        url += ("&" if "?" in url else "?") + "sslmode=require"
+    if "connect_timeout=" not in url:
+        url += ("&" if "?" in url else "?") + "connect_timeout=5"
+    return url
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _connection_factory():
+    """接続ごとに PREPARE 済みの文名を覚えておく connection"""
+    import psycopg2.extensions
+
+    class PreparedConnection(psycopg2.extensions.connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared: set[str] = set()
+            # 変更通知トリガーが送り主を入れられるように（接続ごとに1回）
+            with self.cursor() as cur:
+                cur.execute("SELECT set_config('app.origin', %s, false);", (ORIGIN,))
+            self.commit()
+
+    return PreparedConnection
+
+def get_pool():
+    """ThreadedConnectionPool（最初の1本はここで張る＝事前ウォームアップ）"""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                _POOL = ThreadedConnectionPool(
+                    1, int(os.getenv("DB_POOL_MAX") or 8), dsn=pg_url(), connection_factory=_connection_factory(),
+                )
+    return _POOL
+
+# -----------------------------
+# サーキットブレーカー（プロセス共有 = 全セッション共通）
+#   - 「DBに届かなかった」失敗が DB_BREAKER_FAILS 回続いたら開く
+#   - 開いている間の connect() は接続を試さず即 CircuitOpen（接続タイムアウトを待たない）
+#     → is_connection_error 扱いなので、画面はスナップショット表示 / 保存は端末内ジャーナルへ
+#   - 開いた後は裏のスレッドが DB_BREAKER_PROBE_SEC ごとに1本だけ試し接続（半開）。通れば閉じる
+#   - 接続の取得は DB_RETRIES 回までジッター付きで再試行（合計 DB_RETRY_MAX_SEC 秒まで / 閉じている時だけ）
+# -----------------------------
+class CircuitOpen(Exception):
+    """ブレーカーが開いている（DBに行かずに失敗させた）"""
+
+_BREAKER_LOCK = threading.Lock()
+_BREAKER = {"fails": 0, "opened_at": None, "last_error": ""}
+_PROBER: threading.Thread | None = None
+
+def breaker_state() -> dict:
+    """{"open": bool, "opened_at": epoch秒 or None, "fails": 連続失敗数, "last_error": str}"""
+    with _BREAKER_LOCK:
+        return {**_BREAKER, "open": _BREAKER["opened_at"] is not None}
+
+def _breaker_failure(e: BaseException) -> None:
+    global _PROBER
+    with _BREAKER_LOCK:
+        _BREAKER["fails"] += 1
+        _BREAKER["last_error"] = f"{type(e).__name__}: {e}".strip()
+        if _BREAKER["opened_at"] is not None or _BREAKER["fails"] < int(os.getenv("DB_BREAKER_FAILS") or 3):
+            return
+        _BREAKER["opened_at"] = time.time()
+        if _PROBER is None:
+            _PROBER = threading.Thread(target=_probe_loop, name="db-breaker-probe", daemon=True)
+            _PROBER.start()
+    sys.stderr.write(f"[DB] circuit open: {_BREAKER['last_error']}\n"); sys.stderr.flush()
+
+def _breaker_success() -> None:
+    with _BREAKER_LOCK:
+        _BREAKER["fails"] = 0
+
+def _probe_loop():
+    """開いている間だけ動く（閉じたら終わる）"""
+    global _PROBER
+    import psycopg2
+
+    interval = float(os.getenv("DB_BREAKER_PROBE_SEC") or 10)
+    while True:
+        time.sleep(interval * random.uniform(0.8, 1.2))
+        try:
+            psycopg2.connect(pg_url()).close()
+        except Exception as e:
+            with _BREAKER_LOCK:
+                _BREAKER["last_error"] = f"{type(e).__name__}: {e}".strip()
+            continue
+        with _BREAKER_LOCK:
+            _BREAKER.update(fails=0, opened_at=None, last_error="")
+            _PROBER = None
+        sys.stderr.write("[DB] circuit closed\n"); sys.stderr.flush()
+        return
+
+def _acquire():
+    """(pool, 接続)。届かない / プールが空の時はジッター付きで少しだけ再試行"""
+    from psycopg2.pool import PoolError
+
+    retries = int(os.getenv("DB_RETRIES") or 2)
+    deadline = time.monotonic() + float(os.getenv("DB_RETRY_MAX_SEC") or 2)
+    attempt = 0
+    while True:
+        if _BREAKER["opened_at"] is not None:
+            raise CircuitOpen(f"DB circuit open ({_BREAKER['last_error']})")
+        try:
+            pool = get_pool()
+            con = pool.getconn()
+            if con.closed:
+                pool.putconn(con, close=True)
+                con = pool.getconn()
+            return pool, con
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            delay = 0.1 * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if attempt >= retries or time.monotonic() + delay > deadline:
+                # プールの空きが無いだけなら DB は生きている（ブレーカーは数えない）
+                if not isinstance(e, PoolError):
+                    _breaker_failure(e)
+                raise
+            attempt += 1
+            time.sleep(delay)
+
+@contextmanager
+def connect():
+    """
+    プールから借りて返す（with で使う）
+    - ブレーカーが開いていれば接続を試さず CircuitOpen
+    - 例外時は rollback して返却。接続が死んでいたら捨てる（次は張り直し）
+    - 未コミットのまま返した接続はプール側で rollback される
+    """
+    import psycopg2
+
+    pool, con = _acquire()
+    try:
+        yield con
+    except Exception as e:
+        broken = bool(con.closed) or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not broken:
+            try:
+                con.rollback()
+            except Exception:
+                broken = True
+        closed = bool(con.closed)   # 接続ごと切れた（クエリ単位の失敗はブレーカーに数えない）
+        pool.putconn(con, close=broken)
+        if closed:
+            _breaker_failure(e)
+        raise
+    else:
+        pool.putconn(con)
+        _breaker_success()
+
+# -----------------------------
+# プリペアドステートメント
+#   - SQL は $1, $2 ... で書く（同じ番号を何回使ってもOK / SQL 内に % は書かない）
+#   - 接続ごとに最初の1回だけ PREPARE、以降は EXECUTE のみ（プラン再利用）
+#   - DB_PREPARE=0 なら毎回そのまま実行（pgbouncer の transaction mode など PREPARE が使えない経路向け）
+# -----------------------------
+def _prepare_enabled() -> bool:
+    return os.getenv("DB_PREPARE", "1") != "0"
+
+def execute_prepared(cur, name: str, sql: str, params) -> None:
+    params = list(params)
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None or not _prepare_enabled():
+        cur.execute(re.sub(r"\$(\d+)", r"%(p\1)s", sql), {f"p{i}": v for i, v in enumerate(params, start=1)})
+        return
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+def is_connection_error(e: BaseException) -> bool:
+    """DBに届かなかった系の失敗（オフライン扱いにしてよいもの）"""
+    import psycopg2
+    from psycopg2.pool import PoolError
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError, CircuitOpen))
+
+# -----------------------------
+# テナント（ドライバー）
+#   - 認証なし（ローカル）は APP_TENANT → APP_USERNAME → "default"
+# -----------------------------
+def default_tenant() -> str:
+    return os.getenv("APP_TENANT") or os.getenv("APP_USERNAME") or "default"
+
+# -----------------------------
+# テナント別の台帳バージョン（プロセス内で共有）
+#   - 書き込みのたびに上げる → 版をキーにしたキャッシュが自然に無効化
+#   - バックグラウンドスレッド（ジャーナル再送など）からも上げられるようにここに置く
+#   - 版 = テナントの書き込み回数 + プロセス全体の世代（_EPOCH）。世代を上げると一度も書いていないテナントも版が進む
+# -----------------------------
+_LEDGER_VERSIONS: dict[str, int] = {}
+_EPOCH = 0
+_LEDGER_LOCK = threading.Lock()
+
+def ledger_version(tenant: str) -> int:
+    return _LEDGER_VERSIONS.get(tenant, 0) + _EPOCH
+
+def bump_ledger_version(tenant: str) -> int:
+    with _LEDGER_LOCK:
+        _LEDGER_VERSIONS[tenant] = _LEDGER_VERSIONS.get(tenant, 0) + 1
+        return _LEDGER_VERSIONS[tenant] + _EPOCH
+
+def bump_all_ledger_versions() -> None:
+    """通知を取りこぼした可能性がある時（リスナー再接続など）。全テナントの版が進み、差分の記録も無いので作り直しになる"""
+    global _EPOCH
+    with _LEDGER_LOCK:
+        _EPOCH += 1
+
+# -----------------------------
+# 版ごとの変わった日（プロセス内で共有）
+#   - (テナント, 版) -> [(日付, 新しい行 dict / None = 削除 / DAY_CHANGED = 日付だけわかっている)]
+#   - 自分の保存 / 削除は行まで、他プロセスの通知（change_feed）は日付だけ記録
+#   - 取引先ミックス / メモ検索の索引 / 日付切替の窓 はこれを見て変わった日だけ反映（記録が欠けた版があれば作り直し）
+# -----------------------------
+DAY_CHANGED = object()
+DAY_CHANGES_KEEP = 32
+_DAY_CHANGES: dict[tuple[str, int], list[tuple[str, object]]] = {}
+
+def record_day_changes(tenant: str, ver: int, changes: list[tuple[str, object]]) -> None:
+    with _LEDGER_LOCK:
+        _DAY_CHANGES[(tenant, ver)] = list(changes)
+        # 古い記録は捨てる（使う側が追いついた後は不要）
+        for k in [k for k in _DAY_CHANGES if k[0] == tenant and k[1] <= ver - DAY_CHANGES_KEEP]:
+            del _DAY_CHANGES[k]
+
+def day_changes(tenant: str, since: int, ver: int) -> list[tuple[str, object]] | None:
+    """版 since の後 〜 ver までに変わった日（古い順）。記録が欠けた版があれば None"""
+    with _LEDGER_LOCK:
+        out = []
+        for v in range(since + 1, ver + 1):
+            changes = _DAY_CHANGES.get((tenant, v))
+            if changes is None:
+                return None
+            out.extend(changes)
+        return out
+
+# -----------------------------
+# スキーマ作成/移行（プロセスで1回）
+# -----------------------------
+def _year_partition(year: int) -> str:
+    return f"{TABLE}_y{year}"
+
+def _create_records_sql() -> str:
+    """年単位の宣言的パーティション（RANGE on 日付 / ISO文字列なので COLLATE "C" で辞書順=日付順）"""
+    col_defs = [f'"{TENANT_COL}" TEXT NOT NULL']
+    for c in COLUMNS:
+        if c == "日付":
+            col_defs.append(f'"{c}" TEXT COLLATE "C" NOT NULL')
+        else:
+            col_defs.append(f'"{c}" TEXT')
+    col_defs.append(f'PRIMARY KEY ("{TENANT_COL}", "日付")')
+
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{TABLE}" (\n  ' + ",\n  ".join(col_defs) + '\n) PARTITION BY RANGE ("日付");\n'
+        f'CREATE TABLE IF NOT EXISTS "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT;'
+    )
+
+# このプロセスで作成確認済みの年パーティション
+_KNOWN_PARTITIONS: set[int] = set()
+
+def _ensure_year_partitions_cur(cur, years) -> list[int]:
+    created = []
+    for y in sorted({int(y) for y in years}):
+        if y in _KNOWN_PARTITIONS:
+            continue
+        cur.execute(
+            f'CREATE TABLE IF NOT EXISTS "{_year_partition(y)}" PARTITION OF "{TABLE}" '
+            f"FOR VALUES FROM ('{y:04d}') TO ('{y + 1:04d}');"
+        )
+        created.append(y)
+    return created
+
+def ensure_year_partitions(years) -> None:
+    """書き込み前に対象年のパーティションを用意（DEFAULT に入ると後から年パーティションを作れなくなるため）"""
+    years = {int(y) for y in years} - _KNOWN_PARTITIONS
+    if not years:
+        return
+    with connect() as pcon:
+        with pcon.cursor() as cur:
+            created = _ensure_year_partitions_cur(cur, years)
+        pcon.commit()
+    _KNOWN_PARTITIONS.update(created)
+
+def years_of(date_keys) -> set[int]:
+    out = set()
+    for k in date_keys:
+        k = str(k)
+        if len(k) >= 4 and k[:4].isdigit():
+            out.add(int(k[:4]))
+    return out
+
+_SCHEMA_READY = False
+_SCHEMA_LOCK = threading.Lock()
+
+def init_db(tenant_for_legacy: str | None = None, force: bool = False):
+    """
+    Postgres にテーブルが無ければ作る（全カラムTEXT / PK=(ドライバー, 日付) / 年パーティション）
+    - プロセスで1回だけ（2回目以降は即 return）
+    - 旧スキーマ（PK=日付 / ドライバー列なし）は既存行を tenant_for_legacy に寄せて移行
+    - 旧スキーマ（非パーティション）は年パーティションへ移し替え（1トランザクション）
+    """
+    global _SCHEMA_READY
+    if _SCHEMA_READY and not force:
+        return
+    with _SCHEMA_LOCK:
+        if _SCHEMA_READY and not force:
+            return
+        _init_db(tenant_for_legacy or default_tenant())
+        _SCHEMA_READY = True
+
+def _init_db(tenant_for_legacy: str):
+    # 旧テーブル移行：列追加（既存行は tenant_for_legacy）→ PK を (ドライバー, 日付) に張り替え
+    migrate_tenant_sql = f'''
+        DO $$
+        DECLARE pk_name TEXT;
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                 WHERE table_name = '{TABLE}' AND column_name = '{TENANT_COL}'
+            ) THEN
+                ALTER TABLE "{TABLE}" ADD COLUMN "{TENANT_COL}" TEXT NOT NULL DEFAULT %s;
+                ALTER TABLE "{TABLE}" ALTER COLUMN "{TENANT_COL}" DROP DEFAULT;
+            END IF;
+
+            SELECT conname INTO pk_name FROM pg_constraint
+             WHERE conrelid = '"{TABLE}"'::regclass AND contype = 'p' AND array_length(conkey, 1) = 1;
+            IF pk_name IS NOT NULL THEN
+                EXECUTE format('ALTER TABLE "{TABLE}" DROP CONSTRAINT %%I', pk_name);
+                ALTER TABLE "{TABLE}" ADD PRIMARY KEY ("{TENANT_COL}", "日付");
+            END IF;
+        END $$;
+    '''
+
+    legacy = f"{TABLE}_legacy"
+    colnames = ", ".join([f'"{c}"' for c in [TENANT_COL, *COLUMNS]])
+
+    with connect() as pcon:
+        with pcon.cursor() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (f'"{TABLE}"',))
+            r = cur.fetchone()
+            relkind = r[0] if r else None
+
+            if relkind == "r":
+                # 非パーティションの旧テーブル → 退避して年パーティションへ詰め替え
+                cur.execute(migrate_tenant_sql, (tenant_for_legacy,))
+                cur.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{legacy}";')
+                cur.execute(
+                    "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p';",
+                    (f'"{legacy}"',),
+                )
+                pk = cur.fetchone()
+                if pk:
+                    cur.execute(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{pk[0]}" TO "{legacy}_pkey";')
+                cur.execute(_create_records_sql())
+                cur.execute(f'''SELECT DISTINCT substr("日付", 1, 4) FROM "{legacy}" WHERE "日付" ~ '^[0-9]{{4}}';''')
+                _KNOWN_PARTITIONS.clear()
+                created = _ensure_year_partitions_cur(cur, [int(y) for (y,) in cur.fetchall()])
+                cur.execute(f'INSERT INTO "{TABLE}" ({colnames}) SELECT {colnames} FROM "{legacy}";')
+                cur.execute(f'DROP TABLE "{legacy}";')
+            else:
+                cur.execute(_create_records_sql())
+                created = []
+
+            created += _ensure_year_partitions_cur(cur, [date.today().year])
+
+            # 行バージョン列 + サーバー側 upsert 関数
+            cur.execute(f'ALTER TABLE "{TABLE}" ADD COLUMN IF NOT EXISTS "{VER_COL}" BIGINT NOT NULL DEFAULT 1;')
+            cur.execute(_filter_columns_sql())
+            cur.execute(_upsert_func_sql())
+            cur.execute(_notify_trigger_sql())
+            cur.execute(_changelog_sql())
+            _ensure_memo_index(cur)
+        pcon.commit()
+    _KNOWN_PARTITIONS.update(created)
+
+# -----------------------------
+# 変更通知（書き込みのたびに NOTIFY → 各プロセスのリスナーがそのテナントのキャッシュだけ捨てる）
+#   - 文単位トリガー + 遷移テーブルなので、どの書き込み経路（保存/削除/CSV/アーカイブ/再送）でも1文1通知
+#   - payload: {"origin", "tenant", "dates"（多すぎる時は null = 全体）, "ver"（行バージョンの最大）}
+# -----------------------------
+NOTIFY_MAX_DATES = 200
+
+def _notify_trigger_sql() -> str:
+    def _loop(rows: str) -> str:
+        return f'''
+            FOR r IN
+                SELECT "{TENANT_COL}" AS tenant, array_agg(DISTINCT "日付") AS dates, max("{VER_COL}") AS ver
+                  FROM {rows} GROUP BY "{TENANT_COL}"
+            LOOP
+                PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object(
+                    'origin', current_setting('app.origin', true),
+                    'tenant', r.tenant,
+                    'dates', CASE WHEN cardinality(r.dates) > {NOTIFY_MAX_DATES} THEN NULL ELSE r.dates END,
+                    'ver', r.ver
+                )::text);
+            END LOOP;'''
+
+    func = f"{TABLE}_notify"
+    return f'''
+        CREATE OR REPLACE FUNCTION "{func}"() RETURNS trigger
+        LANGUAGE plpgsql AS $fn$
+        DECLARE r RECORD;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN{_loop("old_rows")}
+            ELSE{_loop("new_rows")}
+            END IF;
+            RETURN NULL;
+        END
+        $fn$;
+        CREATE OR REPLACE TRIGGER "{func}_ins" AFTER INSERT ON "{TABLE}"
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION "{func}"();
+        CREATE OR REPLACE TRIGGER "{func}_upd" AFTER UPDATE ON "{TABLE}"
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION "{func}"();
+        CREATE OR REPLACE TRIGGER "{func}_del" AFTER DELETE ON "{TABLE}"
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION "{func}"();
+    '''
+
+# -----------------------------
+# 変更ログ（追記のみ）
+#   - 通知と同じく文単位トリガー + 遷移テーブルで、どの書き込み経路でも1文1回の INSERT ... SELECT
+#   - 1行 = (ts, テナント, 日付, op I/U/D, source, 変更前, 変更後)。行は JSONB で空欄の列は持たない
+#   - source は書き込み側がトランザクション内で set_source（未設定なら 'sql'）
+#   - 値が変わらない UPDATE（同じ内容の上書き保存）は残さない
+# -----------------------------
+def _changelog_sql() -> str:
+    log, func, compact = CHANGELOG_TABLE, f"{TABLE}_changelog", f"{TABLE}_compact"
+    key = f'"{TENANT_COL}", "日付"'
+    return f'''
+        CREATE TABLE IF NOT EXISTS "{log}" (
+            id BIGSERIAL PRIMARY KEY,
+            ts TIMESTAMPTZ NOT NULL DEFAULT now(),
+            "{TENANT_COL}" TEXT NOT NULL,
+            "日付" TEXT NOT NULL,
+            op CHAR(1) NOT NULL,
+            source TEXT NOT NULL,
+            old_row JSONB,
+            new_row JSONB
+        );
+        CREATE INDEX IF NOT EXISTS "{log}_key" ON "{log}" ({key}, id);
+        CREATE INDEX IF NOT EXISTS "{log}_ts" ON "{log}" USING brin (ts);
+
+        CREATE OR REPLACE FUNCTION "{compact}"(j JSONB) RETURNS JSONB
+        LANGUAGE sql IMMUTABLE AS $fn$
+            SELECT COALESCE(jsonb_object_agg(key, value), '{{}}'::jsonb)
+              FROM jsonb_each(j - '{TENANT_COL}' - '日付' - '{{{",".join(FILTER_COLS)}}}'::text[])
+             WHERE value NOT IN ('""'::jsonb, 'null'::jsonb)
+        $fn$;
+
+        CREATE OR REPLACE FUNCTION "{func}"() RETURNS trigger
+        LANGUAGE plpgsql AS $fn$
+        DECLARE src TEXT := COALESCE(NULLIF(current_setting('app.source', true), ''), 'sql');
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO "{log}" ({key}, op, source, new_row)
+                SELECT n."{TENANT_COL}", n."日付", 'I', src, "{compact}"(to_jsonb(n)) FROM new_rows n;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO "{log}" ({key}, op, source, old_row, new_row)
+                SELECT n."{TENANT_COL}", n."日付", 'U', src, "{compact}"(to_jsonb(o)), "{compact}"(to_jsonb(n))
+                  FROM new_rows n JOIN old_rows o USING ({key})
+                 WHERE "{compact}"(to_jsonb(o)) - '{VER_COL}' IS DISTINCT FROM "{compact}"(to_jsonb(n)) - '{VER_COL}';
+            ELSE
+                INSERT INTO "{log}" ({key}, op, source, old_row)
+                SELECT o."{TENANT_COL}", o."日付", 'D', src, "{compact}"(to_jsonb(o)) FROM old_rows o;
+            END IF;
+            RETURN NULL;
+        END
+        $fn$;
+        CREATE OR REPLACE TRIGGER "{func}_ins" AFTER INSERT ON "{TABLE}"
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION "{func}"();
+        CREATE OR REPLACE TRIGGER "{func}_upd" AFTER UPDATE ON "{TABLE}"
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION "{func}"();
+        CREATE OR REPLACE TRIGGER "{func}_del" AFTER DELETE ON "{TABLE}"
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION "{func}"();
+    '''
+
+SOURCES = ("ui", "import", "bulk", "archive", "journal", "restore")
+
+def set_source(cur, source: str) -> None:
+    """このトランザクションの書き込みの出どころ（変更ログの source / commit・rollback で元に戻る）"""
+    cur.execute("SELECT set_config('app.source', %s, true);", (source,))
+
+def list_changes(cur, tenant: str, limit: int = 200) -> list[tuple]:
+    """新しい順: (id, ts, 日付, op, source, old_row, new_row)"""
+    cur.execute(
+        f'''SELECT id, ts, "日付", op, source, old_row, new_row FROM "{CHANGELOG_TABLE}"
+            WHERE "{TENANT_COL}" = %s ORDER BY id DESC LIMIT %s;''',
+        (tenant, limit),
+    )
+    return cur.fetchall()
+
+def _changed_since_sql() -> str:
+    # 範囲内で at より後に変更があった日ごとに「at より後の最初の変更の old_row」= at 時点の行（NULL = 無かった）
+    return f'''
+        SELECT DISTINCT ON ("日付") "日付", old_row
+          FROM "{CHANGELOG_TABLE}"
+         WHERE "{TENANT_COL}" = %(t)s AND ts > %(at)s
+           AND (%(lo)s::text IS NULL OR "日付" >= %(lo)s) AND (%(hi)s::text IS NULL OR "日付" < %(hi)s)
+         ORDER BY "日付", id
+    '''
+
+def restore_preview(cur, tenant: str, at, lo: str | None = None, hi: str | None = None) -> list[tuple[str, bool]]:
+    """時点復元で今と変わる日: (日付, 行が残るか)。lo/hi は日付の範囲 [lo, hi)（None = 端なし）"""
+    compact = f"{TABLE}_compact"
+    cur.execute(
+        f'''WITH f AS ({_changed_since_sql()})
+            SELECT f."日付", f.old_row IS NOT NULL
+              FROM f LEFT JOIN "{TABLE}" r ON r."{TENANT_COL}" = %(t)s AND r."日付" = f."日付"
+             WHERE f.old_row - '{VER_COL}' IS DISTINCT FROM
+                   CASE WHEN r."日付" IS NULL THEN NULL ELSE "{compact}"(to_jsonb(r)) - '{VER_COL}' END
+             ORDER BY 1;''',
+        {"t": tenant, "at": at, "lo": lo, "hi": hi},
+    )
+    return cur.fetchall()
+
+def restore_to(cur, tenant: str, at, lo: str | None = None, hi: str | None = None) -> int:
+    """
+    日付の範囲 [lo, hi)（None = 全体）を時刻 at の状態に戻す（DELETE + upsert を1文で）
+    - at より後に変更が無い日は触らない / 内容が同じ行は書かない
+    - 戻した書き込みも変更ログに残る（source='restore'）→ 復元自体も戻せる
+    - 戻り値: 変わった行数
+    """
+    years = {int(d[:4]) for d, _ in restore_preview(cur, tenant, at, lo, hi) if d[:4].isdigit()}
+    _ensure_year_partitions_cur(cur, years)
+    set_source(cur, "restore")
+    cols = [c for c in COLUMNS if c != "日付"]
+    values = ", ".join([f"COALESCE(f.old_row->>'{c}', '')" for c in cols])
+    colnames = ", ".join([f'"{c}"' for c in cols])
+    cur.execute(
+        f'''
+        WITH f AS ({_changed_since_sql()}),
+        del AS (
+            DELETE FROM "{TABLE}" r USING f
+             WHERE r."{TENANT_COL}" = %(t)s AND r."日付" = f."日付" AND f.old_row IS NULL
+            RETURNING 1
+        ),
+        up AS (
+            INSERT INTO "{TABLE}" ("{TENANT_COL}", "日付", {colnames})
+            SELECT %(t)s, f."日付", {values} FROM f WHERE f.old_row IS NOT NULL
+            ON CONFLICT ("{TENANT_COL}", "日付") DO UPDATE SET
+            {_UPDATE_SET}, "{VER_COL}" = "{TABLE}"."{VER_COL}" + 1
+            WHERE ({", ".join([f'"{TABLE}"."{c}"' for c in cols])}) IS DISTINCT FROM ({", ".join([f'EXCLUDED."{c}"' for c in cols])})
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM del) + (SELECT count(*) FROM up);
+        ''',
+        {"t": tenant, "at": at, "lo": lo, "hi": hi},
+    )
+    return int(cur.fetchone()[0])
+
+def prune_changes(cur, keep_days: int) -> int:
+    """keep_days より古い変更ログを捨てる（それより前の時点には戻せなくなる）"""
+    cur.execute(f'DELETE FROM "{CHANGELOG_TABLE}" WHERE ts < now() - make_interval(days => %s);', (keep_days,))
+    return cur.rowcount
+
+# -----------------------------
+# メモ / 日付検索（pg_trgm の GIN インデックスで ILIKE '%語%' を引く）
+#   - 拡張を作れない DB（権限なし等）ではインデックス無しで続行（検索は走査になるだけ）
+#   - 語の分け方 / 正規化は ledger_core.parse_query と同じ（画面のプロセス内インデックスと結果を揃える）
+# -----------------------------
+def _ensure_memo_index(cur) -> bool:
+    cur.execute("SAVEPOINT memo_trgm;")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cur.execute(f'CREATE INDEX IF NOT EXISTS "{MEMO_INDEX}" ON "{TABLE}" USING gin ("メモ" gin_trgm_ops);')
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT memo_trgm;")
+        sys.stderr.write(f"[DB] memo trigram index skipped: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+        return False
+    cur.execute("RELEASE SAVEPOINT memo_trgm;")
+    return True
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_memos(cur, tenant: str, words: list[str], prefixes: list[str], limit: int = 200) -> list[tuple]:
+    """メモに words をすべて含み、日付が prefixes すべてに前方一致する日 [(日付, 合計売上, 合計h, メモ)]（新しい順）"""
+    conds, params = [f'"{TENANT_COL}" = %s'], [tenant]
+    for w in words:
+        conds.append('"メモ" ILIKE %s')
+        params.append(f"%{_like_escape(w)}%")
+    for p in prefixes:
+        conds.append('"日付" LIKE %s')
+        params.append(f"{_like_escape(p)}%")
+    cur.execute(
+        f'SELECT "日付", "合計売上", "合計h", "メモ" FROM "{TABLE}" WHERE {" AND ".join(conds)} '
+        f'ORDER BY "日付" DESC LIMIT %s;',
+        (*params, limit),
+    )
+    return cur.fetchall()
+
+# -----------------------------
+# 条件での絞り込み（期間 / 取引先あり / 時給の上下限 / 5h+・警告）
+#   - TEXT 列から型付きの生成列（STORED）を DB 側で持つ → 条件はすべてパラメータ付き SQL で DB に渡す
+#       hourly_yen: 合計時給（円 / 数値でなければ NULL）/ client_bits: CLIENT_COLS の並びで「空欄・0 以外」なら 1bit
+#       flag_bits: FILTER_FLAGS（5h+ = 1 / 警告 = 2）
+#   - 期間は主キー (テナント, 日付) の範囲、時給は (テナント, hourly_yen) の索引で引く
+# -----------------------------
+def _filter_columns_sql() -> str:
+    num = "\"合計時給\""
+    clients = " | ".join(
+        f"(CASE WHEN COALESCE(\"{c}\", '') NOT IN ('', '0') THEN {1 << i} ELSE 0 END)" for i, c in enumerate(CLIENT_COLS)
+    )
+    flags = " | ".join(f"(CASE WHEN COALESCE(\"{c}\", '') <> '' THEN {b} ELSE 0 END)" for c, b in FILTER_FLAGS.items())
+    return f'''
+        ALTER TABLE "{TABLE}" ADD COLUMN IF NOT EXISTS hourly_yen BIGINT GENERATED ALWAYS AS (
+            CASE WHEN {num} ~ '^-?[0-9]{{1,12}}(\\.[0-9]+)?$' THEN round({num}::numeric)::bigint END
+        ) STORED;
+        ALTER TABLE "{TABLE}" ADD COLUMN IF NOT EXISTS client_bits INTEGER GENERATED ALWAYS AS ({clients}) STORED;
+        ALTER TABLE "{TABLE}" ADD COLUMN IF NOT EXISTS flag_bits SMALLINT GENERATED ALWAYS AS ({flags}) STORED;
+        CREATE INDEX IF NOT EXISTS "{TABLE}_hourly" ON "{TABLE}" ("{TENANT_COL}", hourly_yen);
+    '''
+
+def filter_sql(tenant: str, date_from: str | None = None, date_to: str | None = None, clients=(),
+               hourly_min: int | None = None, hourly_max: int | None = None, flags=()) -> tuple[str, list]:
+    """条件 → (WHERE 句, パラメータ)。date_to / hourly_max も含む。clients / flags はすべて満たす日"""
+    conds, params = [f'"{TENANT_COL}" = %s'], [tenant]
+    if date_from:
+        conds.append('"日付" >= %s')
+        params.append(date_from)
+    if date_to:
+        conds.append('"日付" <= %s')
+        params.append(date_to)
+    mask = sum(1 << CLIENT_COLS.index(c) for c in clients)
+    if mask:
+        conds.append("client_bits & %s = %s")
+        params += [mask, mask]
+    if hourly_min is not None:
+        conds.append("hourly_yen >= %s")
+        params.append(int(hourly_min))
+    if hourly_max is not None:
+        conds.append("hourly_yen <= %s")
+        params.append(int(hourly_max))
+    fmask = sum(FILTER_FLAGS[f] for f in flags)
+    if fmask:
+        conds.append("flag_bits & %s = %s")
+        params += [fmask, fmask]
+    return " AND ".join(conds), params
+
+def filter_days(cur, tenant: str, limit: int = 50, offset: int = 0, **flt) -> tuple[list[tuple], int]:
+    """条件に合う日（COLUMNS の並び / 新しい順）の1ページ分と全件数"""
+    where, params = filter_sql(tenant, **flt)
+    cur.execute(
+        f'SELECT {_COLNAMES}, count(*) OVER () FROM "{TABLE}" WHERE {where} ORDER BY "日付" DESC LIMIT %s OFFSET %s;',
+        (*params, limit, offset),
+    )
+    rows = cur.fetchall()
+    if rows:
+        return [r[:-1] for r in rows], int(rows[0][-1])
+    if offset:
+        # ページが範囲外でも件数は返す
+        cur.execute(f'SELECT count(*) FROM "{TABLE}" WHERE {where};', params)
+        return [], int(cur.fetchone()[0])
+    return [], 0
+
+# -----------------------------
+# 読み書き（テナント単位）
+# -----------------------------
+_COLNAMES = ", ".join([f'"{c}"' for c in COLUMNS])
+_UPDATE_SET = ", ".join([f'"{c}"=EXCLUDED."{c}"' for c in COLUMNS if c != "日付"])
+
+def _upsert_func_sql() -> str:
+    """1日分を upsert して新しい行バージョンを返す（plpgsql なのでプランは関数内でキャッシュされる）"""
+    values = ", ".join([f"COALESCE(p_row->>'{c}', '')" for c in COLUMNS])
+    return f'''
+        CREATE OR REPLACE FUNCTION "{UPSERT_FUNC}"(p_tenant TEXT, p_row JSONB) RETURNS BIGINT
+        LANGUAGE plpgsql AS $fn$
+        DECLARE v BIGINT;
+        BEGIN
+            INSERT INTO "{TABLE}" ("{TENANT_COL}", {_COLNAMES})
+            VALUES (p_tenant, {values})
+            ON CONFLICT ("{TENANT_COL}", "日付") DO UPDATE SET
+            {_UPDATE_SET}, "{VER_COL}" = "{TABLE}"."{VER_COL}" + 1
+            RETURNING "{VER_COL}" INTO v;
+            RETURN v;
+        END
+        $fn$;
+    '''
+
+def _use_upsert_func() -> bool:
+    return os.getenv("DB_UPSERT_FUNC") == "1"
+
+def select_all(cur, tenant: str) -> list[tuple]:
+    execute_prepared(
+        cur, "records_select_all",
+        f'SELECT {_COLNAMES} FROM "{TABLE}" WHERE "{TENANT_COL}" = $1',
+        (tenant,),
+    )
+    return cur.fetchall()
+
+def list_tenants(cur) -> list[str]:
+    """台帳に行があるテナント（バックグラウンドのキャッシュ温め / バックアップ用）"""
+    cur.execute(f'SELECT DISTINCT "{TENANT_COL}" FROM "{TABLE}" ORDER BY 1;')
+    return [r[0] for r in cur.fetchall()]
+
+# チェックサム：件数 + 行（全列 + ver）のハッシュ合計（順序に依存しない / スナップショットの照合用）
+_ROW_HASH = "hashtextextended(r::text, 0)"
+
+def select_all_checked(cur, tenant: str) -> tuple[list[tuple], str]:
+    """全行 + 同じ文（同じスナップショット）で取ったチェックサム"""
+    execute_prepared(
+        cur, "records_select_all_checked",
+        f'SELECT {_COLNAMES}, count(*) OVER (), sum({_ROW_HASH}) OVER () FROM "{TABLE}" AS r WHERE "{TENANT_COL}" = $1',
+        (tenant,),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return [], "0:0"
+    n, h = rows[0][-2], rows[0][-1]
+    return [r[:-2] for r in rows], f"{n}:{h}"
+
+def ledger_checksum(cur, tenant: str) -> str:
+    execute_prepared(
+        cur, "records_checksum",
+        f'SELECT count(*), COALESCE(sum({_ROW_HASH}), 0) FROM "{TABLE}" AS r WHERE "{TENANT_COL}" = $1',
+        (tenant,),
+    )
+    n, h = cur.fetchone()
+    return f"{n}:{h}"
+
+def select_day(cur, tenant: str, date_key: str) -> tuple | None:
+    """COLUMNS の並び + 末尾に行バージョン"""
+    execute_prepared(
+        cur, "records_select_day_v",
+        f'SELECT {_COLNAMES}, "{VER_COL}" FROM "{TABLE}" WHERE "{TENANT_COL}" = $1 AND "日付" = $2 LIMIT 1',
+        (tenant, date_key),
+    )
+    return cur.fetchone()
+
+def select_days(cur, tenant: str, date_from: str, date_to: str) -> list[tuple]:
+    """期間（両端含む）の日を 日付順に。並びは select_day と同じ（COLUMNS + 行バージョン）"""
+    execute_prepared(
+        cur, "records_select_days_v",
+        f'SELECT {_COLNAMES}, "{VER_COL}" FROM "{TABLE}" WHERE "{TENANT_COL}" = $1 AND "日付" BETWEEN $2 AND $3 ORDER BY "日付"',
+        (tenant, date_from, date_to),
+    )
+    return cur.fetchall()
+
+def upsert_day(cur, tenant: str, row: dict) -> int:
+    """1日分を upsert して新しい行バージョンを返す（新規行は 1）"""
+    values = ["" if row.get(c) is None else str(row.get(c, "")) for c in COLUMNS]
+    if _use_upsert_func():
+        cur.execute(f'SELECT "{UPSERT_FUNC}"(%s, %s::jsonb);', (tenant, json.dumps(dict(zip(COLUMNS, values)), ensure_ascii=False)))
+        return int(cur.fetchone()[0])
+
+    placeholders = ", ".join([f"${i}" for i in range(2, len(COLUMNS) + 2)])
+    execute_prepared(
+        cur, "records_upsert_day",
+        f'''INSERT INTO "{TABLE}" ("{TENANT_COL}", {_COLNAMES})
+            VALUES ($1, {placeholders})
+            ON CONFLICT ("{TENANT_COL}", "日付") DO UPDATE SET
+            {_UPDATE_SET}, "{VER_COL}" = "{TABLE}"."{VER_COL}" + 1
+            RETURNING "{VER_COL}"''',
+        [tenant, *values],
+    )
+    return int(cur.fetchone()[0])
+
+def delete_days(cur, tenant: str, date_keys) -> int:
+    """= ANY(配列) なので件数が変わっても同じプランを使い回せる"""
+    execute_prepared(
+        cur, "records_delete_days",
+        f'DELETE FROM "{TABLE}" WHERE "{TENANT_COL}" = $1 AND "日付" = ANY($2::text[])',
+        (tenant, [str(k) for k in date_keys]),
+    )
+    return cur.rowcount
+
+def delete_month(cur, tenant: str, month_prefix: str) -> int:
+    """month_prefix='YYYY-MM' の月まるごと（範囲条件も付けてパーティションを絞り込む）"""
+    y, mo = map(int, month_prefix.split("-"))
+    next_prefix = f"{y + 1:04d}-01" if mo == 12 else f"{y:04d}-{mo + 1:02d}"
+    cur.execute(
+        f'''DELETE FROM "{TABLE}"
+             WHERE "{TENANT_COL}" = %s AND "日付" LIKE %s AND "日付" >= %s AND "日付" < %s;''',
+        (tenant, f"{month_prefix}-%", month_prefix, next_prefix),
+    )
+    return cur.rowcount
+
+# -----------------------------
+# 条件付き書き込み（ジャーナル再送用）
+#   - base_ver: 編集の元にした行バージョン（0 = 行が無かった）
+#   - DB側の行が base_ver から進んでいたら書かずに None / False（＝競合）
+# -----------------------------
+def upsert_day_if_ver(cur, tenant: str, row: dict, base_ver: int | None) -> int | None:
+    """書けたら新しい行バージョン、競合なら None（base_ver=None は無条件）"""
+    values = ["" if row.get(c) is None else str(row.get(c, "")) for c in COLUMNS]
+    placeholders = ", ".join([f"${i}" for i in range(2, len(COLUMNS) + 2)])
+    n = len(COLUMNS) + 2
+    execute_prepared(
+        cur, "records_upsert_day_if_ver",
+        f'''INSERT INTO "{TABLE}" ("{TENANT_COL}", {_COLNAMES})
+            VALUES ($1, {placeholders})
+            ON CONFLICT ("{TENANT_COL}", "日付") DO UPDATE SET
+            {_UPDATE_SET}, "{VER_COL}" = "{TABLE}"."{VER_COL}" + 1
+            WHERE ${n}::bigint IS NULL OR "{TABLE}"."{VER_COL}" = ${n}::bigint
+            RETURNING "{VER_COL}"''',
+        [tenant, *values, base_ver],
+    )
+    r = cur.fetchone()
+    return int(r[0]) if r else None
+
+def delete_day_if_ver(cur, tenant: str, date_key: str, base_ver: int | None) -> bool:
+    """消せた/元から無い → True、別の更新が入っていた → False"""
+    execute_prepared(
+        cur, "records_delete_day_if_ver",
+        f'''WITH d AS (
+                DELETE FROM "{TABLE}"
+                 WHERE "{TENANT_COL}" = $1 AND "日付" = $2 AND ($3::bigint IS NULL OR "{VER_COL}" = $3::bigint)
+                RETURNING 1
+            )
+            SELECT EXISTS (SELECT 1 FROM d)
+                OR NOT EXISTS (SELECT 1 FROM "{TABLE}" WHERE "{TENANT_COL}" = $1 AND "日付" = $2)''',
+        (tenant, date_key, base_ver),
+    )
+    return bool(cur.fetchone()[0])
+
+# -----------------------------
+# 列のまとめて更新（派生列の全件再計算など）
+#   - 列ごとの配列を unnest して UPDATE ... FROM の1文で更新（行数に関係なく1往復）
+# -----------------------------
+def update_columns(cur, tenant: str, cols: list[str], rows: list[tuple]) -> int:
+    """rows: (日付, *cols の値) のリスト。値が変わる行だけ更新して行バージョンを上げる"""
+    if not rows:
+        return 0
+    arrays = [list(a) for a in zip(*rows)]
+    aliases = [f"c{i}" for i in range(len(cols))]
+    set_sql = ", ".join([f'"{c}" = v.{a}' for c, a in zip(cols, aliases)])
+    changed = " OR ".join([f'r."{c}" IS DISTINCT FROM v.{a}' for c, a in zip(cols, aliases)])
+    cur.execute(
+        f'''UPDATE "{TABLE}" AS r SET {set_sql}, "{VER_COL}" = r."{VER_COL}" + 1
+            FROM unnest(%s::text[], {", ".join(["%s::text[]"] * len(cols))}) AS v(d, {", ".join(aliases)})
+            WHERE r."{TENANT_COL}" = %s AND r."日付" = v.d AND ({changed})''',
+        [*arrays, tenant],
+    )
+    return cur.rowcount
@@ -0,0 +1,306 @@
+# journal.py
+"""
+オフライン書き込みジャーナル（SQLite / 追記型）
+- DBに届かなかった保存・削除をローカルに残し、復帰後にバックグラウンドでまとめて再送する
+- 競合判定は行バージョン：編集の元にした ver から DB 側が進んでいたら上書きせず「競合」として残す
+- 同じ日付の未送信操作は1件にまとめる（最後の状態だけ送る / 元にした ver は最初のものを保持）
+- 複数プロセスが同じファイルを再送しても二重に送らない（BEGIN IMMEDIATE で未送信行に取り分の印を付けてから送る）
+- JOURNAL_PATH（既定 journal.sqlite3）/ JOURNAL_REPLAY_SEC（既定 15秒）/ JOURNAL_BATCH（既定 200件）/ JOURNAL_CLAIM_SEC（取り分の期限。既定 300秒）
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import db_core
+import scheduler
+
+STATUS_PENDING = "pending"
+STATUS_CONFLICT = "conflict"
+
+# 再送中の追記を待たせる（同じプロセスの再送と追記のまとめ処理が交差して偽の競合にならないように）
+#   別プロセス（ワーカー / レプリカ）とは ops.claim の取り合い（BEGIN IMMEDIATE）で同じ行を二重に送らない
+_LOCK = threading.RLock()
+_REPLAYER: threading.Thread | None = None
+
+# プロセスで共有する接続（スキーマ作成は開いた時の1回だけ / 使う間は _CON_LOCK で直列化）
+_CON_LOCK = threading.RLock()
+_CON: sqlite3.Connection | None = None
+_CON_PATH: str | None = None
+
+
+def _path() -> str:
+    return os.getenv("JOURNAL_PATH") or "journal.sqlite3"
+
+
+def _claim_ttl() -> float:
+    """再送の取り分の期限（これを過ぎたら落ちたプロセスの分とみなして取り直す）"""
+    return float(os.getenv("JOURNAL_CLAIM_SEC") or 300)
+
+
+def _open(path: str) -> sqlite3.Connection:
+    # トランザクションは _tx で明示（BEGIN IMMEDIATE）するので autocommit
+    con = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ops (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant TEXT NOT NULL,
+            op TEXT NOT NULL,            -- upsert / delete
+            date_key TEXT NOT NULL,
+            row_json TEXT,
+            base_ver INTEGER,            -- 編集の元にした行バージョン（0 = 行が無かった / NULL = 無条件）
+            ts REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            claim TEXT,                  -- 再送中のプロセスの印（NULL = 誰も送っていない）
+            claim_ts REAL
+        );
+        """
+    )
+    # 旧スキーマ（claim なし）に列を足す
+    cols = {r["name"] for r in con.execute("PRAGMA table_info(ops)")}
+    for name, typ in (("claim", "TEXT"), ("claim_ts", "REAL")):
+        if name not in cols:
+            try:
+                con.execute(f"ALTER TABLE ops ADD COLUMN {name} {typ}")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):   # 別プロセスが先に足した
+                    raise
+    con.execute("CREATE INDEX IF NOT EXISTS ops_tenant_date ON ops (tenant, date_key);")
+    return con
+
+
+@contextmanager
+def _db():
+    """プロセスで共有する接続（JOURNAL_PATH が変わったら開き直す）"""
+    global _CON, _CON_PATH
+    with _CON_LOCK:
+        path = _path()
+        if _CON is None or _CON_PATH != path:
+            if _CON is not None:
+                _CON.close()
+            _CON, _CON_PATH = _open(path), path
+        yield _CON
+
+
+@contextmanager
+def _tx(con: sqlite3.Connection):
+    """書き込みトランザクション（最初に書き込みロックを取るので、別プロセスとの読んでから書くが交差しない）"""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+
+
+def _rows(cur) -> list[dict]:
+    out = []
+    for r in cur.fetchall():
+        d = dict(r)
+        raw = d.pop("row_json", None)
+        d["row"] = json.loads(raw) if raw else None
+        out.append(d)
+    return out
+
+
+# -----------------------------
+# 追記（同じ日付の未送信は1件にまとめる）
+# -----------------------------
+def append(tenant: str, op: str, date_key: str, row: dict | None, base_ver: int | None) -> None:
+    now = time.time()
+    with _LOCK, _db() as con, _tx(con):
+        # 別プロセスが送っている最中の行には混ぜない（後ろに積む。送り終わるまで再送の対象にもならない）
+        prev = con.execute(
+            "SELECT id, op, base_ver FROM ops WHERE tenant = ? AND date_key = ? AND status = ?"
+            " AND (claim IS NULL OR claim_ts < ?) ORDER BY id DESC LIMIT 1",
+            (tenant, date_key, STATUS_PENDING, now - _claim_ttl()),
+        ).fetchone()
+        if prev is not None:
+            base_ver = prev["base_ver"]
+            con.execute("DELETE FROM ops WHERE id = ?", (prev["id"],))
+        # 元々無かった行を作って消しただけなら何も送らない
+        if not (prev is not None and op == "delete" and base_ver == 0):
+            con.execute(
+                "INSERT INTO ops (tenant, op, date_key, row_json, base_ver, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (tenant, op, date_key, json.dumps(row, ensure_ascii=False) if row is not None else None,
+                 base_ver, now),
+            )
+    # 画面の一覧は未送信分を重ねて表示するのでキャッシュを無効化
+    db_core.bump_ledger_version(tenant)
+
+
+def entries(tenant: str, status: str | None = None) -> list[dict]:
+    if not os.path.exists(_path()):
+        return []
+    with _db() as con:
+        if status is None:
+            cur = con.execute("SELECT * FROM ops WHERE tenant = ? ORDER BY id", (tenant,))
+        else:
+            cur = con.execute("SELECT * FROM ops WHERE tenant = ? AND status = ? ORDER BY id", (tenant, status))
+        return _rows(cur)
+
+
+def has_pending(tenant: str, date_key: str) -> bool:
+    if not os.path.exists(_path()):
+        return False
+    with _db() as con:
+        r = con.execute(
+            "SELECT 1 FROM ops WHERE tenant = ? AND date_key = ? AND status = ? LIMIT 1",
+            (tenant, date_key, STATUS_PENDING),
+        ).fetchone()
+        return r is not None
+
+
+def _tenant_of(con: sqlite3.Connection, entry_id: int) -> str | None:
+    r = con.execute("SELECT tenant FROM ops WHERE id = ?", (entry_id,)).fetchone()
+    return r["tenant"] if r is not None else None
+
+
+def discard(entry_id: int) -> None:
+    with _LOCK, _db() as con, _tx(con):
+        tenant = _tenant_of(con, entry_id)
+        con.execute("DELETE FROM ops WHERE id = ?", (entry_id,))
+    # 画面の一覧は未送信分を重ねて表示するので、行の出入りがあれば版を上げる
+    if tenant is not None:
+        db_core.bump_ledger_version(tenant)
+
+
+def force(entry_id: int) -> None:
+    """競合を「ジャーナル側で上書き」にして再送待ちへ戻す"""
+    with _LOCK, _db() as con, _tx(con):
+        tenant = _tenant_of(con, entry_id)
+        con.execute(
+            "UPDATE ops SET status = ?, base_ver = NULL, error = NULL, claim = NULL, claim_ts = NULL WHERE id = ?",
+            (STATUS_PENDING, entry_id),
+        )
+    if tenant is not None:
+        db_core.bump_ledger_version(tenant)
+
+
+# -----------------------------
+# 再送（まとめて1トランザクション）
+# -----------------------------
+def replay_once(batch: int | None = None) -> dict[str, int]:
+    """
+    未送信をまとめて DB へ
+    - 成功: ジャーナルから削除 / 競合: status=conflict で残す
+    - 接続エラー: 何も変えずに例外（次回また試す）
+    - 戻り値: {"sent": n, "conflict": n}
+    """
+    batch = batch or int(os.getenv("JOURNAL_BATCH") or 200)
+    if not os.path.exists(_path()):
+        return {"sent": 0, "conflict": 0}
+    with _LOCK:
+        return _replay_locked(batch)
+
+
+def claim(batch: int, token: str | None = None) -> tuple[str, list[dict]]:
+    """
+    未送信を batch 件まで取り分にする（別プロセスと同じ行を取らない）
+    - 取るのは 誰も取っていない / 期限切れ（落ちたプロセス）の行だけ
+    - 同じ日付の前の操作が別プロセスで送信中なら、その後ろの行は取らない（順序を守る）
+    - 戻り値: (取り分の印, 取った行)
+    """
+    token = token or f"{os.getpid()}-{uuid.uuid4().hex}"
+    now = time.time()
+    with _db() as con, _tx(con):
+        con.execute(
+            """
+            UPDATE ops SET claim = ?, claim_ts = ? WHERE id IN (
+                SELECT o.id FROM ops o
+                 WHERE o.status = ? AND (o.claim IS NULL OR o.claim_ts < ?)
+                   AND NOT EXISTS (
+                       SELECT 1 FROM ops p
+                        WHERE p.tenant = o.tenant AND p.date_key = o.date_key AND p.id < o.id
+                          AND p.status = ? AND p.claim IS NOT NULL AND p.claim_ts >= ?
+                   )
+                 ORDER BY o.id LIMIT ?
+            )
+            """,
+            (token, now, STATUS_PENDING, now - _claim_ttl(), STATUS_PENDING, now - _claim_ttl(), batch),
+        )
+        todo = _rows(con.execute("SELECT * FROM ops WHERE claim = ? ORDER BY id", (token,)))
+    return token, todo
+
+
+def release(token: str) -> None:
+    """送れなかった取り分を戻す（次回どのプロセスでも取れる）"""
+    with _db() as con, _tx(con):
+        con.execute("UPDATE ops SET claim = NULL, claim_ts = NULL WHERE claim = ?", (token,))
+
+
+def _replay_locked(batch: int) -> dict[str, int]:
+    token, todo = claim(batch)
+    if not todo:
+        return {"sent": 0, "conflict": 0}
+
+    done, conflicts = [], []
+    try:
+        db_core.init_db()
+        db_core.ensure_year_partitions(db_core.years_of([e["date_key"] for e in todo]))
+
+        with db_core.connect() as pcon:
+            with pcon.cursor() as cur:
+                db_core.set_source(cur, "journal")
+                for e in todo:
+                    if e["op"] == "upsert":
+                        ok = db_core.upsert_day_if_ver(cur, e["tenant"], e["row"] or {}, e["base_ver"]) is not None
+                    else:
+                        ok = db_core.delete_day_if_ver(cur, e["tenant"], e["date_key"], e["base_ver"])
+                    (done if ok else conflicts).append(e)
+            pcon.commit()
+    except BaseException:
+        release(token)
+        raise
+
+    # 取り分の印つきで更新（期限切れで別プロセスに取り直された行は触らない）
+    with _db() as con, _tx(con):
+        con.executemany("DELETE FROM ops WHERE id = ? AND claim = ?", [(e["id"], token) for e in done])
+        con.executemany(
+            "UPDATE ops SET status = ?, error = ?, claim = NULL, claim_ts = NULL WHERE id = ? AND claim = ?",
+            [(STATUS_CONFLICT, "DB側が先に更新されています", e["id"], token) for e in conflicts],
+        )
+
+    # 送れた分は DB に、競合は未送信の重ね表示から外れるので、どちらも版を上げる
+    for tenant in {e["tenant"] for e in done + conflicts}:
+        db_core.bump_ledger_version(tenant)
+    if done:
+        scheduler.trigger("rollups")
+    return {"sent": len(done), "conflict": len(conflicts)}
+
+
+def _replay_loop(interval: float):
+    while True:
+        time.sleep(interval * random.uniform(0.8, 1.2))
+        try:
+            while True:
+                r = replay_once()
+                if r["sent"] or r["conflict"]:
+                    sys.stderr.write(f"[JOURNAL] replayed sent={r['sent']} conflict={r['conflict']}\n"); sys.stderr.flush()
+                if r["sent"] + r["conflict"] == 0:
+                    break
+        except Exception as e:
+            # オフライン中は黙って次回へ（接続以外の失敗はログに出す）
+            if not db_core.is_connection_error(e):
+                sys.stderr.write(f"[JOURNAL] replay failed: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+
+
+def start_replayer() -> None:
+    """プロセスで1回だけ再送スレッドを開始"""
+    global _REPLAYER
+    with _LOCK:
+        if _REPLAYER is not None:
+            return
+        interval = float(os.getenv("JOURNAL_REPLAY_SEC") or 15)
+        _REPLAYER = threading.Thread(target=_replay_loop, args=(interval,), name="journal-replayer", daemon=True)
+    _REPLAYER.start()
@@ -0,0 +1,632 @@
+# ledger_core.py
+"""
+台帳の分析ロジック（pandas のみ / st は使わない）
+- parse_ledger: DB の TEXT 台帳（またはコンパクト台帳）→ 日次の数値フレーム（DatetimeIndex）
+- compact_ledger / expand_ledger: プロセス内で共有する型付きの台帳 ⇔ TEXT 台帳
+- 画面側はこれをテナント + 版ごとにキャッシュして各ビューで使い回す
+"""
+import calendar
+import json
+import math
+import re
+import unicodedata
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from db_core import CLIENT_COLS, COLUMNS
+
+# 数値フレームの列（売上/時間 + 取引先）
+SALES, HOURS = "sales", "hours"
+
+
+def parse_ledger(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    TEXT 台帳を日次の数値フレームにする
+    - index: 日付（datetime64 / 昇順 / 重複なし）。日付が不正な行は捨てる
+    - 列: sales / hours / CLIENT_COLS（空欄・不正値は 0）
+    """
+    cols = [SALES, HOURS, *CLIENT_COLS]
+    if df is None or df.empty:
+        return pd.DataFrame(columns=cols, index=pd.DatetimeIndex([], name="日付"), dtype="float64")
+
+    if is_compact(df):
+        # コンパクト台帳は数値化済み（時間は分）
+        out = pd.DataFrame(
+            {
+                SALES: df["合計売上"].to_numpy(dtype="float64"),
+                HOURS: df["合計h"].to_numpy(dtype="float64") / 60,
+                **{c: df[c].to_numpy(dtype="float64") for c in CLIENT_COLS},
+            },
+            index=pd.DatetimeIndex(df["日付"], name="日付"),
+        )
+        out = out[out.index.notna()]
+        return out[~out.index.duplicated(keep="last")].sort_index()
+
+    idx = pd.to_datetime(df["日付"], errors="coerce")
+    src = {SALES: "合計売上", HOURS: "合計h", **{c: c for c in CLIENT_COLS}}
+    out = pd.DataFrame(
+        {k: pd.to_numeric(df[v], errors="coerce").to_numpy() if v in df.columns else 0.0 for k, v in src.items()},
+        index=pd.DatetimeIndex(idx, name="日付"),
+    ).fillna(0.0).astype("float64")
+    out = out[out.index.notna()]
+    out = out[~out.index.duplicated(keep="last")]
+    return out.sort_index()
+
+
+# -----------------------------
+# トレンド（移動合計 7日 / 30日 → 画面解像度へ間引き）
+# -----------------------------
+TREND_WINDOWS = (7, 30)
+# 表示範囲（日数 / None = 全期間）
+TREND_ZOOMS = {"3か月": 92, "1年": 366, "全期間": None}
+
+
+def pick_bucket(n_days: int, max_points: int = 160) -> str:
+    """点の数が max_points 前後に収まる粒度（D / W / M）"""
+    if n_days <= max_points:
+        return "D"
+    if n_days / 7 <= max_points:
+        return "W"
+    return "M"
+
+
+def trend_frame(parsed: pd.DataFrame, zoom_days: int | None = None, max_points: int = 160) -> pd.DataFrame:
+    """
+    売上/時間/時給の移動合計（7日 / 30日）を表示範囲に切り出して間引く
+    - 休みの日は 0 として暦日で移動（窓の計算は全期間で行ってから切り出す）
+    - 間引きは各バケット末日の値（移動合計はもともと平滑化済みなので末日で十分）
+    - 戻り値: index=日付, 列=sales_7 / hours_7 / hourly_7 / sales_30 / ...
+    """
+    if parsed.empty:
+        return pd.DataFrame()
+
+    daily = parsed[[SALES, HOURS]].resample("D").sum()
+    cols = {}
+    for w in TREND_WINDOWS:
+        roll = daily.rolling(w, min_periods=1).sum()
+        s, h = roll[SALES].to_numpy(), roll[HOURS].to_numpy()
+        cols[f"sales_{w}"] = s
+        cols[f"hours_{w}"] = h
+        cols[f"hourly_{w}"] = np.divide(s, h, out=np.full_like(s, np.nan), where=h > 0)
+    out = pd.DataFrame(cols, index=daily.index)
+
+    if zoom_days:
+        out = out[out.index > out.index[-1] - pd.Timedelta(days=zoom_days)]
+
+    bucket = pick_bucket(len(out), max_points)
+    if bucket == "D":
+        return out
+    rule = "W-SUN" if bucket == "W" else "ME"
+    return out.resample(rule).last()
+
+
+# -----------------------------
+# 取引先ミックス（月 × 取引先 の売上行列）
+#   - 行列はテナント + 版ごとに1回だけ作る
+#   - 1日分の保存/削除は、その日の旧値と新値の差分だけ該当月に足す（全件を集計し直さない）
+# -----------------------------
+def client_matrix(parsed: pd.DataFrame) -> pd.DataFrame:
+    """index=月（YYYY-MM）, 列=CLIENT_COLS の売上合計"""
+    if parsed.empty:
+        return pd.DataFrame(columns=list(CLIENT_COLS), dtype="float64").rename_axis("月")
+    m = parsed[list(CLIENT_COLS)].groupby(parsed.index.strftime("%Y-%m")).sum()
+    return m.rename_axis("月")
+
+
+def apply_day_change(days: pd.DataFrame, matrix: pd.DataFrame, date_key: str, row: dict | None) -> None:
+    """
+    1日分の変更を取引先の日次値 days（index=日付, 列=CLIENT_COLS）と行列にその場で反映
+    - row=None は削除
+    """
+    ts = pd.to_datetime(date_key, errors="coerce")
+    if pd.isna(ts):
+        return
+    cols = list(CLIENT_COLS)
+    old = days.loc[ts, cols].to_numpy(dtype="float64") if ts in days.index else np.zeros(len(cols))
+    new = (
+        pd.to_numeric(pd.Series([row.get(c, "") for c in cols]), errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+        if row is not None else np.zeros(len(cols))
+    )
+    if row is None:
+        days.drop(index=ts, inplace=True, errors="ignore")
+    else:
+        days.loc[ts, cols] = new
+
+    month = ts.strftime("%Y-%m")
+    if month not in matrix.index:
+        matrix.loc[month, cols] = 0.0
+        matrix.sort_index(inplace=True)
+    matrix.loc[month, cols] = matrix.loc[month, cols].to_numpy(dtype="float64") + (new - old)
+
+
+def client_mix(matrix: pd.DataFrame, month: str) -> pd.DataFrame:
+    """
+    指定月の取引先別：売上 / シェア / 前月差 / 順位（売上0の取引先は除く）
+    """
+    if matrix.empty or month not in matrix.index:
+        return pd.DataFrame(columns=["取引先", "売上", "シェア", "前月差", "順位"])
+    cur = matrix.loc[month]
+    prev_month = (pd.Period(month, freq="M") - 1).strftime("%Y-%m")
+    prev = matrix.loc[prev_month] if prev_month in matrix.index else pd.Series(0.0, index=matrix.columns)
+    total = float(cur.sum())
+    out = pd.DataFrame({
+        "取引先": matrix.columns,
+        "売上": cur.to_numpy(),
+        "シェア": cur.to_numpy() / total if total > 0 else 0.0,
+        "前月差": (cur - prev).to_numpy(),
+        "順位": cur.rank(ascending=False, method="min").to_numpy(),
+    })
+    out = out[out["売上"] != 0].sort_values("順位")
+    return out.astype({"売上": "int64", "前月差": "int64", "順位": "int64"}).reset_index(drop=True)
+
+
+# -----------------------------
+# 月末着地予測（曜日 × 季節 の日給プロファイル）
+#   - プロファイルは版ごとに1回だけ作る: shape (2季節, 7曜日, 3) = 平均 / 分散 / 日数
+#   - 休みの日も 0円 として暦日で数える（稼働日だけだと着地を高く見積もるため）
+#   - 予測は残り日数ぶんプロファイルを引くだけ（履歴は見ない）
+# -----------------------------
+WINTER_MONTHS = (12, 1, 2, 3)
+PROFILE_MIN_DAYS = 4   # これ未満のセルは季節全体の値で代用
+
+
+def season_index(month: int) -> int:
+    """0 = 夏（4〜11月） / 1 = 冬（12〜3月）"""
+    return 1 if month in WINTER_MONTHS else 0
+
+
+def earnings_profile(parsed: pd.DataFrame) -> np.ndarray:
+    prof = np.zeros((2, 7, 3), dtype="float64")
+    if parsed.empty:
+        return prof
+    daily = parsed[SALES].resample("D").sum()
+    v = daily.to_numpy(dtype="float64")
+    cell = np.where(daily.index.month.isin(WINTER_MONTHS), 7, 0) + daily.index.weekday.to_numpy()
+    n = np.bincount(cell, minlength=14).astype("float64")
+    s1 = np.bincount(cell, weights=v, minlength=14)
+    s2 = np.bincount(cell, weights=v * v, minlength=14)
+
+    # 片方の季節に履歴が無ければもう片方の季節で代用
+    for season in (0, 1):
+        sl, other = slice(season * 7, season * 7 + 7), slice((1 - season) * 7, (1 - season) * 7 + 7)
+        if n[sl].sum() == 0:
+            n[sl], s1[sl], s2[sl] = n[other], s1[other], s2[other]
+
+    # 日数の少ないセル（曜日）は季節全体で代用
+    for season in (0, 1):
+        sl = slice(season * 7, season * 7 + 7)
+        sn, ss1, ss2 = n[sl].sum(), s1[sl].sum(), s2[sl].sum()
+        few = n[sl] < PROFILE_MIN_DAYS
+        n[sl] = np.where(few, sn, n[sl])
+        s1[sl] = np.where(few, ss1, s1[sl])
+        s2[sl] = np.where(few, ss2, s2[sl])
+
+    mean = np.divide(s1, n, out=np.zeros(14), where=n > 0)
+    var = np.divide(s2, n, out=np.zeros(14), where=n > 0) - mean ** 2
+    prof[..., 0] = mean.reshape(2, 7)
+    prof[..., 1] = np.maximum(var, 0.0).reshape(2, 7)
+    prof[..., 2] = n.reshape(2, 7)
+    return prof
+
+
+def forecast_month(profile: np.ndarray, today: date, actual: float, target: float) -> dict:
+    """
+    当月の着地予測（明日〜月末をプロファイルで積む / 日ごとは独立とみなして正規近似）
+    - 戻り値: expected（着地見込み）/ low / high（おおよそ 80% 区間）/ prob（target 到達確率）/ remain_days / basis_days
+    """
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    s = season_index(today.month)
+    mu = var = 0.0
+    basis = int(profile[s, :, 2].min()) if profile.size else 0
+    for day in range(today.day + 1, last_day + 1):
+        wd = date(today.year, today.month, day).weekday()
+        mu += profile[s, wd, 0]
+        var += profile[s, wd, 1]
+
+    sigma = math.sqrt(var)
+    expected = actual + mu
+    need = target - actual
+    if sigma > 0:
+        prob = 0.5 * math.erfc((need - mu) / (sigma * math.sqrt(2)))
+    else:
+        prob = 1.0 if mu >= need else 0.0
+    z80 = 1.2816
+    return {
+        "expected": int(round(expected)),
+        "low": int(round(max(actual, expected - z80 * sigma))),
+        "high": int(round(expected + z80 * sigma)),
+        "prob": float(prob),
+        "remain_days": last_day - today.day,
+        "basis_days": basis,
+    }
+
+
+# -----------------------------
+# CSVインポートの検証（列単位でまとめて判定 / 行ループなし）
+#   - 日付不正 / 日付重複 / 数値列の不正値 / 合計売上 ≠ 取引先合計
+#   - 自動修正できるもの: 日付の書式ゆれ（2026/1/5）・数値の「,」「円」・重複（後の行を採用）・合計売上の再計算
+# -----------------------------
+NUM_COLS = ["合計売上", "合計h", "frex h", "fresh h", "他 h", "合計時給", *CLIENT_COLS]
+IMPORT_MODES = {"reject": "中止（1件でもあれば取り込まない）", "fix": "自動修正（直せない行はスキップ）", "skip": "問題のある行をスキップ"}
+
+
+def _issue(mask: np.ndarray, col: str, msg: str, fixable: bool) -> pd.DataFrame:
+    pos = np.flatnonzero(mask)
+    return pd.DataFrame({"_pos": pos, "列": col, "内容": msg, "自動修正": fixable})
+
+
+def _to_float(a: np.ndarray) -> np.ndarray:
+    """文字列配列 → float（全部数値なら numpy の一括変換 / 混じっていれば to_numeric で NaN に）"""
+    try:
+        return a.astype("float64")
+    except ValueError:
+        return pd.to_numeric(pd.Series(a), errors="coerce").to_numpy(dtype="float64")
+
+
+def validate_import(df: pd.DataFrame) -> dict:
+    """
+    - df: CSV をそのまま（dtype=str / 空欄は ""）
+    - 戻り値:
+        errors   : 行（CSVの行番号 / ヘッダ=1行目）/ 日付 / 列 / 内容 / 自動修正 の表
+        fixed    : 自動修正を当てた全行（修正不能な値はそのまま）
+        issue    : 問題のある行（bool 配列）
+        unfixable: 自動修正しても直らない行（bool 配列）
+        dup      : 重複で捨てる行（bool 配列）
+    - 重い処理（書式ゆれの解釈 / 文字の除去）は厳密な判定で落ちた行だけに掛ける
+    """
+    n = len(df)
+    fixed = df.copy()
+    issues: list[pd.DataFrame] = []
+    unfixable = np.zeros(n, dtype=bool)
+
+    # 日付：ISO はそのまま / 書式ゆれは直す / 解釈できないものは不可
+    raw = df["日付"].to_numpy(dtype=object)
+    not_iso = pd.to_datetime(pd.Series(raw), format="%Y-%m-%d", errors="coerce").isna().to_numpy()
+    bad_date = np.zeros(n, dtype=bool)
+    fmt_date = np.zeros(n, dtype=bool)
+    if not_iso.any():
+        pos = np.flatnonzero(not_iso)
+        loose = pd.to_datetime(pd.Series(raw[pos]).astype(str).str.strip(), format="mixed", errors="coerce")
+        ok = loose.notna().to_numpy()
+        bad_date[pos[~ok]] = True
+        fmt_date[pos[ok]] = True
+        dates = raw.copy()
+        dates[pos[ok]] = loose[ok].dt.strftime("%Y-%m-%d").to_numpy()
+        fixed["日付"] = dates
+    issues += [_issue(bad_date, "日付", "日付として読めない", False), _issue(fmt_date, "日付", "日付の書式（YYYY-MM-DD に修正）", True)]
+    unfixable |= bad_date
+
+    # 日付の重複（同じ日付は後の行を採用）
+    dup = fixed["日付"].duplicated(keep="last").to_numpy() & ~bad_date
+    issues.append(_issue(dup, "日付", "日付が重複（後の行を採用）", True))
+
+    # 数値列：空欄以外だけ数値化 → 落ちた値だけ「,」「円」・空白を除いて再判定
+    nums: dict[str, np.ndarray] = {}
+    for c in [c for c in NUM_COLS if c in df.columns]:
+        s = df[c].to_numpy(dtype=object)
+        v = np.full(n, np.nan)
+        filled = s != ""
+        if filled.any():
+            v[filled] = _to_float(s[filled])
+            failed = filled & np.isnan(v)
+            if failed.any():
+                pos = np.flatnonzero(failed)
+                cleaned = pd.Series(s[pos]).astype(str).str.replace(r"[,，円\s]", "", regex=True)
+                v2 = pd.to_numeric(cleaned, errors="coerce").to_numpy(dtype="float64")
+                ok = ~np.isnan(v2) | (cleaned == "").to_numpy()
+                v[pos[ok]] = v2[ok]
+                fmt_num = np.zeros(n, dtype=bool)
+                bad_num = np.zeros(n, dtype=bool)
+                fmt_num[pos[ok]] = True
+                bad_num[pos[~ok]] = True
+                issues += [_issue(fmt_num, c, "数値の書式（, や 円 を除去）", True), _issue(bad_num, c, "数値ではない", False)]
+                unfixable |= bad_num
+                col = s.copy()
+                col[pos[ok]] = cleaned.to_numpy()[ok]
+                fixed[c] = col
+        nums[c] = v
+
+    # 合計売上 ≠ 取引先合計（取引先が1つでも入っている行だけ / 内訳なしの行は対象外）
+    clients = [c for c in CLIENT_COLS if c in nums]
+    if clients and "合計売上" in nums:
+        cv = np.vstack([nums[c] for c in clients])
+        has_breakdown = (~np.isnan(cv)).any(axis=0)
+        csum = np.nansum(cv, axis=0)
+        total = np.nan_to_num(nums["合計売上"])
+        mismatch = has_breakdown & (total != csum)
+        issues.append(_issue(mismatch, "合計売上", "取引先の合計と一致しない（取引先合計で再計算）", True))
+        if mismatch.any():
+            col = fixed["合計売上"].to_numpy(dtype=object).copy()
+            # 整数は整数の文字のまま（:g だと 1000000 → "1e+06" になる）/ 小数は桁を落とさない repr
+            col[mismatch] = ["" if x == 0 else str(int(x)) if float(x).is_integer() else repr(float(x)) for x in csum[mismatch]]
+            fixed["合計売上"] = col
+
+    errors = pd.concat(issues, ignore_index=True).sort_values(["_pos", "列"], kind="stable")
+    pos = errors["_pos"].to_numpy()
+    errors.insert(0, "行", pos + 2)
+    errors.insert(1, "日付", raw[pos])
+    issue = np.zeros(n, dtype=bool)
+    issue[pos] = True
+    return {
+        "errors": errors.drop(columns=["_pos"]).reset_index(drop=True),
+        "fixed": fixed,
+        "issue": issue,
+        "unfixable": unfixable,
+        "dup": dup,
+    }
+
+
+def resolve_import(df: pd.DataFrame, check: dict, mode: str) -> pd.DataFrame | None:
+    """
+    検証結果に沿って取り込む行を決める
+    - reject: 問題が1件でもあれば None / fix: 修正版から直せない行と重複を除く / skip: 問題のある行を除く
+    """
+    if mode == "reject":
+        return None if check["issue"].any() else df
+    if mode == "fix":
+        keep = ~check["unfixable"] & ~check["dup"]
+        return check["fixed"][keep].reset_index(drop=True)
+    return df[~check["issue"]].reset_index(drop=True)
+
+
+# -----------------------------
+# 派生列（他 h / 合計時給 / 5h+ / 警告）
+#   - 保存ボタン / CSVインポート / 全件再計算 で同じ関数を使う
+#   - 値は保存ボタンと同じ書式の文字列（0 は空欄 / 時間は float 表記 / 時給は切り捨て整数）
+# -----------------------------
+DERIVED_COLS = ["他 h", "合計時給", "5h+", "警告"]
+WARN_SALES_NO_HOURS = "⚠ 売上あり/時間0"
+
+
+def _num(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return np.nan_to_num(pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64"))
+
+
+def derive_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """合計売上 / 合計h / frex h / fresh h から派生列を作る（戻り値は DERIVED_COLS だけ / index は df と同じ）"""
+    sales, total_h = _num(df, "合計売上"), _num(df, "合計h")
+    other_h = np.maximum(0.0, total_h - _num(df, "frex h") - _num(df, "fresh h"))
+    hourly = np.floor(np.divide(sales, total_h, out=np.zeros(len(df)), where=total_h > 0)).astype("int64")
+    return pd.DataFrame({
+        "他 h": np.where(other_h == 0, "", other_h.astype(str)),
+        "合計時給": np.where(hourly == 0, "", hourly.astype(str)),
+        "5h+": np.where(total_h >= 5.0, "5h+", ""),
+        "警告": np.where((sales > 0) & (total_h <= 0), WARN_SALES_NO_HOURS, ""),
+    }, index=df.index)
+
+
+def derive_row(row: dict) -> dict:
+    """1行（dict）版"""
+    return derive_fields(pd.DataFrame([row])).iloc[0].to_dict()
+
+
+# -----------------------------
+# コンパクト台帳（プロセス内で全セッションが共有する形）
+#   - DB / アーカイブは TEXT のまま。読み込んだ後にこの形に詰めてからキャッシュする
+#   - 日付: datetime64 / 円: int32 / 時間: int32 の「分」/ 5h+・警告: 固定カテゴリ / 取引先: 疎（0 は持たない）
+#   - 型に詰めると元の文字にならないセル（"7" と "7.0" / "0" / 数値でない値 / 日付の書式 など）は
+#     RAW_COL にその行の元の文字だけを JSON で持つ → expand_ledger で元の TEXT に完全に戻る（CSV / バックアップ用）
+#   - 日付が読めない行も捨てない（日付は NaT / 末尾に並ぶ）。期間の切り出し / 数値化では対象外
+#   - 表 / CSV / レポは必要な期間だけ expand_ledger で TEXT 形に戻して使う
+# -----------------------------
+YEN_COLS = ["合計売上", "合計時給"]
+MINUTE_COLS = ["合計h", "frex h", "fresh h", "他 h"]
+FLAG_DTYPES = {
+    "5h+": pd.CategoricalDtype(["5h+"]),
+    "警告": pd.CategoricalDtype([WARN_SALES_NO_HOURS]),
+}
+CLIENT_DTYPE = pd.SparseDtype("int32", 0)
+MEMO_DTYPE = pd.StringDtype("pyarrow")
+RAW_COL = "_原文"
+
+
+def is_compact(df: pd.DataFrame) -> bool:
+    return "日付" in df.columns and pd.api.types.is_datetime64_any_dtype(df["日付"])
+
+
+def _int_cells(s: pd.Series, scale: int = 1) -> np.ndarray:
+    """TEXT セル → int32（空欄・不正値は 0 / 時間は scale=60 で分へ）"""
+    v = pd.to_numeric(s, errors="coerce").to_numpy(dtype="float64", na_value=np.nan) * scale
+    return np.clip(np.nan_to_num(np.round(v)), -2**31, 2**31 - 1).astype("int32")
+
+
+def _parse_dates(s: pd.Series) -> pd.Series:
+    """ISO はそのまま / 書式ゆれ（2026/2/3 など）も読む / 読めないものは NaT"""
+    dates = pd.to_datetime(s, format="%Y-%m-%d", errors="coerce")
+    loose = dates.isna() & s.ne("")
+    if loose.any():
+        dates[loose] = pd.to_datetime(s[loose].str.strip(), format="mixed", errors="coerce")
+    return dates
+
+
+def compact_ledger(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    TEXT 台帳 → コンパクト台帳（列は COLUMNS + RAW_COL の順）
+    - 同じ日付（文字として同じ）は後勝ち / 日付昇順（読めない日付の行は末尾に元の順で）
+    """
+    text = df.reindex(columns=COLUMNS, fill_value="")
+    text = text.astype(object).where(text.notna(), "").astype(str)
+    dates = _parse_dates(text["日付"])
+    # 残す行と並びを先に決めてから列を作る（DataFrame の take/マスクは疎配列を int64 に広げるため）
+    keep = np.flatnonzero(~text["日付"].duplicated(keep="last").to_numpy())
+    keep = keep[np.argsort(dates.to_numpy(dtype="datetime64[ns]")[keep], kind="stable")]   # NaT は末尾
+    text = text.iloc[keep]
+
+    data = {"日付": dates.to_numpy(dtype="datetime64[ns]")[keep]}
+    for c in YEN_COLS:
+        data[c] = _int_cells(text[c])
+    for c in MINUTE_COLS:
+        data[c] = _int_cells(text[c], 60)
+    for c, dtype in FLAG_DTYPES.items():
+        data[c] = pd.Categorical(text[c], dtype=dtype)
+    for c in CLIENT_COLS:
+        data[c] = pd.arrays.SparseArray(_int_cells(text[c]), fill_value=0)
+    data["メモ"] = pd.array(text["メモ"], dtype=MEMO_DTYPE)
+
+    # 型から戻した文字と違うセルだけ元の文字を残す
+    canon = _canonical_text(pd.DataFrame(data, columns=COLUMNS))
+    orig = {c: text[c].to_numpy(dtype=object) for c in COLUMNS}
+    diff = {c: canon[c] != orig[c] for c in COLUMNS}
+    raw = np.full(len(text), None, dtype=object)
+    for i in np.flatnonzero(np.logical_or.reduce([diff[c] for c in COLUMNS])):
+        raw[i] = json.dumps({c: orig[c][i] for c in COLUMNS if diff[c][i]}, ensure_ascii=False)
+    data[RAW_COL] = pd.array(raw, dtype=MEMO_DTYPE)
+    return pd.DataFrame(data, columns=[*COLUMNS, RAW_COL])
+
+
+def _text_cells(v: np.ndarray) -> np.ndarray:
+    return np.where(v == 0, "", v.astype(str)).astype(object)
+
+
+def _canonical_text(cdf: pd.DataFrame) -> dict[str, np.ndarray]:
+    """型付きの値だけから作る TEXT（0 は空欄、時間は h の float 表記）"""
+    out = {"日付": cdf["日付"].dt.strftime("%Y-%m-%d").fillna("").to_numpy(dtype=object)}
+    for c in [*YEN_COLS, *CLIENT_COLS]:
+        out[c] = _text_cells(cdf[c].to_numpy(dtype="int64"))
+    for c in MINUTE_COLS:
+        out[c] = _text_cells(cdf[c].to_numpy(dtype="int64") / 60)
+    for c in FLAG_DTYPES:
+        out[c] = cdf[c].astype(object).where(cdf[c].notna(), "").to_numpy()
+    out["メモ"] = cdf["メモ"].astype(object).fillna("").to_numpy()
+    return out
+
+
+def _raw_cells(cdf: pd.DataFrame) -> dict[int, dict]:
+    """行の位置 -> 元の文字（RAW_COL がある行だけ）"""
+    if RAW_COL not in cdf.columns:
+        return {}
+    raw = cdf[RAW_COL]
+    return {int(i): json.loads(raw.iat[i]) for i in np.flatnonzero(raw.notna().to_numpy())}
+
+
+def expand_ledger(cdf: pd.DataFrame) -> pd.DataFrame:
+    """コンパクト台帳 → TEXT 台帳（画面の表 / CSV / レポ関数向け。DB にあった文字そのまま）"""
+    out = pd.DataFrame(_canonical_text(cdf), columns=COLUMNS, index=cdf.index)
+    for i, cells in _raw_cells(cdf).items():
+        for c, v in cells.items():
+            out.iat[i, out.columns.get_loc(c)] = v
+    return out
+
+
+def irregular_dates(cdf: pd.DataFrame) -> pd.DataFrame:
+    """日付が読めない / YYYY-MM-DD でない行（TEXT 形 / 読めない行は 日付 が NaT の行）"""
+    hit = cdf["日付"].isna().to_numpy().copy()
+    for i, cells in _raw_cells(cdf).items():
+        hit[i] |= "日付" in cells
+    return expand_ledger(cdf.iloc[np.flatnonzero(hit)])
+
+
+def period_rows(cdf: pd.DataFrame, period: str | int) -> pd.DataFrame:
+    """YYYY-MM（月）/ YYYY（年）の行だけ（日付昇順なので二分探索で切り出す）"""
+    period = str(period)
+    start = pd.Timestamp(period)
+    end = start + (pd.DateOffset(years=1) if len(period) == 4 else pd.DateOffset(months=1))
+    d = cdf["日付"].to_numpy()
+    return cdf.iloc[np.searchsorted(d, start.to_datetime64()):np.searchsorted(d, end.to_datetime64())]
+
+
+def day_rows(cdf: pd.DataFrame, date_keys: list[str]) -> pd.DataFrame:
+    """指定した日（YYYY-MM-DD）の行だけ TEXT 形で（無い日は飛ばす / 日付昇順）"""
+    ts = pd.to_datetime(pd.Series(date_keys, dtype=object), errors="coerce").dropna().to_numpy()
+    d = cdf["日付"].to_numpy()
+    pos = np.searchsorted(d, ts)
+    pos = np.unique(pos[(pos < len(d)) & (d[np.minimum(pos, len(d) - 1)] == ts)])
+    return expand_ledger(cdf.iloc[pos])
+
+
+def dense_clients(cdf: pd.DataFrame) -> pd.DataFrame:
+    """取引先列を密な int32 に（疎配列を扱えない Arrow へ書く時用）"""
+    return cdf.astype({c: "int32" for c in CLIENT_COLS})
+
+
+def bytes_per_row(df: pd.DataFrame) -> float:
+    return float(df.memory_usage(index=True, deep=True).sum()) / max(len(df), 1)
+
+
+# -----------------------------
+# メモ / 日付検索（3文字単位の転置インデックス）
+#   - index = {"memos": {日付: 正規化したメモ}, "grams": {3文字: {日付, ...}}}（メモが空の日も memos には入れる）
+#   - 検索語は空白区切りで AND。YYYY / YYYY-MM / YYYY-MM-DD（/ 区切り・0 埋め無しも可）は日付の前方一致
+#   - 大文字/小文字・全角/半角は区別しない（NFKC + casefold）
+#   - 保存/削除は index_put で1日ずつ差し替え（全体を作り直さない）
+# -----------------------------
+_DATE_TERM = re.compile(r"^(\d{4})(?:[-/](\d{1,2})(?:[-/](\d{1,2}))?)?$")
+
+
+def normalize_text(s) -> str:
+    return unicodedata.normalize("NFKC", str(s or "")).casefold()
+
+
+def _grams(s: str) -> set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def index_put(index: dict, date_key: str, memo: str | None) -> None:
+    """1日分を差し替え（memo=None は削除）"""
+    memos, grams = index["memos"], index["grams"]
+    old = memos.pop(date_key, None)
+    for g in _grams(old or ""):
+        ds = grams.get(g)
+        if ds is not None:
+            ds.discard(date_key)
+            if not ds:
+                del grams[g]
+    if memo is None:
+        return
+    text = normalize_text(memo)
+    memos[date_key] = text
+    for g in _grams(text):
+        grams.setdefault(g, set()).add(date_key)
+
+
+def memo_index(date_keys, memos) -> dict:
+    index = {"memos": {}, "grams": {}}
+    for d, m in zip(date_keys, memos):
+        if not isinstance(d, str):   # 日付が読めない行
+            continue
+        index_put(index, d, "" if m is None or m is pd.NA else str(m))
+    return index
+
+
+def parse_query(q: str) -> tuple[list[str], list[str]]:
+    """(メモの語, 日付の前方一致) に分ける"""
+    words, prefixes = [], []
+    for term in normalize_text(q).split():
+        m = _DATE_TERM.match(term)
+        if m:
+            prefixes.append("-".join([m.group(1), *(f"{int(x):02d}" for x in m.groups()[1:] if x)]))
+        else:
+            words.append(term)
+    return words, prefixes
+
+
+def _match(memo: str, date_key: str, words: list[str], prefixes: list[str]) -> bool:
+    return all(date_key.startswith(p) for p in prefixes) and all(w in memo for w in words)
+
+
+def search_index(index: dict, q: str, overlay: dict[str, str | None] | None = None, limit: int = 200) -> list[str]:
+    """
+    一致した日付（新しい順）
+    - overlay: インデックスより新しい日 {日付: メモ or None=削除}（未送信のジャーナル分など）
+    """
+    words, prefixes = parse_query(q)
+    if not words and not prefixes:
+        return []
+    memos, grams = index["memos"], index["grams"]
+    cands = None
+    for w in words:
+        if len(w) < 3:
+            continue
+        for g in _grams(w):
+            ds = grams.get(g, set())
+            cands = set(ds) if cands is None else cands & ds
+    if cands is None:
+        cands = memos.keys()
+    overlay = overlay or {}
+    hits = {d for d in cands if d not in overlay and _match(memos[d], d, words, prefixes)}
+    hits |= {d for d, m in overlay.items() if m is not None and _match(normalize_text(m), d, words, prefixes)}
+    return sorted(hits, reverse=True)[:limit]
@@ -0,0 +1,123 @@
+# ledger_snapshot.py
+"""
+台帳スナップショット（Arrow IPC / テナントごとに1ファイル）
+- DB から読み直すたびに書き出し（一時ファイル → os.replace で原子的に差し替え）
+- 中身はコンパクト台帳（ledger_core.compact_ledger）。取引先の疎配列は Arrow に無いので密な int32 で持つ
+- 読むときは memory_map + split_blocks で、数値列 / 取引先（密な int32 のまま）/ 日付 / 文字列列（メモ）は
+  Arrow バッファ = mmap を参照したまま pandas へ（コピーしない）
+  → 同じファイルを読んだワーカー / セッションは OS のページキャッシュを共有する
+  コピーになるのは カテゴリ列（5h+ / 警告。1行1バイト）と、読めない日付（NaT）がある時の日付列だけ
+  ファイルは版ごとに書き直すので版が違えば別のページ（古い版は app 側のキャッシュから外れた時点で手放す）
+- DB 側のチェックサム（件数 + 行ハッシュの合計）を一緒に保存し、起動直後はスナップショットで先に描画 → 裏で DB と照合
+- SNAPSHOT_DIR（既定 snapshot/）。Railway ではボリュームに置くと再デプロイ後も使える
+"""
+import os
+import sys
+import threading
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+
+import db_core
+import ledger_core
+
+STATUS_VERIFYING = "verifying"
+STATUS_OK = "ok"
+STATUS_STALE = "stale"
+
+_LOCK = threading.Lock()
+_STATUS: dict[str, str] = {}   # テナント -> 照合状態（起動直後にスナップショットを使った時だけ）
+
+# 列の持ち方を変えたら上げる（古い形のファイルは読まずに DB から作り直す）
+LAYOUT = b"compact-2"
+# 文字列列は Arrow のバッファを参照したまま pandas へ（ArrowDtype と違い to_numeric 後は通常の欠損扱い）
+_STRING_TYPES = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+
+
+def _path(tenant: str) -> str:
+    base = os.getenv("SNAPSHOT_DIR") or "snapshot"
+    return os.path.join(base, f"{quote(tenant, safe='')}.arrow")
+
+
+def write(tenant: str, df: pd.DataFrame, checksum: str) -> None:
+    path = _path(tenant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(ledger_core.dense_clients(df), preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), b"checksum": checksum.encode(), b"layout": LAYOUT}
+    )
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with pa.OSFile(tmp, "wb") as f:
+        with pa.ipc.new_file(f, table.schema) as w:
+            w.write_table(table)
+    os.replace(tmp, path)
+
+
+def read(tenant: str) -> tuple[pd.DataFrame, str] | None:
+    """(DataFrame, checksum) / 無い・壊れている・古い形の時は None"""
+    path = _path(tenant)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        meta = table.schema.metadata or {}
+        if meta.get(b"layout") != LAYOUT:
+            return None
+        # 取引先を疎配列に戻すとプライベートなコピーになるので密なまま（split_blocks: 列ごとに mmap を参照）
+        df = table.to_pandas(split_blocks=True, types_mapper=_STRING_TYPES.get)
+        return df, meta.get(b"checksum", b"").decode()
+    except (pa.ArrowInvalid, OSError) as e:
+        sys.stderr.write(f"[SNAPSHOT] unreadable {path}: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+        return None
+
+
+def publish(tenant: str, df: pd.DataFrame, checksum: str) -> pd.DataFrame:
+    """書き出して mmap で読み直したものを返す（書けない環境ではそのまま df）"""
+    try:
+        write(tenant, df, checksum)
+        snap = read(tenant)
+    except OSError as e:
+        sys.stderr.write(f"[SNAPSHOT] write failed: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+        snap = None
+    with _LOCK:
+        _STATUS[tenant] = STATUS_OK
+    return snap[0] if snap else df
+
+
+def status(tenant: str) -> str | None:
+    return _STATUS.get(tenant)
+
+
+def _verify(tenant: str, checksum: str) -> None:
+    try:
+        db_core.init_db()
+        with db_core.connect() as pcon:
+            with pcon.cursor() as cur:
+                current = db_core.ledger_checksum(cur, tenant)
+    except Exception as e:
+        # 照合できない（オフライン等）間はスナップショットのまま
+        sys.stderr.write(f"[SNAPSHOT] verify failed: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+        return
+    with _LOCK:
+        if _STATUS.get(tenant) != STATUS_VERIFYING:
+            return
+        _STATUS[tenant] = STATUS_OK if current == checksum else STATUS_STALE
+    if current != checksum:
+        # 版を上げる → 次の描画で DB から読み直して書き直す
+        db_core.bump_ledger_version(tenant)
+
+
+def open_cold(tenant: str) -> pd.DataFrame | None:
+    """
+    起動直後用：スナップショットがあればすぐ返し、裏で DB のチェックサムと照合する
+    - 一致: そのまま使い続ける / 不一致: 版を上げて次の描画で DB から
+    """
+    snap = read(tenant)
+    if snap is None:
+        return None
+    df, checksum = snap
+    with _LOCK:
+        _STATUS[tenant] = STATUS_VERIFYING
+    threading.Thread(target=_verify, args=(tenant, checksum), name="snapshot-verify", daemon=True).start()
+    return df
@@ -0,0 +1,244 @@
+# loadtest.py
+"""
+同時セッションの負荷試験（streamlit.testing の AppTest で app.py を動かす / ブラウザ不要）
+- N 人の仮想ユーザーを1プロセス内のスレッドで同時に回す（= Railway 1インスタンスに N セッション）
+  キャッシュ / DB プール / スケジューラ等はプロセスで共有されるので本番と同じ条件
+- 1人の流れ: ログイン → (日付切替 → 時間入力 → 金額入力 → 保存 → 月次レポ生成) × ラウンド数
+- ユーザーごとに別テナント（loadtest-01 …）でログインする（APP_USERS をこのスクリプトが作る）
+- 出力: 操作ごとの再描画時間（p50 / p95 / 最大）、全体のスループット（再描画/秒）、ピークメモリ（RSS）
+- DB はローカルの Postgres（SUPABASE_DB_URL）に向ける。localhost 以外は LOADTEST_ALLOW_REMOTE=1 の時だけ
+    python loadtest.py --users 8 --rounds 5
+"""
+import argparse
+import contextlib
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import date
+from urllib.parse import parse_qs, urlparse
+
+STEPS = ["login", "switch_date", "enter_hours", "enter_amount", "save", "month_report"]
+TENANT_PREFIX = "loadtest-"
+PASSWORD = "loadtest"
+
+
+def _setup_env(users: int) -> None:
+    """AppTest が app.py を読む前に、仮想ユーザー分のログイン情報を用意する"""
+    from auth_core import hash_password
+
+    encoded = hash_password(PASSWORD)
+    os.environ["APP_USERS"] = ",".join(f"{TENANT_PREFIX}{i:02d}:{encoded}" for i in range(1, users + 1))
+    os.environ.setdefault("APP_SESSION_SECRET", "loadtest")
+    os.environ.pop("DEV_NO_AUTH", None)
+
+
+def _check_db_url() -> None:
+    url = os.getenv("SUPABASE_DB_URL") or ""
+    host = urlparse(url).hostname or ""
+    if not url:
+        sys.exit("SUPABASE_DB_URL が未設定です（ローカルの Postgres を指定）")
+    if host not in ("localhost", "127.0.0.1", "::1") and os.getenv("LOADTEST_ALLOW_REMOTE") != "1":
+        sys.exit(f"ローカル以外の DB（{host}）には書き込みません（LOADTEST_ALLOW_REMOTE=1 で許可）")
+
+
+def _rss_mb() -> float:
+    """プロセスのピーク RSS（MB / Linux は KB・macOS は byte で返る）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# -----------------------------
+# AppTest を同時に回すための土台
+#   - AppTest.run は1回ごとにプロセス全体の Runtime（モック）と設定を差し替えて戻すので、
+#     そのままスレッドで並べると他人の再描画の途中で Runtime が消える
+#   - 負荷試験の間だけ Runtime / 設定の差し替えを1回にまとめ、各ユーザーは台本の実行だけ行う
+#   - コンパイル済みの台本も本番と同じく全セッションで共有（3.11 の ast.parse はスレッドを跨いで同時に呼べない）
+#   - streamlit の内部（AppTest._run）に合わせているので、streamlit を上げたら動作確認する
+# -----------------------------
+@contextlib.contextmanager
+def shared_runtime():
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1.util import patch_config_options
+
+    mock_runtime = MagicMock(spec=Runtime)
+    mock_runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    mock_runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = mock_runtime
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        Runtime._instance = None
+
+
+def _app_test_class(app_path: str):
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    script_cache = ScriptCache()
+    script_cache.get_bytecode(app_path)
+
+    class SharedRuntimeAppTest(AppTest):
+        """shared_runtime() の中で使う AppTest（Runtime / 設定の差し替えをしない）"""
+
+        def _run(self, widget_state=None, timeout=None):
+            pages = PagesManager(self._script_path, script_cache, setup_watcher=False)
+            runner = LocalScriptRunner(self._script_path, self.session_state, pages, args=self.args, kwargs=self.kwargs)
+            self._tree = runner.run(widget_state, self.query_params, timeout or self.default_timeout, self._page_hash)
+            self._tree._runner = self
+            self.query_params = parse_qs(runner.event_data[-1]["client_state"].query_string)
+            return self
+
+    return SharedRuntimeAppTest
+
+
+# -----------------------------
+# 1ユーザー分の流れ
+# -----------------------------
+class VirtualUser:
+    def __init__(self, no: int, app_cls, app_path: str, timeout: float, think: float):
+        self.app_cls = app_cls
+        self.user = f"{TENANT_PREFIX}{no:02d}"
+        self.app_path = app_path
+        self.timeout = timeout
+        self.think = think
+        self.rng = random.Random(no)
+        self.samples: list[tuple[str, float]] = []   # (操作, ms)
+        self.errors: list[str] = []
+        self.at = None
+
+    def _run(self, step: str, action=None) -> None:
+        """操作 → 再描画1回を計測（例外 / DBエラー表示は errors へ）"""
+        at = self.at
+        if action is not None:
+            action(at)
+        # 単一選択の pills が未選択(None)だと AppTest が値を組み立てられないので空にしておく
+        for bg in at.get("button_group"):
+            if bg.value is None:
+                bg.set_value([])
+        t = time.perf_counter()
+        try:
+            at.run(timeout=self.timeout)
+        except Exception as e:
+            self.errors.append(f"{step}: {type(e).__name__}: {e}")
+            return
+        self.samples.append((step, (time.perf_counter() - t) * 1000))
+        if at.exception:
+            self.errors.append(f"{step}: {at.exception[0].value}")
+        # st.error はペース判定などにも使っているので run_db の表示だけ拾う
+        for e in at.error:
+            if e.value.startswith("DBエラー"):
+                self.errors.append(f"{step}: {e.value}")
+        if self.think:
+            time.sleep(self.rng.uniform(0, self.think))
+
+    def _button(self, label: str):
+        return next(b for b in self.at.button if b.label == label)
+
+    def login(self) -> None:
+        self.at = self.app_cls(self.app_path, default_timeout=self.timeout)
+        self._run("open")
+
+        def submit(at):
+            at.text_input(key="login_username").set_value(self.user)
+            at.text_input(key="login_password").set_value(PASSWORD)
+            self._button("ログイン").click()
+
+        self._run("login", submit)
+
+    def round(self) -> None:
+        today = date.today()
+        day = today.replace(day=self.rng.randint(1, today.day))
+        hours = self.rng.choice([4, 5.5, 6, 7.5, 8])
+        amount = self.rng.randrange(8000, 30000, 500)
+
+        self._run("switch_date", lambda at: at.date_input(key="d").set_value(day))
+        self._run("enter_hours", lambda at: at.text_input(key="total_h_s").set_value(str(hours)))
+        self._run("enter_amount", lambda at: at.text_input(key="client_amount_text").set_value(str(amount)))
+        self._run("save", lambda at: self._button("保存（同日なら上書き）").click())
+        self._run("month_report", lambda at: self._button("月次レポ生成").click())
+
+    def main(self, rounds: int, start: threading.Barrier) -> None:
+        try:
+            start.wait()
+            self.login()
+            for _ in range(rounds):
+                self.round()
+        except Exception as e:
+            self.errors.append(f"aborted: {type(e).__name__}: {e}")
+
+
+# -----------------------------
+# 集計 / 表示
+# -----------------------------
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def summarize(vus: list[VirtualUser], elapsed: float, rss_before: float) -> list[dict]:
+    by_step: dict[str, list[float]] = {}
+    for vu in vus:
+        for step, ms in vu.samples:
+            by_step.setdefault(step, []).append(ms)
+    rows = []
+    for step in ["open", *STEPS]:
+        xs = by_step.get(step)
+        if xs:
+            rows.append({"操作": step, "回数": len(xs), "p50ms": _pct(xs, 50), "p95ms": _pct(xs, 95), "最大ms": max(xs)})
+    total = sum(len(vu.samples) for vu in vus)
+    print(f"{'操作':<14}{'回数':>6}{'p50ms':>10}{'p95ms':>10}{'最大ms':>10}")
+    for r in rows:
+        print(f"{r['操作']:<14}{r['回数']:>6}{r['p50ms']:>10.0f}{r['p95ms']:>10.0f}{r['最大ms']:>10.0f}")
+    print(f"ユーザー {len(vus)} / 再描画 {total} 回 / {elapsed:.1f}s / スループット {total / elapsed:.1f} 再描画/秒")
+    print(f"ピークRSS {_rss_mb():.0f}MB（開始時 {rss_before:.0f}MB）")
+    errors = [e for vu in vus for e in vu.errors]
+    if errors:
+        print(f"エラー {len(errors)} 件（先頭5件）:")
+        for e in errors[:5]:
+            print(f"  {e}")
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="app.py の同時セッション負荷試験（AppTest）")
+    ap.add_argument("--users", type=int, default=int(os.getenv("LOADTEST_USERS") or 4), help="同時ユーザー数")
+    ap.add_argument("--rounds", type=int, default=3, help="1人あたりの入力→保存→レポの回数")
+    ap.add_argument("--think", type=float, default=0.0, help="操作の間に入れる最大待ち秒（0 = 連打）")
+    ap.add_argument("--timeout", type=float, default=120.0, help="再描画1回のタイムアウト秒")
+    ap.add_argument("--app", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"))
+    args = ap.parse_args(argv)
+
+    _check_db_url()
+    _setup_env(args.users)
+    rss_before = _rss_mb()
+
+    app_path = os.path.abspath(args.app)
+    app_cls = _app_test_class(app_path)
+    vus = [VirtualUser(i, app_cls, app_path, args.timeout, args.think) for i in range(1, args.users + 1)]
+    start = threading.Barrier(len(vus) + 1)
+    threads = [threading.Thread(target=vu.main, args=(args.rounds, start), name=vu.user, daemon=True) for vu in vus]
+    with shared_runtime():
+        for th in threads:
+            th.start()
+        start.wait()
+        t = time.perf_counter()
+        for th in threads:
+            th.join()
+        elapsed = time.perf_counter() - t
+    summarize(vus, elapsed, rss_before)
+    return 1 if any(vu.errors for vu in vus) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
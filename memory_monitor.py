@@ -0,0 +1,141 @@
+# memory_monitor.py
+"""
+メモリ予算の監視（Railway はほぼメモリで課金される）
+- セッション: st.session_state のキーごとの概算サイズ（sys.getsizeof で中身までたどる。DataFrame は memory_usage(deep)）
+- プロセス: RSS と st.cache_data の関数ごとの使用量（streamlit が持つ統計。中身は pickle 済み bytes なので正確）
+- 予算を超えたら「作り直せるもの」を大きい順に、超過分が埋まるまで捨てる（何が作り直せるかは app.py が決める）
+  ディスクへの書き出しはしない（捨てるだけ。必要になったら作り直す）
+- MEMORY_TRACE=1 で tracemalloc を有効化し、確保の多い行の上位を出す（CPU / メモリを食うので調査時だけ）
+  キーごとの内訳は tracemalloc ではない（確保した行はわかってもどのキーが持っているかはわからない）
+"""
+import ctypes
+import gc
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from typing import Mapping
+
+MB = 1024 * 1024
+
+_LOCK = threading.Lock()
+_TRACING = False
+
+
+def budget_bytes(name: str, default_mb: int) -> int:
+    """環境変数の予算（MB）を bytes で（0 = 見ない）"""
+    return int(float(os.getenv(name) or default_mb) * MB)
+
+
+# -----------------------------
+# 計測
+# -----------------------------
+def sizeof(obj, _seen: set[int] | None = None) -> int:
+    """
+    概算の使用量（bytes）。同じオブジェクトは1回だけ数える
+    - sys.getsizeof で dict / list / tuple / set の中身までたどる（それ以外のオブジェクトの属性は数えない）
+    - pandas / numpy は memory_usage(deep) / nbytes（共有しているバッファも丸ごと数える）
+    """
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if hasattr(obj, "memory_usage") and hasattr(obj, "columns"):   # DataFrame
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if hasattr(obj, "memory_usage") and hasattr(obj, "dtype"):     # Series
+        return int(obj.memory_usage(index=True, deep=True))
+    if hasattr(obj, "nbytes") and hasattr(obj, "dtype"):           # ndarray
+        return int(obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(v, seen) for v in obj)
+    return size
+
+
+def session_footprint(state: Mapping) -> dict[str, int]:
+    """session_state のキー -> bytes（大きい順）"""
+    sizes = {}
+    for k in list(state.keys()):
+        try:
+            sizes[str(k)] = sizeof(state[k])
+        except (KeyError, AttributeError):
+            continue
+    return dict(sorted(sizes.items(), key=lambda kv: -kv[1]))
+
+
+def cache_footprint() -> dict[str, int]:
+    """st.cache_data の関数名 -> bytes（全セッション分の合計）"""
+    from streamlit.runtime.caching.cache_data_api import _data_caches
+
+    out: dict[str, int] = {}
+    for stats in _data_caches.get_stats().values():
+        for s in stats:
+            name = s.cache_name.rsplit(".", 1)[-1]
+            out[name] = out.get(name, 0) + s.byte_length
+    return out
+
+
+def rss_bytes() -> int:
+    """今の RSS（/proc が無い環境はピーク値）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# -----------------------------
+# 予算超過の処理
+# -----------------------------
+def pick_evictions(sizes: Mapping[str, int], over: int) -> list[str]:
+    """大きい順に、合計が超過分（over bytes）に届くまで選ぶ"""
+    out, freed = [], 0
+    for name, n in sorted(sizes.items(), key=lambda kv: -kv[1]):
+        if freed >= over or n <= 0:
+            break
+        out.append(name)
+        freed += n
+    return out
+
+
+def release() -> None:
+    """捨てた後に GC + glibc の空きを OS へ返す（返さないと RSS が下がらない）"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+# -----------------------------
+# tracemalloc（MEMORY_TRACE=1 の時だけ）
+# -----------------------------
+def start_tracing() -> None:
+    """プロセスで1回だけ tracemalloc を開始"""
+    global _TRACING
+    if os.getenv("MEMORY_TRACE") != "1":
+        return
+    with _LOCK:
+        if _TRACING:
+            return
+        tracemalloc.start(int(os.getenv("MEMORY_TRACE_FRAMES") or 1))
+        _TRACING = True
+
+
+def top_allocations(limit: int = 10) -> list[dict]:
+    """確保中のメモリが多い行（tracemalloc 無効なら空）"""
+    if not tracemalloc.is_tracing():
+        return []
+    stats = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ]).statistics("lineno")
+    return [
+        {"場所": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+         "MB": round(s.size / MB, 2), "個数": s.count}
+        for s in stats[:limit]
+    ]
@@ -0,0 +1,204 @@
+# profiler.py
+"""
+再描画ごとの CPU プロファイル（サンプリング / 使う時だけ有効化）
+- app.py の先頭で begin()、末尾で end()。その間の「上から下までの1回の再描画」を計測する
+- プロセスで1本のサンプラースレッドが、計測中のスクリプトスレッドのスタックを PROFILE_INTERVAL_MS ごとに覗く
+  （cProfile は 3.12 からプロセス全体に掛かり同時に1つしか動かせない → 他セッションの処理が混ざるので使わない）
+- 結果は PROFILE_DIR に collapsed stack 形式（speedscope / flamegraph.pl でそのまま開ける）で保存し、新しい PROFILE_KEEP 件だけ残す
+- 有効化: PROFILE=1（全セッション）/ 画面のトグル（そのセッションだけ）
+- st.rerun / st.stop で末尾まで来なかった回は、同じスレッドの次の begin() で「中断」として保存する
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+THREAD_NAME = "profiler"
+SUFFIX = ".collapsed"
+ABORTED = "aborted"
+
+_LOCK = threading.Lock()
+_WAKE = threading.Event()
+_RUNS: dict[int, "Run"] = {}   # スクリプトスレッド id -> 計測中の回
+_THREAD: threading.Thread | None = None
+
+
+def enabled_by_env() -> bool:
+    return os.getenv("PROFILE") == "1"
+
+
+def _dir() -> str:
+    return os.getenv("PROFILE_DIR") or "profiles"
+
+
+def _interval() -> float:
+    return max(1.0, float(os.getenv("PROFILE_INTERVAL_MS") or 5)) / 1000
+
+
+class Run:
+    """1回の再描画の計測（スタック -> サンプル数）"""
+
+    def __init__(self, label: str, root: str):
+        self.label = label
+        self.root = root   # 台本のファイル（そのモジュールフレームより外側 = streamlit 側は数えない）
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+
+
+def _stack(frame, root: str) -> tuple[str, ...]:
+    out = []
+    while frame is not None:
+        code = frame.f_code
+        out.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        if code.co_name == "<module>" and code.co_filename == root:
+            break
+        frame = frame.f_back
+    return tuple(reversed(out))
+
+
+def _loop():
+    while True:
+        with _LOCK:
+            if _RUNS:
+                frames = sys._current_frames()
+                for tid, run in _RUNS.items():
+                    f = frames.get(tid)
+                    if f is not None:
+                        run.stacks[_stack(f, run.root)] += 1
+                busy = True
+            else:
+                busy = False
+                _WAKE.clear()
+        if busy:
+            time.sleep(_interval())
+        else:
+            _WAKE.wait()
+
+
+def _start() -> None:
+    global _THREAD
+    with _LOCK:
+        if _THREAD is not None:
+            return
+        _THREAD = threading.Thread(target=_loop, name=THREAD_NAME, daemon=True)
+    _THREAD.start()
+
+
+# -----------------------------
+# 計測の開始 / 終了
+# -----------------------------
+def begin(label: str, enabled: bool) -> None:
+    """今のスレッドの再描画の計測を開始（前の回が閉じていなければ中断として保存）"""
+    tid = threading.get_ident()
+    with _LOCK:
+        prev = _RUNS.pop(tid, None)
+    if prev is not None:
+        _save(prev, aborted=True)
+    if not enabled:
+        return
+    _start()
+    root = sys._getframe(1).f_code.co_filename
+    with _LOCK:
+        _RUNS[tid] = Run(label, root)
+    _WAKE.set()
+
+
+def end() -> str | None:
+    """今のスレッドの計測を閉じて保存（保存したファイルのパス / 計測していなければ None）"""
+    with _LOCK:
+        run = _RUNS.pop(threading.get_ident(), None)
+    return _save(run) if run is not None else None
+
+
+def _save(run: Run, aborted: bool = False) -> str | None:
+    if not run.stacks:
+        return None
+    ms = (time.perf_counter() - run.t0) * 1000
+    stamp = datetime.fromtimestamp(run.started).strftime("%Y%m%d-%H%M%S-%f")
+    parts = [stamp, f"{ms:.0f}ms", quote(run.label, safe="").replace("_", "%5F")] + ([ABORTED] if aborted else [])
+    d = _dir()
+    path = os.path.join(d, "__".join(parts) + SUFFIX)
+    try:
+        os.makedirs(d, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for stack, n in run.stacks.items():
+                f.write(f"{';'.join(stack)} {n}\n")
+        os.replace(tmp, path)
+        keep = int(os.getenv("PROFILE_KEEP") or 20)
+        for old in sorted(x for x in os.listdir(d) if x.endswith(SUFFIX))[:-keep]:
+            os.remove(os.path.join(d, old))
+    except OSError as e:
+        sys.stderr.write(f"[PROFILE] write failed: {type(e).__name__}: {e}\n"); sys.stderr.flush()
+        return None
+    return path
+
+
+# -----------------------------
+# 一覧 / 集計（画面用）
+# -----------------------------
+def _meta(path: str) -> dict | None:
+    """ファイル名（時刻__所要ms__ラベル[__aborted]）から一覧の1行を作る"""
+    parts = os.path.basename(path)[: -len(SUFFIX)].split("__")
+    try:
+        return {
+            "path": path,
+            "時刻": datetime.strptime(parts[0], "%Y%m%d-%H%M%S-%f").strftime("%m-%d %H:%M:%S"),
+            "ms": int(parts[1].removesuffix("ms")),
+            "ラベル": unquote(parts[2]),
+            "中断": ABORTED in parts[3:],
+        }
+    except (ValueError, IndexError):
+        return None
+
+
+def list_profiles() -> list[dict]:
+    """保存済みプロファイル（新しい順）"""
+    d = _dir()
+    if not os.path.isdir(d):
+        return []
+    names = sorted((x for x in os.listdir(d) if x.endswith(SUFFIX)), reverse=True)
+    return [m for m in (_meta(os.path.join(d, x)) for x in names) if m is not None]
+
+
+def read_profile(path: str) -> bytes:
+    """ファイルの中身（他のセッションの保存で世代落ちしていたら空）"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return b""
+
+
+def top_functions(path: str, limit: int = 25) -> list[dict]:
+    """
+    関数ごとの 累積（その関数の中にいた時間）/ 自身（その関数そのものを実行していた時間）
+    - ms はサンプル数の比率 × 再描画の所要時間（ファイル名の ms）
+    """
+    cum: Counter[str] = Counter()
+    own: Counter[str] = Counter()
+    total = 0
+    for line in read_profile(path).decode("utf-8").splitlines():
+        stack, _, n = line.rpartition(" ")
+        frames = stack.split(";")
+        n = int(n)
+        total += n
+        own[frames[-1]] += n
+        for fn in set(frames):
+            cum[fn] += n
+    if not total:
+        return []
+    wall = (_meta(path) or {}).get("ms") or total
+    return [
+        {
+            "関数": fn,
+            "累積ms": round(c / total * wall),
+            "累積%": round(c / total * 100, 1),
+            "自身ms": round(own[fn] / total * wall),
+        }
+        for fn, c in cum.most_common(limit)
+    ]
@@ -0,0 +1,186 @@
+# scheduler.py
+"""
+プロセス内のバックグラウンドスケジューラ（プロセスで1スレッド）
+- 集計の作り直し / バックアップ / 当月レポの事前計算 / 起動直後のキャッシュ温め を、誰かの再描画を待たずに回す
+- ジョブの起動: 間隔（every 秒）/ 日付が変わった直後（daily）/ 登録直後（at_start）/ trigger() で即時
+- 実行時刻には揺らぎ（jitter）を入れる（レプリカが同じ瞬間に DB へ集中しないように）
+- 同じジョブは同時に1つだけ（実行中に trigger されたら、終わった後にもう1回だけ）
+- ジョブ本体は画面要素を出さない（st のキャッシュ関数を呼ぶだけ）
+- SCHEDULER=0 で無効 / SCHEDULER_LOG=1 で実行ログ
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+THREAD_NAME = "scheduler"
+DAILY_JITTER_SEC = 300   # 日付が変わってから最大何秒ずらすか
+MAX_SLEEP_SEC = 60
+
+_LOCK = threading.Lock()
+_WAKE = threading.Event()
+_JOBS: dict[str, dict] = {}
+_THREAD: threading.Thread | None = None
+
+
+def _next_midnight(now: float) -> float:
+    d = datetime.fromtimestamp(now).date() + timedelta(days=1)
+    return datetime(d.year, d.month, d.day).timestamp() + random.uniform(0, DAILY_JITTER_SEC)
+
+
+def _next_run(job: dict, now: float) -> float:
+    cands = []
+    if job["every"]:
+        cands.append(now + job["every"] * random.uniform(1 - job["jitter"], 1 + job["jitter"]))
+    if job["daily"]:
+        cands.append(_next_midnight(now))
+    return min(cands) if cands else float("inf")
+
+
+# -----------------------------
+# 登録 / 即時実行
+# -----------------------------
+def register(name: str, fn: Callable[[], object], every: float | None = None, daily: bool = False,
+             at_start: bool = False, jitter: float = 0.1) -> None:
+    """
+    ジョブを登録（同じ名前なら関数と設定だけ差し替え、次回予定はそのまま）
+    - 画面の再実行ごとに呼んでよい（最新のコードの関数で動く）
+    """
+    now = time.time()
+    with _LOCK:
+        job = _JOBS.get(name)
+        if job is None:
+            job = _JOBS[name] = {
+                "name": name, "lock": threading.Lock(), "pending": False,
+                "last_start": None, "last_ms": None, "last_error": None, "runs": 0,
+            }
+            job.update(every=every, daily=daily, jitter=jitter)
+            job["next"] = now + random.uniform(0, 2) if at_start else _next_run(job, now)
+        job.update(fn=fn, every=every, daily=daily, jitter=jitter)
+    _WAKE.set()
+
+
+def trigger(name: str) -> None:
+    """次のループですぐ実行（実行中なら終わった後にもう1回 / 未登録なら何もしない）"""
+    with _LOCK:
+        job = _JOBS.get(name)
+        if job is None:
+            return
+        if job["lock"].locked():
+            job["pending"] = True
+        else:
+            job["next"] = time.time()
+    _WAKE.set()
+
+
+def run(name: str) -> bool:
+    """
+    今のスレッドでジョブを1回実行（画面のボタン用）
+    - 同じジョブが実行中なら待たずに False（single-flight）
+    """
+    with _LOCK:
+        job = _JOBS.get(name)
+    if job is None or not job["lock"].acquire(blocking=False):
+        return False
+    try:
+        _execute(job)
+    finally:
+        job["lock"].release()
+    return job["last_error"] is None
+
+
+def _execute(job: dict) -> None:
+    t = time.perf_counter()
+    job["last_start"] = time.time()
+    try:
+        job["fn"]()
+        job["last_error"] = None
+    except Exception as e:
+        job["last_error"] = f"{type(e).__name__}: {e}"
+        sys.stderr.write(f"[SCHED] {job['name']} failed: {job['last_error']}\n"); sys.stderr.flush()
+    job["last_ms"] = (time.perf_counter() - t) * 1000
+    job["runs"] += 1
+    if os.getenv("SCHEDULER_LOG") == "1":
+        sys.stderr.write(f"[SCHED] {job['name']} {job['last_ms']:.0f}ms\n"); sys.stderr.flush()
+
+
+def status() -> list[dict]:
+    """ジョブごとの 前回実行 / 所要 / エラー / 次回まで（画面の計測表示用）"""
+    now = time.time()
+    with _LOCK:
+        return [
+            {
+                "ジョブ": j["name"],
+                "回数": j["runs"],
+                "前回": datetime.fromtimestamp(j["last_start"]).strftime("%m-%d %H:%M:%S") if j["last_start"] else "",
+                "所要ms": round(j["last_ms"]) if j["last_ms"] is not None else None,
+                "次回まで秒": max(0, round(j["next"] - now)) if j["next"] != float("inf") else None,
+                "エラー": j["last_error"] or "",
+            }
+            for j in _JOBS.values()
+        ]
+
+
+# -----------------------------
+# ループ
+# -----------------------------
+def _loop():
+    while True:
+        now = time.time()
+        with _LOCK:
+            due = [j for j in _JOBS.values() if j["next"] <= now]
+        for job in due:
+            if not job["lock"].acquire(blocking=False):
+                continue   # 画面のボタンから実行中
+            try:
+                with _LOCK:
+                    job["pending"] = False
+                _execute(job)
+            finally:
+                job["lock"].release()
+            with _LOCK:
+                job["next"] = time.time() if job["pending"] else _next_run(job, time.time())
+
+        with _LOCK:
+            nxt = min((j["next"] for j in _JOBS.values()), default=float("inf"))
+        _WAKE.wait(max(0.0, min(MAX_SLEEP_SEC, nxt - time.time())))
+        _WAKE.clear()
+
+
+_QUIET_THREADS: list[str] = [THREAD_NAME]   # 「ScriptRunContext が無い」警告を出さないスレッド名の接頭辞
+_QUIET_INSTALLED = False
+
+
+class _NoContextWarning(logging.Filter):
+    """st を触らないスレッド（スケジューラ / 読み込みワーカー）から st のキャッシュ関数を呼んだ時の「ScriptRunContext が無い」警告は出さない"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not record.threadName.startswith(tuple(_QUIET_THREADS))
+
+
+def quiet_no_context(thread_prefix: str) -> None:
+    """thread_prefix で始まるスレッド（ThreadPoolExecutor の thread_name_prefix など）の警告も出さない"""
+    global _QUIET_INSTALLED
+    with _LOCK:
+        if thread_prefix not in _QUIET_THREADS:
+            _QUIET_THREADS.append(thread_prefix)
+        if not _QUIET_INSTALLED:
+            logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(_NoContextWarning())
+            _QUIET_INSTALLED = True
+
+
+def start_scheduler() -> None:
+    """プロセスで1回だけスケジューラスレッドを開始（ジョブは後から register で足す）"""
+    global _THREAD
+    if os.getenv("SCHEDULER") == "0":
+        return
+    quiet_no_context(THREAD_NAME)
+    with _LOCK:
+        if _THREAD is not None:
+            return
+        _THREAD = threading.Thread(target=_loop, name=THREAD_NAME, daemon=True)
+    _THREAD.start()
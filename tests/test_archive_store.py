@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+import pytest
+
+import archive_store
+from db_core import COLUMNS
+
+
+@pytest.fixture
+def arc_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _rows(*dates):
+    return pd.DataFrame([{c: "" for c in COLUMNS} | {"日付": d, "合計売上": "1000"} for d in dates], columns=COLUMNS)
+
+
+def test_delete_then_reload_does_not_resurrect_archived_row(arc_dir):
+    archive_store.write_year("t1", 2024, _rows("2024-01-05", "2024-03-02"))
+    assert sorted(archive_store.load_archive("t1")["日付"]) == ["2024-01-05", "2024-03-02"]
+
+    assert archive_store.delete_days("t1", ["2024-01-05", "2025-01-01"]) == 1
+    assert list(archive_store.load_archive("t1")["日付"]) == ["2024-03-02"]
+    # 他のテナントは触らない
+    assert archive_store.delete_days("t2", ["2024-03-02"]) == 0
+
+
+def test_delete_month_prefix_and_drop_empty_year(arc_dir):
+    archive_store.write_year("t1", 2024, _rows("2024-03-01", "2024-03-31"))
+    assert archive_store.delete_days("t1", month_prefix="2024-03") == 2
+    assert archive_store.archived_years("t1") == []
+    assert not os.listdir(archive_store.archive_dir("t1"))
+    assert archive_store.load_archive("t1").empty
+
+
+def test_write_year_merges_and_prefers_new_rows(arc_dir):
+    archive_store.write_year("t1", 2024, _rows("2024-01-05"))
+    new = _rows("2024-01-05", "2024-01-06")
+    new.loc[0, "合計売上"] = "2000"
+    assert archive_store.write_year("t1", 2024, new) == 2
+    arc = archive_store.load_archive("t1").set_index("日付")
+    assert arc.loc["2024-01-05", "合計売上"] == "2000"
@@ -12,9 +12,17 @@ import sys
 import pytest
 
 
+class _Ctx:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
 class FakeStreamlit:
     def __init__(self):
-        self.title_called = False
+        self.headings = []
         self.writes = []
         self.errors = []
         self.session_state = {}
@@ -22,9 +30,17 @@ class FakeStreamlit:
         # テスト側から注入するUI入力
         self._text_inputs = {}   # key -> value
         self._buttons = {}       # label -> bool
+        self._secrets = {}
+        self.secrets_reads = 0
+        self.sidebar = _Ctx()
+
+    @property
+    def secrets(self):
+        self.secrets_reads += 1
+        return self._secrets
 
     def title(self, *args, **kwargs):
-        self.title_called = True
+        self.headings.extend(args)
 
     def write(self, *args, **kwargs):
         self.writes.append((args, kwargs))
@@ -37,12 +53,27 @@ class FakeStreamlit:
         k = key if key is not None else label
         return self._text_inputs.get(k, "")
 
-    def button(self, label):
+    def button(self, label, key=None):
+        return bool(self._buttons.get(label, False))
+
+    def subheader(self, *args, **kwargs):
+        self.headings.extend(args)
+
+    def success(self, *args, **kwargs):
+        pass
+
+    def form(self, *args, **kwargs):
+        return _Ctx()
+
+    def form_submit_button(self, label):
         return bool(self._buttons.get(label, False))
 
     def stop(self):
         raise RuntimeError("st.stop called")
 
+    def rerun(self):
+        raise RuntimeError("st.rerun called")
+
 
 @pytest.fixture
 def fake_st(monkeypatch):
@@ -57,14 +88,18 @@ def import_auth_guard():
     return m
 
 
-def test_auth_guard_calls_title(fake_st, monkeypatch):
+def test_auth_guard_shows_login_heading(fake_st, monkeypatch):
     monkeypatch.delenv("DEV_NO_AUTH", raising=False)
+    monkeypatch.delenv("APP_USERS", raising=False)
+    monkeypatch.setenv("APP_USERNAME", "tatsu")
+    monkeypatch.setenv("APP_PASSWORD", "pass")
     auth_guard = import_auth_guard()
 
-    with pytest.raises(RuntimeError):
+    # 未送信なら見出しだけ出して止まる
+    with pytest.raises(RuntimeError, match="stop"):
         auth_guard.auth_guard()
 
-    assert fake_st.title_called is True
+    assert fake_st.headings == ["ログイン"]
 
 
 def test_dev_no_auth_bypasses_stop(fake_st, monkeypatch):
@@ -86,6 +121,7 @@ def test_already_authed_passes(fake_st, monkeypatch):
 
 def test_login_success_sets_session_and_passes(fake_st, monkeypatch):
     monkeypatch.delenv("DEV_NO_AUTH", raising=False)
+    monkeypatch.delenv("APP_USERS", raising=False)
     monkeypatch.setenv("APP_USERNAME", "tatsu")
     monkeypatch.setenv("APP_PASSWORD", "pass")
     auth_guard = import_auth_guard()
@@ -93,24 +129,139 @@ def test_login_success_sets_session_and_passes(fake_st, monkeypatch):
     # 入力値注入
     fake_st._text_inputs["login_username"] = "tatsu"
     fake_st._text_inputs["login_password"] = "pass"
-    fake_st._buttons["Login"] = True
+    fake_st._buttons["ログイン"] = True
 
-    assert auth_guard.auth_guard() is True
+    # 成功したらトークンを持たせて rerun
+    with pytest.raises(RuntimeError, match="rerun"):
+        auth_guard.auth_guard()
     assert fake_st.session_state.get("authed") is True
+    assert fake_st.session_state.get("auth_user") == "tatsu"
+
+    fake_st._buttons.clear()
+    assert auth_guard.auth_guard() is True
 
 
 def test_login_fail_shows_error_and_stops(fake_st, monkeypatch):
     monkeypatch.delenv("DEV_NO_AUTH", raising=False)
+    monkeypatch.delenv("APP_USERS", raising=False)
     monkeypatch.setenv("APP_USERNAME", "tatsu")
     monkeypatch.setenv("APP_PASSWORD", "pass")
     auth_guard = import_auth_guard()
 
     fake_st._text_inputs["login_username"] = "tatsu"
     fake_st._text_inputs["login_password"] = "WRONG"
-    fake_st._buttons["Login"] = True
+    fake_st._buttons["ログイン"] = True
 
-    with pytest.raises(RuntimeError):
+    with pytest.raises(RuntimeError, match="stop"):
         auth_guard.auth_guard()
 
     # エラー表示が出てるはず
     assert len(fake_st.errors) >= 1
+
+
+# -----------------------------
+# 複数ユーザー（ハッシュ）/ セッショントークン
+# -----------------------------
+import auth_core
+
+
+def test_hash_roundtrip_scrypt_and_pbkdf2():
+    for method in ("scrypt", "pbkdf2_sha256"):
+        encoded = auth_core.hash_password("s3cret", method=method)
+        assert encoded.startswith(method + "$")
+        assert auth_core.verify_password("s3cret", encoded) is True
+        assert auth_core.verify_password("wrong", encoded) is False
+
+    # 同じパスワードでも salt が違えば別ハッシュ
+    assert auth_core.hash_password("x") != auth_core.hash_password("x")
+    assert auth_core.verify_password("x", "broken$format") is False
+
+
+def test_credential_store_multi_user_and_legacy():
+    a = auth_core.hash_password("pa")
+    b = auth_core.hash_password("pb", method="pbkdf2_sha256")
+    env = {"APP_USERS": f"alice:{a}, bob:{b}", "APP_USERNAME": "tatsu", "APP_PASSWORD": "pass"}
+    secrets = {"auth": {"users": {"carol": auth_core.hash_password("pc")}}}
+
+    store = auth_core.load_credential_store(env, secrets)
+    assert set(store) == {"alice", "bob", "carol", "tatsu"}
+    # 平文は保持しない
+    assert "pass" not in store.values()
+
+    assert auth_core.verify_user(store, "alice", "pa")
+    assert auth_core.verify_user(store, "bob", "pb")
+    assert auth_core.verify_user(store, "carol", "pc")
+    assert auth_core.verify_user(store, "tatsu", "pass")
+    assert not auth_core.verify_user(store, "alice", "pb")
+    assert not auth_core.verify_user(store, "nobody", "pa")
+
+
+def test_token_roundtrip_tamper_and_expiry():
+    key = b"k" * 32
+    tok = auth_core.issue_token("alice", key, ttl_sec=60, now=1000)
+    assert auth_core.verify_token(tok, key, now=1030) == "alice"
+    assert auth_core.verify_token(tok, key, now=1061) is None
+    assert auth_core.verify_token(tok, b"other-key", now=1030) is None
+    assert auth_core.verify_token(tok[:-1] + ("0" if tok[-1] != "0" else "1"), key, now=1030) is None
+    assert auth_core.verify_token("", key) is None
+
+
+def test_is_admin_from_admin_users():
+    env = {"ADMIN_USERS": " alice, ,bob "}
+    assert auth_core.is_admin("alice", env) and auth_core.is_admin("bob", env)
+    assert not auth_core.is_admin("carol", env)
+    assert not auth_core.is_admin("carol", {})
+    # 認証なし（ローカル開発）は管理者 / Railway では誰でもない
+    assert auth_core.is_admin(None, {"DEV_NO_AUTH": "1"})
+    assert not auth_core.is_admin(None, {"RAILWAY_ENVIRONMENT": "production"})
+
+def test_login_issues_token_and_rerun_skips_secrets_and_hash(fake_st, monkeypatch):
+    monkeypatch.delenv("DEV_NO_AUTH", raising=False)
+    monkeypatch.delenv("APP_USERNAME", raising=False)
+    monkeypatch.delenv("APP_PASSWORD", raising=False)
+    monkeypatch.setenv("APP_USERS", f"alice:{auth_core.hash_password('pa')},bob:{auth_core.hash_password('pb')}")
+    auth_guard = import_auth_guard()
+
+    fake_st._text_inputs["login_username"] = "bob"
+    fake_st._text_inputs["login_password"] = "pb"
+    fake_st._buttons["ログイン"] = True
+
+    with pytest.raises(RuntimeError, match="rerun"):
+        auth_guard.auth_guard()
+    assert fake_st.session_state.get("auth_user") == "bob"
+    assert fake_st.session_state.get("auth_token")
+    assert fake_st.secrets_reads == 1
+
+    # 次の rerun：secrets もハッシュ検証も通らない
+    calls = []
+    monkeypatch.setattr(auth_guard, "verify_user", lambda *a: calls.append(a) or False)
+    fake_st._buttons.clear()
+    for _ in range(3):
+        assert auth_guard.auth_guard() is True
+    assert fake_st.secrets_reads == 1
+    assert calls == []
+
+
+def test_store_loaded_once_per_process(fake_st, monkeypatch):
+    monkeypatch.delenv("DEV_NO_AUTH", raising=False)
+    monkeypatch.setenv("APP_USERS", f"alice:{auth_core.hash_password('pa')}")
+    auth_guard = import_auth_guard()
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError, match="stop"):
+            auth_guard.auth_guard()
+    assert fake_st.secrets_reads == 1
+
+
+def test_tampered_token_falls_back_to_login(fake_st, monkeypatch):
+    monkeypatch.delenv("DEV_NO_AUTH", raising=False)
+    monkeypatch.setenv("APP_USERS", f"alice:{auth_core.hash_password('pa')}")
+    auth_guard = import_auth_guard()
+
+    fake_st.session_state["auth_token"] = auth_core.issue_token("alice", b"not-the-key")
+    fake_st.session_state["auth_user"] = "alice"
+
+    with pytest.raises(RuntimeError, match="stop"):
+        auth_guard.auth_guard()
+    assert "auth_token" not in fake_st.session_state
+    assert "auth_user" not in fake_st.session_state
@@ -0,0 +1,48 @@
+# tests/test_change_feed.py
+import json
+from datetime import date
+
+import change_feed
+import db_core
+import scheduler
+
+
+def _notify(tenant, dates, origin="other-process"):
+    return json.dumps({"origin": origin, "tenant": tenant, "dates": dates, "ver": 9})
+
+
+def test_notify_records_only_the_notified_days(monkeypatch):
+    triggered = []
+    monkeypatch.setattr(scheduler, "trigger", triggered.append)
+    before = db_core.ledger_version("feed-a")
+
+    assert change_feed.handle(_notify("feed-a", ["2001-01-02", "2001-01-03"]))
+    ver = db_core.ledger_version("feed-a")
+    assert ver == before + 1
+    assert db_core.day_changes("feed-a", before, ver) == [
+        ("2001-01-02", db_core.DAY_CHANGED), ("2001-01-03", db_core.DAY_CHANGED),
+    ]
+    # 当月の日が無ければ当月レポは作り直さない
+    assert triggered == ["rollups"]
+
+
+def test_notify_without_dates_is_a_full_invalidation(monkeypatch):
+    triggered = []
+    monkeypatch.setattr(scheduler, "trigger", triggered.append)
+    before = db_core.ledger_version("feed-b")
+
+    assert change_feed.handle(_notify("feed-b", None))
+    assert db_core.day_changes("feed-b", before, db_core.ledger_version("feed-b")) is None
+    assert triggered == ["rollups", "month_report"]
+
+    triggered.clear()
+    assert change_feed.handle(_notify("feed-b", [date.today().isoformat()]))
+    assert triggered == ["rollups", "month_report"]
+
+
+def test_own_notifications_are_ignored(monkeypatch):
+    monkeypatch.setattr(scheduler, "trigger", lambda name: None)
+    before = db_core.ledger_version("feed-c")
+    assert not change_feed.handle(_notify("feed-c", ["2001-01-02"], origin=db_core.ORIGIN))
+    assert not change_feed.handle("not json")
+    assert db_core.ledger_version("feed-c") == before
@@ -0,0 +1,169 @@
+# tests/test_day_window.py
+from pathlib import Path
+import sys
+import uuid
+from concurrent.futures import Future
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import pytest
+
+import db_core
+import day_window
+
+
+def _row(date_key: str, memo: str = "") -> tuple:
+    row = {c: "" for c in db_core.COLUMNS} | {"日付": date_key, "メモ": memo}
+    return (*(row[c] for c in db_core.COLUMNS), 1)
+
+
+@pytest.fixture
+def session():
+    """テナントごとに版を進められるよう、テストごとに別テナント + 窓を読んだ直後のセッション"""
+    tenant = f"win-{uuid.uuid4().hex}"
+    ver = db_core.ledger_version(tenant)
+    lo, hi = day_window.bounds("2026-02-10")
+    state = {"day_window": day_window.build(tenant, ver, lo, hi, [_row("2026-02-09", "a"), _row("2026-02-10", "b")])}
+    return tenant, state
+
+
+def _memo(win: dict, date_key: str) -> str:
+    return win["rows"][date_key][db_core.COLUMNS.index("メモ")]
+
+
+def test_window_hit(session):
+    tenant, state = session
+    ver = db_core.ledger_version(tenant)
+
+    win = day_window.usable(state, tenant, "2026-02-10", ver)
+    assert win is state["day_window"] and _memo(win, "2026-02-09") == "a"
+    # 窓の中の行が無い日 = 未入力（読み直さない）
+    assert day_window.usable(state, tenant, "2026-02-15", ver) is win
+    # 窓の外 / 別テナント は使わない
+    assert day_window.usable(state, tenant, "2026-02-18", ver) is None
+    assert day_window.usable(state, "other", "2026-02-10", ver) is None
+
+
+def test_other_writers_only_drop_their_days(session):
+    tenant, state = session
+    ver = db_core.bump_ledger_version(tenant)
+    db_core.record_day_changes(tenant, ver, [("2026-02-09", db_core.DAY_CHANGED)])
+
+    assert day_window.usable(state, tenant, "2026-02-09", ver) is None
+    assert day_window.usable(state, tenant, "2026-02-10", ver) is not None
+
+    # 差分の記録が無い版（通知に日付が無かった等）→ 窓ごと使わない
+    ver = db_core.bump_ledger_version(tenant)
+    assert day_window.usable(state, tenant, "2026-02-10", ver) is None
+
+
+def test_catch_up_after_own_save(session):
+    tenant, state = session
+    # 先に他の経路の変更（02-09）、続けて自分の保存（02-10）と削除（02-11）
+    v1 = db_core.bump_ledger_version(tenant)
+    db_core.record_day_changes(tenant, v1, [("2026-02-09", db_core.DAY_CHANGED)])
+    row = {c: None for c in db_core.COLUMNS} | {"日付": "2026-02-10", "メモ": "mine", "合計売上": 5000}
+    state["row_vers"] = {"2026-02-10": 7}
+    v2 = db_core.bump_ledger_version(tenant)
+    db_core.record_day_changes(tenant, v2, [("2026-02-10", row)])
+    day_window.apply(state, tenant, v2, [("2026-02-10", row)])
+
+    win = day_window.usable(state, tenant, "2026-02-10", v2)
+    assert win is not None and win["ver"] == v2
+    assert _memo(win, "2026-02-10") == "mine"
+    assert win["rows"]["2026-02-10"][db_core.COLUMNS.index("合計売上")] == "5000"
+    assert win["rows"]["2026-02-10"][db_core.COLUMNS.index("U")] == ""
+    assert win["rows"]["2026-02-10"][-1] == 7
+    # 他の経路で変わった日はまだ読み直しが要る
+    assert day_window.usable(state, tenant, "2026-02-09", v2) is None
+
+    v3 = db_core.bump_ledger_version(tenant)
+    db_core.record_day_changes(tenant, v3, [("2026-02-10", None)])
+    day_window.apply(state, tenant, v3, [("2026-02-10", None)])
+    assert "2026-02-10" not in win["rows"] and day_window.usable(state, tenant, "2026-02-10", v3) is win
+
+
+def test_own_save_after_unrecorded_version_drops_the_window(session):
+    tenant, state = session
+    db_core.bump_ledger_version(tenant)   # 差分の記録なし
+    ver = db_core.bump_ledger_version(tenant)
+    day_window.apply(state, tenant, ver, [("2026-02-10", {"日付": "2026-02-10"})])
+    assert "day_window" not in state
+
+
+# -----------------------------
+# 同時読み込み
+# -----------------------------
+class FakePool:
+    """投げられた仕事を記録するだけ（Future は走らせない = 取り消せる）"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append((fn, args))
+        return Future()
+
+
+def _load_ledger(tenant, ver):
+    return "ledger"
+
+
+def _fetch_window(tenant, date_key, ver):
+    return "window"
+
+
+def _no_pending(tenant, date_key):
+    return False
+
+
+def test_window_hit_starts_nothing(session):
+    tenant, state = session
+    pool = FakePool()
+    day_window.start_fetches(state, pool, tenant, "2026-02-11", db_core.ledger_version(tenant), _load_ledger, _fetch_window, _no_pending)
+    assert pool.submitted == [] and "_inflight" not in state
+
+    # 未送信のジャーナルが答える日も投げない
+    day_window.start_fetches(state, pool, tenant, "2026-03-01", 0, _load_ledger, _fetch_window, lambda t, d: True)
+    assert pool.submitted == []
+
+
+def test_window_miss_starts_both_and_hands_them_over(session):
+    tenant, state = session
+    pool = FakePool()
+    ver = db_core.ledger_version(tenant)
+    day_window.start_fetches(state, pool, tenant, "2026-03-01", ver, _load_ledger, _fetch_window, _no_pending)
+    assert pool.submitted == [(_load_ledger, (tenant, ver)), (_fetch_window, (tenant, "2026-03-01", ver))]
+
+    fut = day_window.take_inflight(state, "window", (tenant, "2026-03-01"))
+    assert fut is not None and not fut.cancelled()
+    assert day_window.take_inflight(state, "window", (tenant, "2026-03-01")) is None   # 受け取りは1回だけ
+
+
+def test_key_mismatch_cancels_the_inflight_fetch(session):
+    tenant, state = session
+    pool = FakePool()
+    ver = db_core.ledger_version(tenant)
+    day_window.start_fetches(state, pool, tenant, "2026-03-01", ver, _load_ledger, _fetch_window, _no_pending)
+    window = state["_inflight"]["window"][1]
+    ledger = state["_inflight"]["ledger"][1]
+
+    # 投げた後に版が進んだ / 別の日を選び直した → 古い読み込みは使わずに取り消す
+    assert day_window.take_inflight(state, "ledger", (tenant, ver + 1)) is None and ledger.cancelled()
+    assert day_window.take_inflight(state, "window", (tenant, "2026-03-02")) is None and window.cancelled()
+
+
+def test_new_fetches_and_rerun_end_drop_leftovers(session):
+    tenant, state = session
+    pool = FakePool()
+    ver = db_core.ledger_version(tenant)
+    day_window.start_fetches(state, pool, tenant, "2026-03-01", ver, _load_ledger, _fetch_window, _no_pending)
+    first = [fut for _key, fut in state["_inflight"].values()]
+
+    day_window.start_fetches(state, pool, tenant, "2026-04-01", ver, _load_ledger, _fetch_window, _no_pending)
+    assert all(f.cancelled() for f in first)
+    second = [fut for _key, fut in state["_inflight"].values()]
+
+    day_window.drop_inflight(state)
+    assert all(f.cancelled() for f in second) and "_inflight" not in state
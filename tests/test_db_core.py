@@ -0,0 +1,104 @@
+import psycopg2
+import pytest
+
+import db_core
+
+
+def test_filter_sql_tenant_only():
+    where, params = db_core.filter_sql("t1")
+    assert where == '"ドライバー" = %s'
+    assert params == ["t1"]
+
+
+def test_filter_sql_all_conditions_are_parameters():
+    where, params = db_core.filter_sql(
+        "t1", date_from="2026-01-01", date_to="2026-01-31", clients=("出", "U"),
+        hourly_min=1500, hourly_max=3000, flags=("5h+", "警告"),
+    )
+    assert where == (
+        '"ドライバー" = %s AND "日付" >= %s AND "日付" <= %s'
+        " AND client_bits & %s = %s AND hourly_yen >= %s AND hourly_yen <= %s AND flag_bits & %s = %s"
+    )
+    # U = bit0, 出 = bit1 / 5h+ = 1, 警告 = 2
+    assert params == ["t1", "2026-01-01", "2026-01-31", 3, 3, 1500, 3000, 3, 3]
+    # 値は SQL に埋め込まない
+    assert "2026" not in where and "1500" not in where
+
+
+def test_filter_sql_hourly_zero_is_a_condition():
+    where, params = db_core.filter_sql("t1", hourly_max=0, flags=("警告",))
+    assert where == '"ドライバー" = %s AND hourly_yen <= %s AND flag_bits & %s = %s'
+    assert params == ["t1", 0, 2, 2]
+
+
+# -----------------------------
+# サーキットブレーカー
+# -----------------------------
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setenv("DB_RETRIES", "0")
+    monkeypatch.setenv("DB_BREAKER_FAILS", "2")
+    monkeypatch.setattr(db_core, "_PROBER", object())   # 試し接続のスレッドは起こさない
+    monkeypatch.setattr(db_core, "_BREAKER", {"fails": 0, "opened_at": None, "last_error": ""})
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise psycopg2.OperationalError("connection refused")
+
+    monkeypatch.setattr(db_core, "get_pool", down)
+    return calls
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast(breaker):
+    for _ in range(2):
+        with pytest.raises(psycopg2.OperationalError):
+            with db_core.connect():
+                pass
+    assert db_core.breaker_state()["open"]
+
+    # 開いた後は接続を試さない / オフライン扱い（ジャーナルへ）になる
+    with pytest.raises(db_core.CircuitOpen) as ei:
+        with db_core.connect():
+            pass
+    assert len(breaker) == 2
+    assert db_core.is_connection_error(ei.value)
+
+
+def test_breaker_retries_with_backoff_then_counts_once(breaker, monkeypatch):
+    monkeypatch.setenv("DB_RETRIES", "2")
+    monkeypatch.setattr(db_core.time, "sleep", lambda s: None)
+    with pytest.raises(psycopg2.OperationalError):
+        with db_core.connect():
+            pass
+    assert len(breaker) == 3
+    assert db_core.breaker_state()["fails"] == 1
+    assert not db_core.breaker_state()["open"]
+
+
+# -----------------------------
+# 台帳の版 / 版ごとの変わった日
+# -----------------------------
+def test_bump_all_advances_tenants_never_bumped():
+    v_new = db_core.ledger_version("never-bumped")
+    v_old = db_core.bump_ledger_version("bumped-once")
+    db_core.bump_all_ledger_versions()
+    assert db_core.ledger_version("never-bumped") == v_new + 1
+    assert db_core.ledger_version("bumped-once") == v_old + 1
+    assert db_core.bump_ledger_version("bumped-once") == v_old + 2
+
+
+def test_day_changes_across_versions_and_gaps():
+    t = "day-changes"
+    v1 = db_core.bump_ledger_version(t)
+    db_core.record_day_changes(t, v1, [("2026-02-01", {"メモ": "a"})])
+    v2 = db_core.bump_ledger_version(t)
+    db_core.record_day_changes(t, v2, [("2026-02-02", db_core.DAY_CHANGED)])
+    assert db_core.day_changes(t, v1 - 1, v2) == [("2026-02-01", {"メモ": "a"}), ("2026-02-02", db_core.DAY_CHANGED)]
+    assert db_core.day_changes(t, v2, v2) == []
+
+    # 記録の無い版（CSV取込 / 取りこぼし）をまたぐと None = 作り直し
+    v3 = db_core.bump_ledger_version(t)
+    assert db_core.day_changes(t, v2, v3) is None
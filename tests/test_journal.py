@@ -0,0 +1,125 @@
+# tests/test_journal.py
+from pathlib import Path
+import sqlite3
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import pytest
+
+import db_core
+import journal
+
+
+@pytest.fixture
+def jpath(tmp_path, monkeypatch):
+    path = tmp_path / "journal.sqlite3"
+    monkeypatch.setenv("JOURNAL_PATH", str(path))
+    monkeypatch.delenv("JOURNAL_CLAIM_SEC", raising=False)
+    return path
+
+
+def test_connection_and_schema_once_per_process(jpath, monkeypatch):
+    opened = []
+    real_connect = sqlite3.connect
+    monkeypatch.setattr(journal.sqlite3, "connect", lambda *a, **k: opened.append(a) or real_connect(*a, **k))
+
+    journal.append("t", "upsert", "2026-02-01", {"日付": "2026-02-01"}, 3)
+    for _ in range(5):
+        assert journal.has_pending("t", "2026-02-01")
+        assert not journal.has_pending("t", "2026-02-02")
+        assert len(journal.entries("t", status=journal.STATUS_PENDING)) == 1
+    journal.append("t", "upsert", "2026-02-01", {"日付": "2026-02-01", "メモ": "x"}, 9)
+
+    assert len(opened) == 1
+    (e,) = journal.entries("t")
+    assert e["row"]["メモ"] == "x" and e["base_ver"] == 3     # まとめても元にした ver は最初のまま
+
+
+def test_claim_is_exclusive_across_claimants(jpath):
+    journal.append("t", "upsert", "2026-02-01", {"日付": "2026-02-01"}, 1)
+    journal.append("t", "delete", "2026-02-02", None, None)
+
+    _, a = journal.claim(10, token="A")
+    _, b = journal.claim(10, token="B")
+    assert [e["date_key"] for e in a] == ["2026-02-01", "2026-02-02"]
+    assert b == []
+
+    # 送れなかったら戻す → 次は別のプロセスが取れる
+    journal.release("A")
+    _, b = journal.claim(10, token="B")
+    assert len(b) == 2
+
+
+def test_expired_claim_is_taken_over(jpath, monkeypatch):
+    journal.append("t", "upsert", "2026-02-01", {"日付": "2026-02-01"}, 1)
+    journal.claim(10, token="A")
+
+    monkeypatch.setenv("JOURNAL_CLAIM_SEC", "-1")   # A は落ちたものとみなす
+    _, b = journal.claim(10, token="B")
+    assert [e["claim"] for e in b] == ["B"]
+
+
+def test_append_while_claimed_queues_behind(jpath):
+    journal.append("t", "upsert", "2026-02-01", {"日付": "2026-02-01", "メモ": "1"}, 1)
+    journal.claim(10, token="A")
+
+    # 送信中の行には混ぜない / 同じ日付の後ろの行は A が終わるまで誰も取らない
+    journal.append("t", "upsert", "2026-02-01", {"日付": "2026-02-01", "メモ": "2"}, 1)
+    assert [e["row"]["メモ"] for e in journal.entries("t")] == ["1", "2"]
+    assert journal.claim(10, token="B")[1] == []
+
+    journal.release("A")
+    assert [e["row"]["メモ"] for e in journal.claim(10, token="B")[1]] == ["1", "2"]
+
+
+def test_old_schema_gets_claim_columns(jpath):
+    con = sqlite3.connect(jpath)
+    con.execute(
+        "CREATE TABLE ops (id INTEGER PRIMARY KEY AUTOINCREMENT, tenant TEXT NOT NULL, op TEXT NOT NULL,"
+        " date_key TEXT NOT NULL, row_json TEXT, base_ver INTEGER, ts REAL NOT NULL,"
+        " status TEXT NOT NULL DEFAULT 'pending', error TEXT)"
+    )
+    con.execute("INSERT INTO ops (tenant, op, date_key, ts) VALUES ('t', 'delete', '2026-02-01', 0)")
+    con.commit()
+    con.close()
+
+    _, got = journal.claim(10, token="A")
+    assert [(e["date_key"], e["claim"]) for e in got] == [("2026-02-01", "A")]
+
+
+def test_status_changes_bump_the_ledger_version(jpath, monkeypatch):
+    journal.append("tv", "upsert", "2026-02-01", {"日付": "2026-02-01"}, 1)
+
+    # 再送で競合 → 未送信の重ね表示から外れる
+    class _Con:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self):
+            return self
+
+        def commit(self):
+            pass
+
+    monkeypatch.setattr(db_core, "init_db", lambda *a, **k: None)
+    monkeypatch.setattr(db_core, "ensure_year_partitions", lambda *a: None)
+    monkeypatch.setattr(db_core, "connect", lambda: _Con())
+    monkeypatch.setattr(db_core, "set_source", lambda *a: None)
+    monkeypatch.setattr(db_core, "upsert_day_if_ver", lambda *a: None)
+    monkeypatch.setattr(journal.scheduler, "trigger", lambda name: None)
+
+    v = db_core.ledger_version("tv")
+    assert journal.replay_once() == {"sent": 0, "conflict": 1}
+    assert db_core.ledger_version("tv") == v + 1
+
+    (e,) = journal.entries("tv", status=journal.STATUS_CONFLICT)
+    journal.force(e["id"])
+    assert db_core.ledger_version("tv") == v + 2
+    journal.discard(e["id"])
+    assert db_core.ledger_version("tv") == v + 3
+    assert journal.entries("tv") == []
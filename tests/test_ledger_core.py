@@ -0,0 +1,287 @@
+import numpy as np
+import pandas as pd
+
+import ledger_core
+
+
+def _ledger(rows):
+    return pd.DataFrame(rows, columns=["日付", "合計売上", "合計h", "U", "出"])
+
+
+def test_parse_ledger_numeric_sorted_and_drops_bad_dates():
+    df = _ledger([
+        ["2026-02-03", "12000", "5", "12000", ""],
+        ["bad", "999", "1", "", ""],
+        ["2026-02-01", "", "abc", "", "3000"],
+    ])
+    p = ledger_core.parse_ledger(df)
+
+    assert list(p.index.strftime("%Y-%m-%d")) == ["2026-02-01", "2026-02-03"]
+    assert p.loc["2026-02-01", "sales"] == 0.0
+    assert p.loc["2026-02-01", "hours"] == 0.0
+    assert p.loc["2026-02-01", "出"] == 3000.0
+    # 台帳に無い取引先列は 0
+    assert p["R"].sum() == 0.0
+
+
+def test_parse_ledger_empty():
+    p = ledger_core.parse_ledger(pd.DataFrame(columns=["日付"]))
+    assert p.empty
+    assert "sales" in p.columns
+
+
+def test_trend_frame_rolls_over_calendar_days():
+    df = _ledger([
+        ["2026-01-01", "10000", "5", "", ""],
+        ["2026-01-03", "20000", "5", "", ""],
+        ["2026-01-09", "6000", "2", "", ""],
+    ])
+    t = ledger_core.trend_frame(ledger_core.parse_ledger(df))
+
+    # 休みの日も暦日として窓に入る
+    assert len(t) == 9
+    assert t.loc["2026-01-03", "sales_7"] == 30000
+    # 01-09 の7日窓は 01-03〜01-09
+    assert t.loc["2026-01-09", "sales_7"] == 26000
+    assert t.loc["2026-01-09", "hourly_7"] == 26000 / 7
+    assert t.loc["2026-01-09", "sales_30"] == 36000
+
+
+def test_trend_frame_downsamples_long_history():
+    days = pd.date_range("2020-01-01", "2025-12-31", freq="D")
+    df = pd.DataFrame({"日付": days.strftime("%Y-%m-%d"), "合計売上": "1000", "合計h": "1"})
+    p = ledger_core.parse_ledger(df)
+
+    assert len(ledger_core.trend_frame(p, 92)) == 92
+    assert len(ledger_core.trend_frame(p, 366)) <= 60
+    assert len(ledger_core.trend_frame(p, None)) == 72
+
+
+def test_client_matrix_incremental_matches_rebuild():
+    df = _ledger([
+        ["2026-01-05", "10000", "5", "7000", "3000"],
+        ["2026-02-01", "8000", "4", "8000", ""],
+        ["2026-02-10", "5000", "2", "", "5000"],
+    ])
+    p = ledger_core.parse_ledger(df)
+    days = p[list(ledger_core.CLIENT_COLS)].copy()
+    m = ledger_core.client_matrix(p)
+
+    # 上書き / 新しい月に追加 / 削除
+    ledger_core.apply_day_change(days, m, "2026-02-01", {"日付": "2026-02-01", "U": 1000, "R": "2000"})
+    ledger_core.apply_day_change(days, m, "2026-03-02", {"日付": "2026-03-02", "出": "4000"})
+    ledger_core.apply_day_change(days, m, "2026-01-05", None)
+
+    df2 = _ledger([
+        ["2026-02-01", "", "", "1000", ""],
+        ["2026-02-10", "5000", "2", "", "5000"],
+        ["2026-03-02", "", "", "", "4000"],
+    ]).assign(R=["2000", "", ""])
+    expected = ledger_core.client_matrix(ledger_core.parse_ledger(df2))
+
+    assert m.index.tolist() == ["2026-01", "2026-02", "2026-03"]
+    assert (m.loc["2026-01"] == 0).all()
+    pd.testing.assert_frame_equal(m.loc[expected.index], expected, check_names=False)
+
+
+def test_client_mix_share_rank_and_prev_month_diff():
+    df = _ledger([
+        ["2026-01-05", "10000", "5", "6000", "4000"],
+        ["2026-02-01", "10000", "4", "2000", "8000"],
+    ])
+    m = ledger_core.client_matrix(ledger_core.parse_ledger(df))
+    mix = ledger_core.client_mix(m, "2026-02")
+
+    assert mix["取引先"].tolist() == ["出", "U"]
+    assert mix["シェア"].tolist() == [0.8, 0.2]
+    assert mix["前月差"].tolist() == [4000, -4000]
+    assert mix["順位"].tolist() == [1, 2]
+    assert ledger_core.client_mix(m, "2025-12").empty
+
+
+def test_earnings_profile_counts_rest_days_and_falls_back():
+    # 2026-06 の月曜だけ 10000（他の曜日は 0円 の休み）
+    days = pd.date_range("2026-06-01", "2026-06-30", freq="D")
+    sales = ["10000" if d.weekday() == 0 else "" for d in days]
+    df = pd.DataFrame({"日付": days.strftime("%Y-%m-%d"), "合計売上": sales, "合計h": ""})
+    prof = ledger_core.earnings_profile(ledger_core.parse_ledger(df))
+
+    assert prof.shape == (2, 7, 3)
+    assert prof[0, 0, 0] == 10000 and prof[0, 0, 1] == 0   # 夏の月曜
+    assert prof[0, 1, 0] == 0                              # 夏の火曜（休み）
+    # 冬の履歴が無いので夏で代用
+    assert prof[1, 0, 0] == 10000
+
+
+def test_forecast_month_expected_and_probability():
+    from datetime import date
+
+    prof = np.zeros((2, 7, 3))
+    prof[..., 0] = 10000
+    prof[..., 2] = 10
+    # 2026-06-20 → 残り10日 × 10000（ばらつき0）
+    fc = ledger_core.forecast_month(prof, date(2026, 6, 20), 300000, 400000)
+    assert fc["remain_days"] == 10
+    assert fc["expected"] == 400000
+    assert fc["prob"] == 1.0
+
+    prof[..., 1] = 5000.0 ** 2
+    fc = ledger_core.forecast_month(prof, date(2026, 6, 20), 300000, 400000)
+    assert abs(fc["prob"] - 0.5) < 1e-9
+    assert fc["low"] < 400000 < fc["high"]
+
+
+def _import_frame(rows):
+    cols = ["日付", "合計売上", "合計h", "U", "出"]
+    return pd.DataFrame(rows, columns=cols).reindex(columns=[*cols, "メモ"], fill_value="")
+
+
+def test_validate_import_flags_and_fixes():
+    df = _import_frame([
+        ["2026-01-01", "5000", "5", "5000", ""],     # OK
+        ["2026/1/2", "3000", "2", "3000", ""],       # 書式ゆれ
+        ["nope", "1", "1", "", ""],                  # 日付不正
+        ["2026-01-04", "1,000円", "abc", "", ""],    # 数値の書式 / 数値でない
+        ["2026-01-05", "9000", "3", "4000", "4000"], # 合計売上 ≠ 取引先合計
+        ["2026-01-01", "6000", "6", "6000", ""],     # 重複（こちらを採用）
+    ])
+    check = ledger_core.validate_import(df)
+    errs = check["errors"]
+
+    assert set(zip(errs["行"], errs["列"])) == {
+        (2, "日付"), (3, "日付"), (4, "日付"), (5, "合計売上"), (5, "合計h"), (6, "合計売上"),
+    }
+    assert check["unfixable"].tolist() == [False, False, True, True, False, False]
+    fixed = check["fixed"]
+    assert fixed.loc[1, "日付"] == "2026-01-02"
+    assert fixed.loc[3, "合計売上"] == "1000"
+    assert fixed.loc[4, "合計売上"] == "8000"
+
+
+
+def test_validate_import_fixed_total_keeps_large_and_fractional_sums():
+    df = _import_frame([
+        ["2026-01-01", "1", "5", "600000", "400000"],       # 1000000（:g だと 1e+06）
+        ["2026-01-02", "1", "5", "1000000", "234567"],      # 1234567（:g だと 1.23457e+06）
+        ["2026-01-03", "1", "5", "1000.5", "0.25"],
+    ])
+    fixed = ledger_core.validate_import(df)["fixed"]
+    assert fixed["合計売上"].tolist() == ["1000000", "1234567", "1000.75"]
+
+def test_resolve_import_modes():
+    df = _import_frame([
+        ["2026-01-01", "5000", "5", "5000", ""],
+        ["2026/1/2", "3000", "2", "3000", ""],
+        ["nope", "1", "1", "", ""],
+    ])
+    check = ledger_core.validate_import(df)
+
+    assert ledger_core.resolve_import(df, check, "reject") is None
+    assert ledger_core.resolve_import(df, check, "skip")["日付"].tolist() == ["2026-01-01"]
+    assert ledger_core.resolve_import(df, check, "fix")["日付"].tolist() == ["2026-01-01", "2026-01-02"]
+
+    clean = df.iloc[:1]
+    assert ledger_core.resolve_import(clean, ledger_core.validate_import(clean), "reject") is clean
+
+
+def test_validate_import_100k_rows_is_fast():
+    import time
+
+    n = 100_000
+    df = pd.DataFrame("", index=range(n), columns=ledger_core.NUM_COLS)
+    df.insert(0, "日付", pd.date_range("1800-01-01", periods=n).strftime("%Y-%m-%d"))
+    df["U"] = "5000"
+    df["合計売上"] = "5000"
+    df["合計h"] = "5"
+    df.loc[10, "U"] = "x"
+
+    t = time.perf_counter()
+    check = ledger_core.validate_import(df)
+    assert time.perf_counter() - t < 1.0
+    assert check["errors"][["行", "列"]].values.tolist() == [[12, "U"]]
+
+
+def test_derive_fields_frame_and_row_agree():
+    df = pd.DataFrame({
+        "合計売上": ["22000", "5000", "", "10000"],
+        "合計h": ["7", "", "3", "6.3"],
+        "frex h": ["", "", "1", "2.1"],
+        "fresh h": ["", "", "", "1.1"],
+    })
+    out = ledger_core.derive_fields(df)
+
+    assert out["他 h"].tolist() == ["7.0", "", "2.0", str(6.3 - 2.1 - 1.1)]
+    assert out["合計時給"].tolist() == ["3142", "", "", "1587"]
+    assert out["5h+"].tolist() == ["5h+", "", "", "5h+"]
+    assert out["警告"].tolist() == ["", ledger_core.WARN_SALES_NO_HOURS, "", ""]
+
+    # 保存ボタンの1行（数値型）でも同じ結果
+    row = {"合計売上": 22000, "合計h": 7.0, "frex h": "", "fresh h": ""}
+    assert ledger_core.derive_row(row) == out.iloc[0].to_dict()
+
+
+def test_compact_ledger_round_trip_and_period():
+    df = _import_frame([
+        ["2026-02-03", "12000", "6.3", "12000", ""],
+        ["2026-01-31", "22000", "7.0", "", "abc"],   # 数値でない → 数値は 0 / 文字は残す
+        ["bad", "1", "1", "", ""],                   # 日付不正 → 末尾に残す（期間 / 数値化の対象外）
+    ]).reindex(columns=ledger_core.COLUMNS, fill_value="")
+    df.loc[0, ["5h+", "メモ"]] = ["5h+", "雪"]
+    c = ledger_core.compact_ledger(df)
+
+    assert c["日付"].dt.strftime("%Y-%m-%d").fillna("NaT").tolist() == ["2026-01-31", "2026-02-03", "NaT"]
+    assert c["合計h"].tolist() == [420, 378, 60]             # 分
+    assert c["出"].tolist() == [0, 0, 0]
+    assert c["U"].dtype == ledger_core.CLIENT_DTYPE
+    assert ledger_core.bytes_per_row(c) < ledger_core.bytes_per_row(df) / 4
+
+    e = ledger_core.expand_ledger(c)
+    assert e.loc[1, ["合計売上", "合計h", "U", "出", "5h+", "メモ"]].tolist() == ["12000", "6.3", "12000", "", "5h+", "雪"]
+    assert e.loc[0, ["出", "5h+", "警告"]].tolist() == ["abc", "", ""]
+    assert ledger_core.irregular_dates(c)["日付"].tolist() == ["bad"]
+
+    assert ledger_core.period_rows(c, "2026-02")["U"].tolist() == [12000]
+    assert len(ledger_core.period_rows(c, 2026)) == 2
+    pd.testing.assert_frame_equal(ledger_core.parse_ledger(c), ledger_core.parse_ledger(df))
+
+
+def test_compact_ledger_csv_is_byte_identical_to_db_text():
+    """全データCSV（バックアップ）は DB の TEXT をそのまま書いたものと1バイトも違わない"""
+    rows = [
+        ["2025-12-31", "12000.0", "7", "", "", "", "1714", "5h+", "", "0", "", "メモ, カンマ\n改行"],
+        ["2026-01-02", "", "6.33", "2", "1.5", "2.83", "", "", "x", "-500", "99999999999", None],
+        ["2026/1/3", "8000", "3.0999999999999996", "", "", "3.1", "2580", "", "", "8000", "", ""],
+        ["2026-01-04", None, None, None, None, None, None, None, None, None, None, "雪"],
+        ["bad", "1", "1", "", "", "", "", "", "", "", "", ""],
+        ["", "2", "", "", "", "", "", "", "", "", "", ""],
+    ]
+    cols = ["日付", "合計売上", "合計h", "frex h", "fresh h", "他 h", "合計時給", "5h+", "警告", "U", "出", "メモ"]
+    df = pd.DataFrame(rows, columns=cols).reindex(columns=ledger_core.COLUMNS)
+
+    back = ledger_core.expand_ledger(ledger_core.compact_ledger(df))
+    assert back.to_csv(index=False).encode("utf-8-sig") == df.to_csv(index=False).encode("utf-8-sig")
+    assert ledger_core.irregular_dates(ledger_core.compact_ledger(df))["日付"].tolist() == ["2026/1/3", "bad", ""]
+
+
+def test_memo_index_search_incremental_and_overlay():
+    ix = ledger_core.memo_index(
+        ["2025-03-01", "2025-03-02", "2024-12-31"], ["首都高 渋滞", "ＥＴＣ 渋滞ひどい", None]
+    )
+    assert ledger_core.search_index(ix, "渋滞") == ["2025-03-02", "2025-03-01"]
+    assert ledger_core.search_index(ix, "etc") == ["2025-03-02"]          # 全角/大文字を区別しない
+    assert ledger_core.search_index(ix, "渋滞 2025/3/1") == ["2025-03-01"]  # 日付は前方一致（0 埋め無しも可）
+    assert ledger_core.search_index(ix, "2024") == ["2024-12-31"]
+    assert ledger_core.search_index(ix, "  ") == []
+
+    # 1日ずつ差し替え（古いメモの 3文字は索引から消える）
+    ledger_core.index_put(ix, "2025-03-01", "晴れ")
+    ledger_core.index_put(ix, "2024-12-31", None)
+    assert ledger_core.search_index(ix, "首都高") == []
+    assert ledger_core.search_index(ix, "2024") == []
+    # 未送信分は上乗せ（削除 / 追加）
+    assert ledger_core.search_index(ix, "渋滞", overlay={"2025-03-02": None, "2025-04-01": "渋滞"}) == ["2025-04-01"]
+
+    c = ledger_core.compact_ledger(pd.DataFrame(
+        {"日付": ["2025-03-02", "2025-03-01"], "合計売上": ["9000", "8000"], "メモ": ["a", "b"]}
+    ).reindex(columns=ledger_core.COLUMNS, fill_value=""))
+    assert ledger_core.day_rows(c, ["2025-03-02", "2025-01-01"])["合計売上"].tolist() == ["9000"]
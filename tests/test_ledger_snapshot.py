@@ -0,0 +1,91 @@
+# tests/test_ledger_snapshot.py
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import pandas as pd
+import pytest
+
+import db_core
+import ledger_core
+import ledger_snapshot
+
+
+@pytest.fixture
+def snapdir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _ledger():
+    df = pd.DataFrame(
+        [["2026-01-02", "5000", "5", "5000", "メモ"], ["2026-01-01", "7", "6.33", "", ""], ["bad", "1", "", "", ""]],
+        columns=["日付", "合計売上", "合計h", "U", "メモ"],
+    ).reindex(columns=ledger_core.COLUMNS, fill_value="")
+    return ledger_core.compact_ledger(df)
+
+
+def test_write_read_round_trip_is_mmap_backed(snapdir):
+    c = _ledger()
+    ledger_snapshot.write("t/1", c, "3:abc")
+    df, checksum = ledger_snapshot.read("t/1")
+
+    assert checksum == "3:abc"
+    pd.testing.assert_frame_equal(df, ledger_core.dense_clients(c), check_categorical=False)
+    pd.testing.assert_frame_equal(ledger_core.expand_ledger(df), ledger_core.expand_ledger(c))
+    # 数値 / 取引先は Arrow のバッファ（mmap）を参照したまま
+    for col in ["合計売上", "合計h", "U"]:
+        assert not df[col].to_numpy().flags.owndata
+    assert ledger_snapshot.read("missing") is None
+
+
+def test_read_rejects_corrupt_and_old_layout(snapdir, monkeypatch):
+    ledger_snapshot.write("t", _ledger(), "1:x")
+    path = Path(ledger_snapshot._path("t"))
+
+    layout = ledger_snapshot.LAYOUT
+    monkeypatch.setattr(ledger_snapshot, "LAYOUT", b"compact-999")
+    assert ledger_snapshot.read("t") is None
+    monkeypatch.setattr(ledger_snapshot, "LAYOUT", layout)
+    assert ledger_snapshot.read("t") is not None
+
+    path.write_bytes(path.read_bytes()[:64])
+    assert ledger_snapshot.read("t") is None
+
+
+@pytest.mark.parametrize("current, expected", [("1:x", ledger_snapshot.STATUS_OK), ("2:y", ledger_snapshot.STATUS_STALE)])
+def test_verify_checksum(snapdir, monkeypatch, current, expected):
+    class _Con:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self):
+            return self
+
+    monkeypatch.setattr(db_core, "init_db", lambda *a, **k: None)
+    monkeypatch.setattr(db_core, "connect", lambda: _Con())
+    monkeypatch.setattr(db_core, "ledger_checksum", lambda cur, tenant: current)
+
+    tenant = f"verify-{expected}"
+    ledger_snapshot._STATUS[tenant] = ledger_snapshot.STATUS_VERIFYING
+    ver = db_core.ledger_version(tenant)
+    ledger_snapshot._verify(tenant, "1:x")
+
+    assert ledger_snapshot.status(tenant) == expected
+    # 不一致なら版を上げて DB から読み直させる
+    assert db_core.ledger_version(tenant) == ver + (expected == ledger_snapshot.STATUS_STALE)
+
+
+def test_verify_offline_keeps_the_snapshot(snapdir, monkeypatch):
+    def _down(*a, **k):
+        raise OSError("down")
+
+    monkeypatch.setattr(db_core, "init_db", _down)
+    ledger_snapshot._STATUS["verify-off"] = ledger_snapshot.STATUS_VERIFYING
+    ledger_snapshot._verify("verify-off", "1:x")
+    assert ledger_snapshot.status("verify-off") == ledger_snapshot.STATUS_VERIFYING
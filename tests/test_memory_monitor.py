@@ -0,0 +1,22 @@
+import pandas as pd
+
+import memory_monitor
+
+
+def test_sizeof_counts_frames_deep_and_shared_objects_once():
+    df = pd.DataFrame({"メモ": ["x" * 1000] * 100})
+    one = memory_monitor.sizeof(df)
+    assert one > 100 * 1000
+    # 同じ DataFrame を2つのキーから参照しても2回は数えない
+    assert memory_monitor.sizeof({"a": df, "b": df}) < one * 2
+
+    sizes = memory_monitor.session_footprint({"small": 1, "big": df})
+    assert list(sizes) == ["big", "small"]
+
+
+def test_pick_evictions_largest_first_until_covered():
+    sizes = {"a": 10, "b": 50, "c": 30, "d": 0}
+    assert memory_monitor.pick_evictions(sizes, 40) == ["b"]
+    assert memory_monitor.pick_evictions(sizes, 60) == ["b", "c"]
+    assert memory_monitor.pick_evictions(sizes, 1000) == ["b", "c", "a"]
+    assert memory_monitor.pick_evictions(sizes, 0) == []
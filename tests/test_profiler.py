@@ -0,0 +1,40 @@
+import time
+
+import profiler
+
+
+def _busy(sec: float) -> None:
+    t = time.perf_counter()
+    while time.perf_counter() - t < sec:
+        sum(range(1000))
+
+
+def test_profile_saved_and_summarized(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "1")
+    profiler.begin("a__b", enabled=True)
+    _busy(0.15)
+    path = profiler.end()
+
+    profs = profiler.list_profiles()
+    assert [p["path"] for p in profs] == [path]
+    assert profs[0]["ラベル"] == "a__b" and not profs[0]["中断"]
+    top = {r["関数"].split(" ")[0]: r for r in profiler.top_functions(path)}
+    assert top["_busy"]["累積%"] > 50
+    # 計測していない時は何も残らない
+    assert profiler.end() is None
+
+
+def test_unfinished_run_saved_as_aborted_and_pruned(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "1")
+    monkeypatch.setenv("PROFILE_KEEP", "2")
+    for _ in range(3):
+        # end() まで来ない（st.rerun 相当）→ 次の begin() で中断として保存
+        profiler.begin("t", enabled=True)
+        _busy(0.03)
+    profiler.begin("t", enabled=False)
+
+    profs = profiler.list_profiles()
+    assert len(profs) == 2
+    assert all(p["中断"] for p in profs)
@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+
+import scheduler
+
+
+def test_run_is_single_flight():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+
+    scheduler.register("t_single", slow)
+    th = threading.Thread(target=scheduler.run, args=("t_single",))
+    th.start()
+    started.wait(2)
+    # 実行中は待たずに False
+    assert scheduler.run("t_single") is False
+    release.set()
+    th.join()
+    assert calls == [1]
+    assert scheduler.run("t_single") is True
+
+
+def test_register_keeps_schedule_and_records_errors():
+    def boom():
+        raise RuntimeError("x")
+
+    scheduler.register("t_err", boom, every=3600)
+    nxt = scheduler._JOBS["t_err"]["next"]
+    assert nxt > time.time() + 3000
+    # 同じ名前の再登録は関数だけ差し替え
+    scheduler.register("t_err", boom, every=3600)
+    assert scheduler._JOBS["t_err"]["next"] == nxt
+
+    assert scheduler.run("t_err") is False
+    st = {s["ジョブ"]: s for s in scheduler.status()}["t_err"]
+    assert st["回数"] == 1 and st["エラー"] == "RuntimeError: x"
+
+
+def test_no_context_warning_is_quiet_for_registered_threads():
+    scheduler.quiet_no_context("t_fetch")
+    filt = scheduler._NoContextWarning()
+
+    def _record(thread_name):
+        rec = logging.LogRecord("x", logging.WARNING, __file__, 1, "missing ScriptRunContext", None, None)
+        rec.threadName = thread_name
+        return rec
+
+    assert not filt.filter(_record(scheduler.THREAD_NAME))
+    assert not filt.filter(_record("t_fetch_0"))
+    assert filt.filter(_record("MainThread"))
+    assert any(isinstance(f, scheduler._NoContextWarning) for f in logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").filters)
@@ -0,0 +1,209 @@
+# tests/test_tenant_scope.py
+"""テナント（ドライバー）ごとの分離：SQL は必ずテナントで絞る / 版・差分・スナップショットはテナント別"""
+from pathlib import Path
+import os
+import sys
+import uuid
+from datetime import date
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import pandas as pd
+import pytest
+
+import db_core
+import ledger_core
+import ledger_snapshot
+
+
+class FakeCursor:
+    """実行した SQL と引数を記録するだけ（PREPARE なしの経路）"""
+
+    def __init__(self, rows=None):
+        self.calls = []
+        self.connection = SimpleNamespace()
+        self.rowcount = 0
+        self._rows = list(rows or [])
+
+    def execute(self, sql, params=None):
+        self.calls.append((sql, params))
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+TENANT_WHERE = f'"{db_core.TENANT_COL}" = '
+
+
+def _tenant_param(params):
+    return params[next(iter(params))] if isinstance(params, dict) else params[0]
+
+
+# -----------------------------
+# SQL はテナントで絞る
+# -----------------------------
+def test_upsert_uses_composite_key_and_tenant_first(monkeypatch):
+    monkeypatch.delenv("DB_UPSERT_FUNC", raising=False)
+    cur = FakeCursor(rows=[(1,)])
+    assert db_core.upsert_day(cur, "alice", {"日付": "2026-02-01", "メモ": "x"}) == 1
+
+    (sql, params), = cur.calls
+    assert f'ON CONFLICT ("{db_core.TENANT_COL}", "日付")' in sql
+    assert _tenant_param(params) == "alice"
+
+
+@pytest.mark.parametrize("call", [
+    lambda cur, t: db_core.delete_days(cur, t, ["2026-02-01"]),
+    lambda cur, t: db_core.delete_month(cur, t, "2026-02"),
+    lambda cur, t: db_core.select_all(cur, t),
+    lambda cur, t: db_core.select_day(cur, t, "2026-02-01"),
+    lambda cur, t: db_core.select_days(cur, t, "2026-02-01", "2026-02-07"),
+    lambda cur, t: db_core.delete_day_if_ver(cur, t, "2026-02-01", 3),
+])
+def test_reads_and_deletes_are_scoped_to_the_tenant(call):
+    cur = FakeCursor(rows=[(True,)])
+    call(cur, "alice")
+    (sql, params), = cur.calls
+    assert TENANT_WHERE in sql
+    assert _tenant_param(params) == "alice"
+
+
+def test_delete_month_bounds_the_month():
+    cur = FakeCursor()
+    db_core.delete_month(cur, "bob", "2025-12")
+    (_sql, params), = cur.calls
+    assert params == ("bob", "2025-12-%", "2025-12", "2026-01")
+
+
+def test_filter_sql_differs_only_by_tenant_param():
+    wa, pa = db_core.filter_sql("alice", date_from="2026-01-01", hourly_min=0)
+    wb, pb = db_core.filter_sql("bob", date_from="2026-01-01", hourly_min=0)
+    assert wa == wb and wa.startswith(TENANT_WHERE)
+    assert pa[0] == "alice" and pb[0] == "bob" and pa[1:] == pb[1:]
+
+
+# -----------------------------
+# 旧スキーマ（ドライバー列なし）の移行は既存行を default_tenant() に寄せる
+# -----------------------------
+@pytest.mark.parametrize("env, expected", [({}, "default"), ({"APP_TENANT": "tatsu"}, "tatsu")])
+def test_legacy_migration_assigns_default_tenant(monkeypatch, env, expected):
+    for k in ("APP_TENANT", "APP_USERNAME"):
+        monkeypatch.delenv(k, raising=False)
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+
+    cur = FakeCursor(rows=[("r",)])   # relkind = 通常テーブル（非パーティションの旧テーブル）
+    class _Con:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self):
+            return cur
+
+        def commit(self):
+            pass
+
+    monkeypatch.setattr(db_core, "connect", lambda: _Con())
+    monkeypatch.setattr(db_core, "_ensure_memo_index", lambda cur: None)
+    monkeypatch.setattr(db_core, "_SCHEMA_READY", False)
+    monkeypatch.setattr(db_core, "_KNOWN_PARTITIONS", set())
+    db_core.init_db()
+
+    migrate = [params for sql, params in cur.calls if f'ADD COLUMN "{db_core.TENANT_COL}"' in sql]
+    assert migrate == [(expected,)]
+
+
+# -----------------------------
+# プロセス内の状態はテナント別
+# -----------------------------
+def test_versions_and_day_changes_are_per_tenant():
+    a, b = f"iso-a-{uuid.uuid4().hex}", f"iso-b-{uuid.uuid4().hex}"
+    vb = db_core.ledger_version(b)
+    va = db_core.bump_ledger_version(a)
+    db_core.record_day_changes(a, va, [("2026-02-01", None)])
+
+    assert db_core.ledger_version(b) == vb
+    assert db_core.day_changes(b, vb, vb) == []
+    assert db_core.day_changes(a, va - 1, va) == [("2026-02-01", None)]
+
+
+def test_snapshots_are_per_tenant(tmp_path, monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_DIR", str(tmp_path))
+
+    def _one(memo):
+        df = pd.DataFrame([["2026-02-01", memo]], columns=["日付", "メモ"]).reindex(columns=ledger_core.COLUMNS, fill_value="")
+        return ledger_core.compact_ledger(df)
+
+    ledger_snapshot.write("alice", _one("A"), "1:a")
+    ledger_snapshot.write("al/ice", _one("B"), "1:b")   # 似た名前 / 区切り文字でも別ファイル
+    assert ledger_snapshot.read("alice")[0]["メモ"].tolist() == ["A"]
+    assert ledger_snapshot.read("al/ice")[0]["メモ"].tolist() == ["B"]
+    assert ledger_snapshot.read("bob") is None
+
+
+# -----------------------------
+# 画面のキャッシュ（Postgres があるときだけ）
+#   - 同じプロセスで2テナントの画面を動かし、片方の保存がもう片方に出ないこと
+# -----------------------------
+@pytest.mark.skipif(not os.getenv("SUPABASE_DB_URL"), reason="SUPABASE_DB_URL が無い（Postgres が要る）")
+def test_app_caches_do_not_leak_between_tenants(tmp_path, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+
+    for k, v in {
+        "DEV_NO_AUTH": "1", "SCHEDULER": "0", "DB_LISTEN": "0", "JOURNAL_PATH": str(tmp_path / "j.sqlite3"),
+        "SNAPSHOT_DIR": str(tmp_path / "snap"), "ARCHIVE_DIR": str(tmp_path / "arc"),
+        "BACKUP_DIR": str(tmp_path / "bk"), "PROFILE_DIR": str(tmp_path / "prof"),
+    }.items():
+        monkeypatch.setenv(k, v)
+    a, b = f"scope-a-{uuid.uuid4().hex[:8]}", f"scope-b-{uuid.uuid4().hex[:8]}"
+    day = date(2019, 5, 5)
+
+    def _run(at):
+        for bg in at.get("button_group"):
+            if bg.value is None:
+                bg.set_value([])
+        return at.run()
+
+    def _open(tenant):
+        monkeypatch.setenv("APP_TENANT", tenant)
+        at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=60).run()
+        at.date_input(key="d").set_value(day)
+        return _run(at)
+
+    try:
+        at = _open(a)
+        at.text_area(key="memo").input("only-in-a")
+        _run(at)
+        next(x for x in at.button if x.label.startswith("保存")).click()
+        _run(at)
+        assert not at.exception
+
+        at = _open(b)
+        assert at.text_area(key="memo").value == ""
+        at.text_input(key="memo_q").input("only-in-a")
+        _run(at)
+        assert any(c.value.startswith("0 件") for c in at.caption)
+
+        at = _open(a)
+        assert at.text_area(key="memo").value == "only-in-a"
+    finally:
+        db_core.init_db()
+        with db_core.connect() as pcon:
+            with pcon.cursor() as cur:
+                for t in (a, b):
+                    db_core.delete_days(cur, t, [day.isoformat()])
+            pcon.commit()